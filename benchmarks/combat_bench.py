@@ -0,0 +1,288 @@
+"""
+Бенчмарк и статистическая регрессия боевого движка.
+
+Замеры времени и пика памяти на ход для синтетических флотов из SHIP_PRESETS:
+    python -m benchmarks.combat_bench bench --sizes 1 10 100 1000
+
+Статистическая регрессия (до и после изменения движка):
+    python -m benchmarks.combat_bench baseline --out baseline.json
+    python -m benchmarks.combat_bench check --baseline baseline.json
+
+check сравнивает распределения точности и урона по каждому сценарию (пара пресетов)
+с сохранённым эталоном: z-тест средних и двухвыборочный тест Колмогорова-Смирнова
+по гистограмме урона. Код выхода 1 - регрессия.
+
+Залпы выборки проходят полный конвейер фаз движка, включая ракеты и перехват;
+при смене способа выборки эталон нужно пересобрать.
+"""
+import argparse
+import itertools
+import json
+import math
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models.schemas import Fleet, Module, Ship, ShipModule, ShipStatus  # noqa: E402
+from utils.combat_engine import BattleState  # noqa: E402
+from utils.constants import SHIP_SPECS, DEFAULT_BATTLE_DISTANCE  # noqa: E402
+from utils.game_mechanics import (  # noqa: E402
+    MODULE_PROTOTYPES, calculate_ship_combat_stats, generate_debris_field,
+    invalidate_combat_profile, simulate_volley
+)
+from utils.ship_presets import _PRESETS_DATA  # noqa: E402
+
+CATALOG = [
+    Module(id=i, name=m["name"], type=m["type"], weight=m["weight"], price=m["price"], stats=m["stats"])
+    for i, m in enumerate(MODULE_PROTOTYPES, start=1)
+]
+PRESET_NAMES = sorted(_PRESETS_DATA)
+
+Z_CRITICAL = 4.0            # |z| средних, выше которого сценарий считается регрессией
+KS_C_ALPHA = 1.95           # c(alpha) для KS при alpha = 0.001
+
+
+def _find_module(name_part: str):
+    for module in CATALOG:
+        if name_part.lower() in module.name.lower():
+            return module
+    return None
+
+
+def build_ship(ship_id: int, fleet_id: int, preset_name: str) -> Ship:
+    preset = _PRESETS_DATA[preset_name]
+    modules = []
+    for name_part, count in preset["loadout"]:
+        module = _find_module(name_part)
+        if module:
+            modules.append(ShipModule(id=len(modules) + 1, ship_id=ship_id, module_id=module.id,
+                                      count=count, module=module))
+    crew = SHIP_SPECS[preset["class"]][1]
+    return Ship(id=ship_id, fleet_id=fleet_id, ship_class=preset["class"].value, project=preset_name,
+                callsign=f"{preset_name}-{ship_id}", current_crew=crew, required_crew=crew,
+                status=ShipStatus.OPERATIONAL, modules=modules)
+
+
+def build_fleet(fleet_id: int, size: int, first_id: int = 1) -> List[Ship]:
+    """Синтетический флот: пресеты по кругу"""
+    presets = itertools.cycle(PRESET_NAMES)
+    return [build_ship(first_id + i, fleet_id, next(presets)) for i in range(size)]
+
+
+def _fleet(fleet_id: int) -> Fleet:
+    return Fleet(id=fleet_id, user_id=fleet_id, guild_id=0, name=f"Флот {fleet_id}", leader_name="bench")
+
+
+# --- BENCHMARKS ---
+
+def bench_battle(size: int, seed: int = 0) -> Dict[str, float]:
+    random.seed(seed)
+    attackers = build_fleet(1, size, first_id=1)
+    defenders = build_fleet(2, size, first_id=size + 1)
+    invalidate_combat_profile()
+
+    t0 = time.perf_counter()
+    battle = BattleState(_fleet(1), _fleet(2), attackers, defenders, 10, seed=seed)
+    setup_s = time.perf_counter() - t0
+
+    # Второй старт с тёплым кэшем профилей; тот же сид - тот же бой для замера памяти
+    t0 = time.perf_counter()
+    traced = BattleState(_fleet(1), _fleet(2), attackers, defenders, 10, seed=seed)
+    warm_setup_s = time.perf_counter() - t0
+
+    # Время - без tracemalloc, он сам замедляет ход
+    turns = 0
+    t0 = time.perf_counter()
+    while not battle.is_over:
+        battle.run_turn(verbose=False)
+        turns += 1
+    turn_s = (time.perf_counter() - t0) / max(turns, 1)
+
+    # Пик выделенной памяти каждого хода отдельно, сверх памяти до хода
+    peaks = []
+    tracemalloc.start()
+    while not traced.is_over:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        traced.run_turn(verbose=False)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+    tracemalloc.stop()
+
+    return {
+        "ships": size,
+        "setup_ms": setup_s * 1000,
+        "warm_setup_ms": warm_setup_s * 1000,
+        "turns": turns,
+        "turn_ms": turn_s * 1000,
+        "turn_peak_kib_max": max(peaks, default=0) / 1024,
+        "turn_peak_kib_mean": statistics.fmean(peaks) / 1024 if peaks else 0.0,
+    }
+
+
+def bench_primitives(size: int, repeat: int = 200) -> Dict[str, float]:
+    ships = build_fleet(1, size)
+    invalidate_combat_profile()
+
+    t0 = time.perf_counter()
+    stats = [calculate_ship_combat_stats(s) for s in ships]
+    profile_ms = (time.perf_counter() - t0) * 1000
+
+    target = {"callsign": "target", "evasion": 0.2}
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        simulate_volley(stats[0], target)
+    volley_us = (time.perf_counter() - t0) / repeat * 1e6
+
+    t0 = time.perf_counter()
+    generate_debris_field(ships, guaranteed_weapons=True)
+    debris_ms = (time.perf_counter() - t0) * 1000
+
+    return {"ships": size, "profiles_ms": profile_ms, "volley_us": volley_us, "debris_ms": debris_ms}
+
+
+def run_bench(sizes: List[int]) -> None:
+    print(f"{'ships':>6} {'setup ms':>10} {'warm ms':>9} {'turns':>6} {'turn ms':>9} "
+          f"{'peak KiB max':>13} {'mean':>8}")
+    for size in sizes:
+        r = bench_battle(size)
+        print(f"{r['ships']:>6} {r['setup_ms']:>10.2f} {r['warm_setup_ms']:>9.2f} {r['turns']:>6} "
+              f"{r['turn_ms']:>9.3f} {r['turn_peak_kib_max']:>13.1f} {r['turn_peak_kib_mean']:>8.1f}")
+    print()
+    print(f"{'ships':>6} {'profiles ms':>12} {'volley us':>10} {'debris ms':>10}")
+    for size in sizes:
+        r = bench_primitives(size)
+        print(f"{r['ships']:>6} {r['profiles_ms']:>12.2f} {r['volley_us']:>10.1f} {r['debris_ms']:>10.2f}")
+
+
+# --- STATISTICAL REGRESSION ---
+
+def sample_scenario(attacker: str, defender: str, volleys: int, seed: int) -> Dict[str, list]:
+    """
+    Выборка урона за залп и точности по каждому залпу для пары пресетов.
+    Залп идёт через BattleState._side_volley - те же фазы, что в бою: ствольный огонь,
+    пуск ракет, перехват ПРО и ловушками, попадания. Каждый залп - по свежему бою
+    (цель цела, ловушки полные) со своим сидом.
+    """
+    seeds = random.Random(seed)
+    a_ship, d_ship = build_ship(1, 1, attacker), build_ship(2, 2, defender)
+    max_damage = sum(w.damage * w.shots for w in calculate_ship_combat_stats(a_ship)["weapons"])
+    damage, hit_rate = [], []
+    for _ in range(volleys):
+        battle = BattleState(_fleet(1), _fleet(2), [a_ship], [d_ship], DEFAULT_BATTLE_DISTANCE,
+                             seed=seeds.getrandbits(32))
+        dmg, _ = battle._side_volley(battle.attackers, battle.defenders, None)
+        damage.append(dmg)
+        hit_rate.append(dmg / max_damage if max_damage else 0.0)
+    return {"damage": damage, "hit_rate": hit_rate}
+
+
+def summarize(samples: List[float]) -> Dict[str, object]:
+    return {
+        "n": len(samples),
+        "mean": statistics.fmean(samples),
+        "var": statistics.pvariance(samples),
+        # Урон дискретен, гистограмма компактнее сырых выборок
+        "hist": sorted(Counter(round(x, 4) for x in samples).items()),
+    }
+
+
+def ks_statistic(hist_a, hist_b) -> float:
+    """Максимальное расстояние между эмпирическими функциями распределения"""
+    a, b = dict(hist_a), dict(hist_b)
+    n_a, n_b = sum(a.values()), sum(b.values())
+    cdf_a = cdf_b = 0
+    d = 0.0
+    for x in sorted(set(a) | set(b)):
+        cdf_a += a.get(x, 0)
+        cdf_b += b.get(x, 0)
+        d = max(d, abs(cdf_a / n_a - cdf_b / n_b))
+    return d
+
+
+def scenarios():
+    armed = [p for p in PRESET_NAMES if calculate_ship_combat_stats(build_ship(1, 1, p))["weapons"]]
+    return [(a, d) for a in armed for d in PRESET_NAMES[::3]]
+
+
+def collect(volleys: int, seed: int) -> Dict[str, dict]:
+    result = {}
+    for i, (attacker, defender) in enumerate(scenarios()):
+        samples = sample_scenario(attacker, defender, volleys, seed + i)
+        result[f"{attacker}>{defender}"] = {k: summarize(v) for k, v in samples.items()}
+    return result
+
+
+def compare(baseline: Dict[str, dict], current: Dict[str, dict]) -> List[str]:
+    """Парное сравнение сценариев: z-тест средних (Уэлч) и KS по распределению урона"""
+    failures = []
+    for key, base in baseline.items():
+        cur = current.get(key)
+        if cur is None:
+            failures.append(f"{key}: сценарий отсутствует")
+            continue
+        for metric in ("damage", "hit_rate"):
+            b, c = base[metric], cur[metric]
+            se = math.sqrt(b["var"] / b["n"] + c["var"] / c["n"])
+            diff = c["mean"] - b["mean"]
+            if se == 0:
+                if abs(diff) > 1e-9:
+                    failures.append(f"{key} {metric}: {b['mean']:.3f} -> {c['mean']:.3f}")
+                continue
+            z = diff / se
+            if abs(z) > Z_CRITICAL:
+                failures.append(f"{key} {metric}: {b['mean']:.3f} -> {c['mean']:.3f} (z={z:.1f})")
+        b, c = base["damage"], cur["damage"]
+        d = ks_statistic(b["hist"], c["hist"])
+        critical = KS_C_ALPHA * math.sqrt((b["n"] + c["n"]) / (b["n"] * c["n"]))
+        if d > critical:
+            failures.append(f"{key} damage KS: D={d:.3f} > {critical:.3f}")
+    return failures
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк боевого движка")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    bench = sub.add_parser("bench", help="время и память на ход")
+    bench.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+
+    base = sub.add_parser("baseline", help="сохранить эталонные распределения")
+    base.add_argument("--out", type=Path, required=True)
+    base.add_argument("--volleys", type=int, default=2000)
+    base.add_argument("--seed", type=int, default=1)
+
+    check = sub.add_parser("check", help="сравнить движок с эталоном")
+    check.add_argument("--baseline", type=Path, required=True)
+    check.add_argument("--volleys", type=int, default=2000)
+    check.add_argument("--seed", type=int, default=1001)
+
+    args = parser.parse_args(argv)
+
+    if args.cmd == "bench":
+        run_bench(args.sizes)
+        return 0
+
+    if args.cmd == "baseline":
+        args.out.write_text(json.dumps(collect(args.volleys, args.seed), ensure_ascii=False))
+        print(f"Эталон сохранён: {args.out}")
+        return 0
+
+    failures = compare(json.loads(args.baseline.read_text()), collect(args.volleys, args.seed))
+    if failures:
+        print("❌ Распределения вышли за допуск:")
+        print("\n".join(failures))
+        return 1
+    print("✅ Распределения точности и урона в пределах допуска")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -108,6 +108,8 @@ class AdminCommands(commands.Cog):
         
         embed.color = 0x2ecc71 if not errors else 0xe67e22
         await message.edit(embed=embed)
+        # Затухание рыночного спроса и прочие обработчики конца хода
+        self.bot.dispatch("game_turn", ctx.guild.id)
     
     @commands.command(name="дать_ресурсы", aliases=["give_resources", "ресурсы"])
     @commands.check(is_admin)
@@ -166,6 +168,13 @@ class AdminCommands(commands.Cog):
             await ctx.send(f"❌ У {member.mention} нет флотилии.")
             return
         
+        # Снимаем заявки с биржи: залог возвращается, стакан не держит заявок удалённого флота
+        exchange = self.bot.get_cog("PlayerExchange")
+        if exchange:
+            await exchange.cancel_fleet_orders(ctx.guild.id, fleet.id)
+        else:
+            await self.db.cancel_fleet_orders(fleet.id)
+
         # Удаляем корабли
         ships = await self.db.get_ships_by_fleet(fleet.id)
         for ship in ships:
@@ -3,64 +3,97 @@ from discord.ext import commands
 import asyncio
 import random
 import time
+from typing import Optional
+from utils.constants import (
+    RETREAT_CHANCE, DEBRIS_ITEMS_PER_PAGE, MAX_BATTLE_DISTANCE, DEFAULT_BATTLE_DISTANCE, BATTLE_DISTANCE_STEP
+)
 from models.database import Database
-from models.schemas import ShipModule, ShipStatus
-from utils.game_mechanics import calculate_ship_combat_stats, simulate_volley, generate_debris_field
-
-class BattleState:
-    def __init__(self, attacker_fleet, defender_fleet, attacker_ships, defender_ships, distance):
-        self.attacker_fleet = attacker_fleet
-        self.defender_fleet = defender_fleet
-        self.distance = distance
-        self.turn = 1
-        self.max_turns = 10
-        self.logs = []
-        
-        # Prepare combat stats
-        self.a_stats = [calculate_ship_combat_stats(s) for s in attacker_ships]
-        self.d_stats = [calculate_ship_combat_stats(s) for s in defender_ships]
-        
-        # Store max_hp for damage percentage calculations
-        for s in self.a_stats:
-            s['max_hp'] = s['hp']
-        for s in self.d_stats:
-            s['max_hp'] = s['hp']
-        
-        # Map IDs to original objects for final updates
-        self.a_ships_map = {s.id: s for s in attacker_ships}
-        self.d_ships_map = {s.id: s for s in defender_ships}
+from utils.game_mechanics import binomial, generate_debris_field
+from utils.battle_registry import BattleRegistry
+from utils.combat_engine import BattleState
+from utils.mass_combat import MassBattleState
+from utils.targeting import DOCTRINE_NAMES, DOCTRINE_ALIASES, parse_doctrine
+from utils.battle_log import OUTCOME_NAMES, encode_log, decode_log, render_pages
 
-    @property
-    def is_over(self):
-        a_alive = any(s['hp'] > 0 for s in self.a_stats)
-        d_alive = any(s['hp'] > 0 for s in self.d_stats)
-        return not a_alive or not d_alive or self.turn > self.max_turns
+AUTO_MODE_ALIASES = ("авто", "auto")
+MASS_MODE_ALIASES = ("масса", "массовый", "mass")
+ALLIANCE_SEPARATORS = ("против", "vs")
+
+STAT_METRICS = {
+    "победы": "battles_won",
+    "поражения": "battles_lost",
+    "уничтожено": "ships_destroyed",
+    "урон": "total_damage_dealt",
+}
+# user_stats ведётся на игрока по всем серверам; таблицы показывают игроков этого сервера
+STATS_SCOPE_NOTE = "Статистика игроков сервера в общем зачёте (бои на всех серверах)"
+STAT_METRIC_NAMES = {
+    "battles_won": "Победы",
+    "battles_lost": "Поражения",
+    "ships_destroyed": "Уничтожено кораблей",
+    "total_damage_dealt": "Нанесено урона",
+}
+
+class DoctrineSelect(discord.ui.Select):
+    """Доктрина целеуказания флотилии нажавшего игрока"""
+
+    def __init__(self):
+        options = [discord.SelectOption(label=label, value=doctrine) for doctrine, label in DOCTRINE_NAMES.items()]
+        super().__init__(placeholder="🎯 Доктрина целеуказания", options=options, row=1)
+
+    async def callback(self, interaction: discord.Interaction):
+        battle = self.view.battle
+        fleet = next((f for f in battle.attacker_fleets + battle.defender_fleets
+                      if f.user_id == interaction.user.id), None)
+        if not fleet:
+            await interaction.response.send_message("❌ Вы не участвуете в этом бою.", ephemeral=True)
+            return
+        battle.set_doctrine(fleet.id, self.values[0])
+        await interaction.response.send_message(
+            f"🎯 **{fleet.name}**: {DOCTRINE_NAMES[self.values[0]]}", ephemeral=True
+        )
 
-    def get_progress_bar(self):
-        percent = (self.turn / self.max_turns)
-        filled = int(percent * 10)
-        bar = "█" * filled + "░" * (10 - filled)
-        return f"[{bar}] {self.turn}/{self.max_turns}"
 
 class BattleView(discord.ui.View):
-    def __init__(self, cog, battle: BattleState, ctx):
+    def __init__(self, cog, battle: BattleState, ctx, entry):
         super().__init__(timeout=300)
         self.cog = cog
         self.battle = battle
         self.ctx = ctx
+        self.entry = entry
         self.message = None
+        # В массовом бою огонь распределяется по стекам, доктрины не применяются
+        if not isinstance(battle, MassBattleState):
+            self.add_item(DoctrineSelect())
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Любое действие продлевает бой; выселенный из реестра бой больше не принимает действий
+        if self.entry.battle_id not in self.cog.battles:
+            await interaction.response.send_message("❌ Бой уже завершен.", ephemeral=True)
+            return False
+        self.entry.touch()
+        return True
 
-    async def update_embed(self, finished=False, result_text=None):
+    async def on_timeout(self):
+        # Брошенный бой завершается без урона и покидает реестр
+        async with self.entry.lock:
+            if self.battle.finished:
+                return
+            self.battle.finished = True
+        self.cog.battles.release(self.entry.battle_id)
+        await self.update_embed(finished=True, result_text="Бой прерван по таймауту")
+
+    async def update_embed(self, finished=False, result_text=None, battle_id=None):
         color = 0xe74c3c if not finished else 0x2ecc71
         
         desc = (
-            f"**{self.battle.attacker_fleet.name}** vs **{self.battle.defender_fleet.name}**\n"
+            f"**{self.battle.attacker_name}** vs **{self.battle.defender_name}**\n"
             f"Дистанция: {self.battle.distance} км\n"
             f"Ход: {self.battle.get_progress_bar()}\n\n"
         )
         
         if self.battle.logs:
-            last_logs = "\n".join(self.battle.logs[-5:]) # Show last 5 entries
+            last_logs = "\n".join(list(self.battle.logs)[-5:]) # Show last 5 entries
             desc += f"📜 **Ход боя:**\n{last_logs}\n"
             
         if result_text:
@@ -71,53 +104,34 @@ class BattleView(discord.ui.View):
             description=desc,
             color=color
         )
+        if battle_id:
+            embed.set_footer(text=f"📼 Повтор: !повтор {battle_id}")
         
         # Status Fields
-        a_status = "\n".join([f"{s['callsign']}: {int(s['hp'])} HP" for s in self.battle.a_stats])
-        d_status = "\n".join([f"{s['callsign']}: {int(s['hp'])} HP" for s in self.battle.d_stats])
-        
-        embed.add_field(name="Атакующие", value=a_status or "Уничтожены", inline=True)
-        embed.add_field(name="Защитники", value=d_status or "Уничтожены", inline=True)
+        a_status, d_status = self.battle.status_fields()
+        embed.add_field(name="Атакующие", value=a_status[:1024] or "Уничтожены", inline=True)
+        embed.add_field(name="Защитники", value=d_status[:1024] or "Уничтожены", inline=True)
 
         if self.message:
             await self.message.edit(embed=embed, view=self if not finished else None)
 
     @discord.ui.button(label="⚔️ Атака", style=discord.ButtonStyle.danger, custom_id="battle_attack")
     async def attack_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if interaction.user.id != self.battle.attacker_fleet.user_id and interaction.user.id != self.battle.defender_fleet.user_id:
+        if interaction.user.id not in self.battle.participant_ids:
              await interaction.response.send_message("❌ Вы не участвуете в этом бою.", ephemeral=True)
              return
 
         await interaction.response.defer()
-        
-        # Simulate Turn
-        round_log = []
-        
-        # 1. Attacker Volley
-        active_defenders = [s for s in self.battle.d_stats if s['hp'] > 0]
-        if active_defenders:
-            for att in [s for s in self.battle.a_stats if s['hp'] > 0]:
-                target = random.choice(active_defenders)
-                logs, dmg = simulate_volley(att, target)
-                target['hp'] -= dmg
-                round_log.extend(logs)
-                if target['hp'] <= 0:
-                     round_log.append(f"💀 **{target['callsign']}** уничтожен!")
-
-        # 2. Defender Volley
-        active_attackers = [s for s in self.battle.a_stats if s['hp'] > 0]
-        if active_attackers:
-            for deff in [s for s in self.battle.d_stats if s['hp'] > 0]:
-                 target = random.choice(active_attackers)
-                 logs, dmg = simulate_volley(deff, target)
-                 target['hp'] -= dmg
-                 round_log.extend(logs)
-                 if target['hp'] <= 0:
-                     round_log.append(f"💀 **{target['callsign']}** уничтожен!")
-        
-        self.battle.logs.extend(round_log)
-        self.battle.turn += 1
-        
+
+        # Ходы одного боя выполняются строго по очереди
+        async with self.entry.lock:
+            if self.battle.finished:
+                return
+            await self.play_turn()
+
+    async def play_turn(self):
+        self.battle.run_turn()
+
         # Check End Condition
         if self.battle.is_over:
             await self.end_battle()
@@ -126,17 +140,48 @@ class BattleView(discord.ui.View):
 
     @discord.ui.button(label="🏳️ Отступление", style=discord.ButtonStyle.secondary, custom_id="battle_retreat")
     async def retreat_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        if interaction.user.id != self.battle.attacker_fleet.user_id and interaction.user.id != self.battle.defender_fleet.user_id:
+        if interaction.user.id not in self.battle.participant_ids:
              await interaction.response.send_message("❌ Вы не участвуете в этом бою.", ephemeral=True)
              return
              
-        # Simple retreat logic: 50% chance
-        if random.random() < 0.5:
-            await interaction.response.send_message("💨 **Отступление успешно!** Бой завершен.", ephemeral=False)
-            await self.end_battle(reason="retreat")
-        else:
-            await interaction.response.send_message("❌ **Не удалось отступить!** Противник перехватил маневр.", ephemeral=True)
-            self.battle.logs.append("⚠️ Попытка отступления провалилась!")
+        async with self.entry.lock:
+            if self.battle.finished:
+                await interaction.response.send_message("❌ Бой уже завершен.", ephemeral=True)
+                return
+
+            # Simple retreat logic: 50% chance
+            if random.random() < RETREAT_CHANCE:
+                await interaction.response.send_message("💨 **Отступление успешно!** Бой завершен.", ephemeral=False)
+                await self.end_battle(reason="retreat")
+            else:
+                await interaction.response.send_message("❌ **Не удалось отступить!** Противник перехватил маневр.", ephemeral=True)
+                self.battle.logs.append("⚠️ Попытка отступления провалилась!")
+                await self.update_embed()
+
+    @discord.ui.button(label="⏩ Сблизиться", style=discord.ButtonStyle.primary, custom_id="battle_close_in", row=2)
+    async def close_in_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.maneuver(interaction, -BATTLE_DISTANCE_STEP)
+
+    @discord.ui.button(label="⏪ Отойти", style=discord.ButtonStyle.primary, custom_id="battle_open_range", row=2)
+    async def open_range_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        await self.maneuver(interaction, BATTLE_DISTANCE_STEP)
+
+    async def maneuver(self, interaction: discord.Interaction, delta: int):
+        """Смена дистанции между ходами: меняет точность всех орудий по таблицам дальности"""
+        if interaction.user.id not in self.battle.participant_ids:
+            await interaction.response.send_message("❌ Вы не участвуете в этом бою.", ephemeral=True)
+            return
+
+        await interaction.response.defer()
+        async with self.entry.lock:
+            if self.battle.finished:
+                return
+            before = self.battle.distance
+            after = self.battle.change_distance(delta)
+            if after == before:
+                return
+            action = "сближается" if delta < 0 else "отходит"
+            self.battle.logs.append(f"↔️ **{interaction.user.display_name}** {action}: {before} → {after} км")
             await self.update_embed()
 
     @discord.ui.button(label="🛑 Отмена (Админ)", style=discord.ButtonStyle.grey, custom_id="battle_cancel")
@@ -146,123 +191,245 @@ class BattleView(discord.ui.View):
              await interaction.response.send_message("❌ Только администратор может отменить бой.", ephemeral=True)
              return
         
+        async with self.entry.lock:
+            if self.battle.finished:
+                await interaction.response.send_message("❌ Бой уже завершен.", ephemeral=True)
+                return
+            self.battle.finished = True
+
         await interaction.response.send_message("🛑 **Бой остановлен администратором.**", ephemeral=False)
         self.stop()
+        self.cog.battles.release(self.entry.battle_id)
         await self.update_embed(finished=True, result_text="Бой отменен")
 
     async def end_battle(self, reason="normal"):
+        # Вызывается под блокировкой боя
+        if self.battle.finished:
+            return
+        self.battle.finished = True
         self.stop()
-        
-        # Determine Winner
-        a_alive = any(s['hp'] > 0 for s in self.battle.a_stats)
-        d_alive = any(s['hp'] > 0 for s in self.battle.d_stats)
-        
-        result_text = "Ничья"
-        if reason == "retreat":
-            result_text = "Бой прерван отступлением"
-        elif a_alive and not d_alive:
-            result_text = f"Победа {self.battle.attacker_fleet.name}!"
-        elif d_alive and not a_alive:
-            result_text = f"Победа {self.battle.defender_fleet.name}!"
-            
-        await self.update_embed(finished=True, result_text=result_text)
+        self.cog.battles.release(self.entry.battle_id)
         
         # Apply Damage to DB
-        await self.apply_damage()
+        battle_id = await self.cog.apply_damage(self.battle, self.ctx.guild.id, reason)
+
+        result_text = self.battle.result_text(reason)
+        await self.update_embed(finished=True, result_text=result_text, battle_id=battle_id)
         
         # Generate Debris
         if reason == "normal":
-            await self.generate_loot()
+            view = self.cog.build_debris_view(self.battle, self.ctx.author)
+            if view:
+                await self.ctx.send("🛰️ **Обнаружены обломки!**", view=view)
 
-    async def apply_damage(self):
-        # Update ships based on final HP
-        for stats in self.battle.a_stats + self.battle.d_stats:
-            ship_id = stats['id']
-            hp_percent = stats['hp'] / stats.get('max_hp', 100) # Assuming max_hp is roughly tracked or just check dead
-            
-            status = ShipStatus.OPERATIONAL
-            if stats['hp'] <= 0:
-                status = ShipStatus.DESTROYED
-            elif hp_percent < 0.3:
-                status = ShipStatus.CRITICAL_DAMAGE
-            elif hp_percent < 0.6:
-                status = ShipStatus.MODERATE_DAMAGE
-            elif hp_percent < 0.9:
-                status = ShipStatus.LIGHT_DAMAGE
-            
-            await self.cog.db.update_ship_status(ship_id, status)
-            # If destroyed, maybe delete? For now just set status.
-            
-    async def generate_loot(self):
-        # Collect destroyed ships
-        destroyed_stats = [s for s in self.battle.a_stats + self.battle.d_stats if s['hp'] <= 0]
-        
-        if not destroyed_stats:
-            return
 
-        # Fetch original ships to get modules
+class Combat(commands.Cog):
+    """Система боя и разрушений"""
+    
+    def __init__(self, bot):
+        self.bot = bot
+        self.db: Database = bot.db
+        self.battles = BattleRegistry()
+
+    async def apply_damage(self, battle: BattleState, guild_id: int, reason="normal"):
+        """
+        Сохраняет итоги и историю боя одной транзакцией. Возвращает id записи в истории.
+        Повторный вызов ничего не делает.
+        """
+        if battle.applied:
+            return None
+        # Флаг ставится до первого await, поэтому гонка двух завершений невозможна
+        battle.applied = True
+        row, participants, record = battle.history_record(reason)
+        return await self.db.apply_battle_results(
+            battle.final_statuses(),
+            stats=battle.result_stats(reason),
+            history=(guild_id, row, participants, encode_log(record))
+        )
+
+    def build_debris_view(self, battle: BattleState, owner):
+        if not battle.destroyed:
+            return None
+
+        # Original ships carry the modules
         destroyed_ships = []
-        for s in destroyed_stats:
-            ship = self.battle.a_ships_map.get(s['id']) or self.battle.d_ships_map.get(s['id'])
+        for ship_id in battle.destroyed:
+            ship = battle.a_ships_map.get(ship_id) or battle.d_ships_map.get(ship_id)
             if ship:
                 destroyed_ships.append(ship)
         
         # Generate debris
         debris = generate_debris_field(destroyed_ships, guaranteed_weapons=True)
-        if debris:
-            view = DebrisView(self.cog, debris, self.ctx.author)
-            await self.ctx.send("🛰️ **Обнаружены обломки!**", view=view)
+        if not debris:
+            return None
+        return DebrisView(self, debris, owner)
 
+    async def auto_resolve(self, ctx, battle: BattleState, entry):
+        """Проводит все ходы на сервере и публикует один итоговый embed"""
+        async with entry.lock:
+            if battle.finished:
+                return
+            while not battle.is_over:
+                battle.run_turn(verbose=False)
+            battle.finished = True
+        self.battles.release(entry.battle_id)
 
-class Combat(commands.Cog):
-    """Система боя и разрушений"""
-    
-    def __init__(self, bot):
-        self.bot = bot
-        self.db: Database = bot.db
-        self.active_battles = {}
+        result_text = battle.result_text()
+        battle_id = await self.apply_damage(battle, ctx.guild.id)
+        debris_view = self.build_debris_view(battle, ctx.author)
+
+        turn_log = "\n".join(battle.compressed_log())
+        desc = (
+            f"**{battle.attacker_name}** vs **{battle.defender_name}**\n"
+            f"Дистанция: {battle.distance} км | Ходов: {battle.turn - 1}\n\n"
+            f"📜 **Ход боя:**\n{turn_log}\n"
+            f"\n🏆 **{result_text}**"
+        )
+        mass = isinstance(battle, MassBattleState)
+        title = "⚔️ Массовое сражение" if mass else "⚔️ Сражение (авто)"
+        if mass:
+            desc = "⚙️ Стеки ведут огонь автоматически, без доктрин и манёвров.\n" + desc
+        embed = discord.Embed(title=title, description=desc[:4096], color=0x2ecc71)
+        a_status, d_status = battle.status_fields()
+        embed.add_field(name="Атакующие", value=a_status[:1024] or "Уничтожены", inline=True)
+        embed.add_field(name="Защитники", value=d_status[:1024] or "Уничтожены", inline=True)
+        footer = f"📼 Повтор: !повтор {battle_id}"
+        embed.set_footer(text=footer)
+        if debris_view:
+            embed.set_footer(text=f"{footer} | 🛰️ Обнаружены обломки! Соберите их через меню ниже.")
+            await ctx.send(embed=embed, view=debris_view)
+        else:
+            await ctx.send(embed=embed)
+
+    @staticmethod
+    def parse_options(options):
+        """(авто, массовый, доктрина) по аргументам команды или None, если аргумент неизвестен"""
+        auto = mass = False
+        doctrine = None
+        for option in options:
+            option = option.lower()
+            if option in AUTO_MODE_ALIASES:
+                auto = True
+            elif option in MASS_MODE_ALIASES:
+                auto = mass = True
+            elif parse_doctrine(option):
+                doctrine = parse_doctrine(option)
+            else:
+                return None
+        return auto, mass, doctrine
 
     @commands.command(name="бой", aliases=["battle", "fight"])
-    async def start_battle(self, ctx, enemy: discord.Member, distance: int = 10):
+    async def start_battle(self, ctx, enemy: discord.Member, distance: Optional[int] = None, *options: str):
         """
         Начать бой с игроком
-        !бой @враг [дистанция]
+        !бой @враг [дистанция] [авто/масса] [доктрина]
+        """
+        # Optional: без числа первый параметр уходит в options (`!бой @враг авто`)
+        if distance is None:
+            distance = DEFAULT_BATTLE_DISTANCE
+        await self.launch_battle(ctx, [ctx.author], [enemy], distance, options)
+
+    @commands.command(name="бой_альянс", aliases=["alliance_battle", "альянс"])
+    async def start_alliance_battle(self, ctx, *args: str):
+        """
+        Бой союзов: несколько флотилий на каждой стороне
+        !бой_альянс @союзник ... против @враг ... [дистанция] [авто/масса] [доктрина]
         """
-        if distance > 20:
-            await ctx.send("❌ Слишком большая дистанция для начала боя (макс. 20 км).")
+        converter = commands.MemberConverter()
+        allies, enemies = [ctx.author], []
+        side = allies
+        distance, options = DEFAULT_BATTLE_DISTANCE, []
+        for token in args:
+            if token.lower() in ALLIANCE_SEPARATORS:
+                side = enemies
+            elif token.lower() in AUTO_MODE_ALIASES + MASS_MODE_ALIASES or parse_doctrine(token):
+                options.append(token)
+            else:
+                # Сначала участник (в том числе по ID пользователя), число в пределах дистанции боя - дистанция
+                try:
+                    member = await converter.convert(ctx, token)
+                except commands.BadArgument:
+                    if token.isdigit() and int(token) <= MAX_BATTLE_DISTANCE:
+                        distance = int(token)
+                        continue
+                    await ctx.send(f"❌ Игрок `{token}` не найден.")
+                    return
+                if member not in allies and member not in enemies:
+                    side.append(member)
+
+        if not enemies:
+            await ctx.send("❌ Укажите противников: `!бой_альянс @союзник против @враг [дистанция] [авто/масса]`")
             return
-            
-        attacker_fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
-        defender_fleet = await self.db.get_fleet_by_user(enemy.id, ctx.guild.id)
-        
-        if not attacker_fleet or not defender_fleet:
+
+        await self.launch_battle(ctx, allies, enemies, distance, options)
+
+    async def launch_battle(self, ctx, attackers, defenders, distance, options=()):
+        """
+        Общий запуск боя: стороны - списки участников, по одной флотилии на игрока.
+        Доктрина из команды применяется к флотилии автора.
+        """
+        parsed = self.parse_options(options)
+        if parsed is None:
+            await ctx.send(
+                "❌ Неизвестный параметр боя. Режимы: `авто`, `масса`. "
+                f"Доктрины: {', '.join(f'`{d}`' for d in DOCTRINE_ALIASES)}."
+            )
+            return
+        auto, mass, doctrine = parsed
+        if mass and doctrine:
+            await ctx.send("❌ Массовый бой проходит автоматически: доктрины и манёвры в нём не применяются.")
+            return
+
+        if distance > MAX_BATTLE_DISTANCE:
+            await ctx.send(f"❌ Слишком большая дистанция для начала боя (макс. {MAX_BATTLE_DISTANCE} км).")
+            return
+
+        fleets = await self.db.get_fleets_by_users(ctx.guild.id, [m.id for m in attackers + defenders])
+        attacker_fleets = [fleets.get(m.id) for m in attackers]
+        defender_fleets = [fleets.get(m.id) for m in defenders]
+
+        if None in attacker_fleets or None in defender_fleets:
             await ctx.send("❌ У одного из участников нет флотилии.")
             return
 
-        # Fetch ships
-        a_ships = await self.db.get_ships_by_fleet(attacker_fleet.id)
-        d_ships = await self.db.get_ships_by_fleet(defender_fleet.id)
-        
-        # Populate modules
-        for s in a_ships: 
-            modules_data = await self.db.get_ship_modules(s.id)
-            s.modules = [ShipModule(**m) for m in modules_data]
-            
-        for s in d_ships: 
-            modules_data = await self.db.get_ship_modules(s.id)
-            s.modules = [ShipModule(**m) for m in modules_data]
-        
-        # Filter operational ships
-        a_combat_ships = [s for s in a_ships if s.status not in [ShipStatus.DESTROYED, ShipStatus.CRITICAL_DAMAGE]]
-        d_combat_ships = [s for s in d_ships if s.status not in [ShipStatus.DESTROYED, ShipStatus.CRITICAL_DAMAGE]]
+        fleet_ids = [f.id for f in attacker_fleets + defender_fleets]
+        if len(set(fleet_ids)) != len(fleet_ids):
+            await ctx.send("❌ Нельзя атаковать собственную флотилию.")
+            return
+
+        limit_error = self.battles.check_limits(ctx.guild.id, fleet_ids)
+        if limit_error:
+            await ctx.send(f"❌ {limit_error}")
+            return
+
+        # Боеспособные корабли всех сторон с модулями - одним запросом
+        combat_ships = await self.db.get_combat_ships(fleet_ids)
+        a_combat_ships = [s for f in attacker_fleets for s in combat_ships[f.id]]
+        d_combat_ships = [s for f in defender_fleets for s in combat_ships[f.id]]
 
         if not a_combat_ships or not d_combat_ships:
             await ctx.send("❌ У одной из сторон нет боеспособных кораблей.")
             return
 
         # Initialize Battle
-        battle = BattleState(attacker_fleet, defender_fleet, a_combat_ships, d_combat_ships, distance)
-        view = BattleView(self, battle, ctx)
+        # Повторная проверка: пока грузились корабли, мог начаться другой бой
+        limit_error = self.battles.check_limits(ctx.guild.id, fleet_ids)
+        if limit_error:
+            await ctx.send(f"❌ {limit_error}")
+            return
+
+        # Массовый бой сводит одинаковые корабли в стеки
+        state_cls = MassBattleState if mass else BattleState
+        battle = state_cls(attacker_fleets, defender_fleets, a_combat_ships, d_combat_ships, distance)
+        if doctrine:
+            battle.set_doctrine(attacker_fleets[0].id, doctrine)
+        entry = self.battles.register(ctx.guild.id, fleet_ids, battle)
+
+        if auto:
+            await self.auto_resolve(ctx, battle, entry)
+            return
+
+        view = BattleView(self, battle, ctx, entry)
         
         # Send initial message
         embed = discord.Embed(title="⚔️ Подготовка к бою...", description="Инициализация систем...", color=0xe74c3c)
@@ -271,55 +438,277 @@ class Combat(commands.Cog):
         await view.update_embed() # Updates the embed with correct stats
 
 
+    @commands.command(name="повтор", aliases=["replay"])
+    async def replay_battle(self, ctx, battle_id: int):
+        """
+        Повтор сохранённого боя по страницам
+        !повтор <id боя>
+        """
+        battle = await self.db.get_battle(ctx.guild.id, battle_id)
+        if not battle:
+            await ctx.send(f"❌ Бой #{battle_id} не найден.")
+            return
+
+        pages = render_pages(battle, decode_log(battle['log']))
+        view = ReplayView(f"📼 Повтор боя #{battle_id}", pages)
+        await ctx.send(embed=view.build_embed(), view=view if len(pages) > 1 else None)
+
+    @commands.command(name="история", aliases=["history", "бои"])
+    async def battle_history(self, ctx, member: discord.Member = None):
+        """
+        Последние бои сервера или игрока
+        !история [@игрок]
+        """
+        fleet_id = None
+        if member:
+            fleet = await self.db.get_fleet_by_user(member.id, ctx.guild.id)
+            if not fleet:
+                await ctx.send("❌ У игрока нет флотилии.")
+                return
+            fleet_id = fleet.id
+
+        rows = await self.db.get_battle_history(ctx.guild.id, fleet_id)
+        if not rows:
+            await ctx.send("📜 Боёв пока не было.")
+            return
+
+        lines = [
+            f"`#{row['id']}` {row['created_at'][:16]} **{row['attacker_name']}** vs **{row['defender_name']}** — "
+            f"{OUTCOME_NAMES.get(row['outcome'], row['outcome'])}, ходов: {row['turns']}"
+            for row in rows
+        ]
+        title = f"📜 Бои: {member.display_name}" if member else "📜 Последние бои сервера"
+        embed = discord.Embed(title=title, description="\n".join(lines)[:4096], color=0x3498db)
+        embed.set_footer(text="Повтор боя: !повтор <id>")
+        await ctx.send(embed=embed)
+
+    @commands.command(name="боевая_статистика", aliases=["battle_stats"])
+    async def show_battle_stats(self, ctx, member: discord.Member = None):
+        """
+        Боевая статистика игрока
+        !боевая_статистика [@игрок]
+        """
+        target = member or ctx.author
+        stats = await self.db.get_user_stats(target.id)
+        if not stats:
+            await ctx.send(f"📊 У {target.mention} ещё нет боевой статистики.")
+            return
+
+        battles = stats['battles_won'] + stats['battles_lost']
+        win_rate = stats['battles_won'] / battles * 100 if battles else 0
+        embed = discord.Embed(title=f"📊 Боевая статистика: {target.display_name}", color=0x3498db)
+        embed.add_field(
+            name="⚔️ Сражения",
+            value=(
+                f"Побед: **{stats['battles_won']}** | Поражений: **{stats['battles_lost']}**\n"
+                f"Процент побед: **{win_rate:.0f}%**"
+            ),
+            inline=False
+        )
+        embed.add_field(
+            name="💥 Боевой счёт",
+            value=(
+                f"Уничтожено кораблей: **{stats['ships_destroyed']:,}**\n"
+                f"Нанесено урона: **{stats['total_damage_dealt']:,}**"
+            ),
+            inline=False
+        )
+        await ctx.send(embed=embed)
+
+    @commands.command(name="рекорды", aliases=["records", "leaderboard", "лидеры"])
+    async def show_records(self, ctx, metric: str = None):
+        """
+        Рекорды сервера или таблица лидеров по показателю
+        !рекорды [победы/уничтожено/урон]
+        """
+        if metric:
+            field = STAT_METRICS.get(metric.lower())
+            if not field:
+                await ctx.send(f"❌ Неизвестный показатель. Доступные: {', '.join(STAT_METRIC_NAMES)}")
+                return
+            rows = await self.db.get_stats_leaderboard(ctx.guild.id, field)
+            if not rows:
+                await ctx.send("📊 Таблица лидеров пока пуста.")
+                return
+            lines = [f"`{i}.` **{row['fleet_name']}** — {row[field]:,}" for i, row in enumerate(rows, 1)]
+            embed = discord.Embed(
+                title=f"🏆 Лидеры: {STAT_METRIC_NAMES[field]}",
+                description="\n".join(lines),
+                color=0xf1c40f
+            )
+            embed.set_footer(text=STATS_SCOPE_NOTE)
+            await ctx.send(embed=embed)
+            return
+
+        records = await self.db.get_stats_records(ctx.guild.id)
+        if not records:
+            await ctx.send("📊 Рекордов пока нет. Проведите первый бой!")
+            return
+        lines = [
+            f"{STAT_METRIC_NAMES[field]}: **{records[field]['fleet_name']}** — {records[field]['value']:,}"
+            for field in STAT_METRIC_NAMES if field in records
+        ]
+        embed = discord.Embed(title="🏆 Рекорды сервера", description="\n".join(lines), color=0xf1c40f)
+        embed.set_footer(text=f"{STATS_SCOPE_NOTE}\nТаблица лидеров: !рекорды [победы/уничтожено/урон]")
+        await ctx.send(embed=embed)
+
+
+class ReplayView(discord.ui.View):
+    """Постраничный просмотр сохранённого боя"""
+
+    def __init__(self, title, pages):
+        super().__init__(timeout=300)
+        self.title = title
+        self.pages = pages
+        self.current_page = 0
+        self.refresh()
+
+    def build_embed(self):
+        embed = discord.Embed(title=self.title, description=self.pages[self.current_page][:4096], color=0x9b59b6)
+        embed.set_footer(text=f"Страница {self.current_page + 1}/{len(self.pages)}")
+        return embed
+
+    def refresh(self):
+        self.previous_page.disabled = self.current_page == 0
+        self.next_page.disabled = self.current_page >= len(self.pages) - 1
+
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.gray)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.current_page = max(0, self.current_page - 1)
+        self.refresh()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.gray)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.current_page = min(len(self.pages) - 1, self.current_page + 1)
+        self.refresh()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+
 class DebrisView(discord.ui.View):
     def __init__(self, cog, debris_items, owner):
-        super().__init__(timeout=60)
+        super().__init__(timeout=120)
         self.cog = cog
         self.debris = debris_items
         self.owner = owner
-        
-        for i, item in enumerate(self.debris[:5]): # Max 5 buttons for now
-            mod_label = "☢️" if item.get('modifier') == "radiation" else "💣" if item.get('modifier') == "explosive" else ""
-            label = f"{mod_label} {item['name']} ({item.get('amount', 1)})"
-            self.add_item(DebrisButton(item, label, i))
+        self.selected = set()
+        self.current_page = 0
+        self.lock = asyncio.Lock()
+        self.select = DebrisSelect()
+        self.add_item(self.select)
+        self.refresh()
 
-class DebrisButton(discord.ui.Button):
-    def __init__(self, item, label, index):
-        super().__init__(style=discord.ButtonStyle.secondary, label=label, custom_id=f"debris_{index}")
-        self.item = item
-        self.index = index
+    @property
+    def remaining(self):
+        return [i for i, item in enumerate(self.debris) if not item.get('collected')]
 
-    async def callback(self, interaction: discord.Interaction):
-        # Hazard Check
-        if self.item.get('modifier') == "radiation":
-            if random.random() < 0.7:
-                await interaction.response.send_message("☢️ **АВАРИЯ!** Вы получили дозу радиации при попытке сбора. Экипаж пострадал!", ephemeral=True)
-                self.disabled = True
-                await interaction.message.edit(view=self.view)
+    @property
+    def total_pages(self):
+        return max(1, (len(self.remaining) - 1) // DEBRIS_ITEMS_PER_PAGE + 1)
+
+    def refresh(self):
+        """Пересобирает варианты текущей страницы и состояние кнопок"""
+        remaining = self.remaining
+        self.current_page = min(self.current_page, self.total_pages - 1)
+        start = self.current_page * DEBRIS_ITEMS_PER_PAGE
+        page = remaining[start:start + DEBRIS_ITEMS_PER_PAGE]
+
+        options = []
+        for i in page:
+            item = self.debris[i]
+            mod_label = "☢️ " if item.get('modifier') == "radiation" else "💣 " if item.get('modifier') == "explosive" else ""
+            unit = " т" if item['name'] == 'Топливо' else ""
+            options.append(discord.SelectOption(
+                label=f"{mod_label}{item['name']} x{item['amount']}{unit}"[:100],
+                value=str(i),
+                default=i in self.selected
+            ))
+        if not options:
+            options = [discord.SelectOption(label="Обломков не осталось", value="-1")]
+
+        self.select.options = options
+        self.select.max_values = len(options)
+        self.select.placeholder = f"Выберите обломки (стр. {self.current_page + 1}/{self.total_pages})"
+        self.select.disabled = not page
+        self.previous_page.disabled = self.current_page == 0
+        self.next_page.disabled = self.current_page >= self.total_pages - 1
+        self.collect_button.disabled = not page
+
+    @discord.ui.button(label="◀️", style=discord.ButtonStyle.gray, row=1)
+    async def previous_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.current_page = max(0, self.current_page - 1)
+        self.refresh()
+        await interaction.response.edit_message(view=self)
+
+    @discord.ui.button(label="▶️", style=discord.ButtonStyle.gray, row=1)
+    async def next_page(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.current_page = min(self.total_pages - 1, self.current_page + 1)
+        self.refresh()
+        await interaction.response.edit_message(view=self)
+
+    @discord.ui.button(label="📦 Собрать", style=discord.ButtonStyle.success, row=1)
+    async def collect_button(self, interaction: discord.Interaction, button: discord.ui.Button):
+        """Собирает выбранные стопки (или все, если ничего не выбрано) одной транзакцией"""
+        fleet = await self.cog.db.get_fleet_by_user(interaction.user.id, interaction.guild.id)
+        if not fleet:
+            await interaction.response.send_message("❌ У вас нет флотилии.", ephemeral=True)
+            return
+
+        async with self.lock:
+            picked = [i for i in (self.selected or self.remaining) if not self.debris[i].get('collected')]
+            if not picked:
+                await interaction.response.send_message("❌ Эти обломки уже собраны.", ephemeral=True)
                 return
+            for i in picked:
+                self.debris[i]['collected'] = True
+            self.selected.clear()
 
-        if self.item.get('modifier') == "explosive":
-             pass # Simplify
+            methane = 0
+            modules = []
+            lines = []
+            for i in picked:
+                item = self.debris[i]
+                amount = item['amount']
+                # Hazard Check: радиация губит каждую единицу стопки отдельно
+                if item.get('modifier') == "radiation":
+                    lost = binomial(amount, 0.7)
+                    amount -= lost
+                    if lost:
+                        lines.append(f"☢️ {item['name']} x{lost} - утеряно из-за радиации")
+                    if not amount:
+                        continue
 
-        # Give item
-        msg = ""
-        fleet = await self.view.cog.db.get_fleet_by_user(interaction.user.id, interaction.guild.id)
-        
-        if self.item['type'] == 'resource':
-            if self.item['name'] == 'Топливо':
-                await self.view.cog.db.update_fleet_resources(fleet.id, methane=fleet.methane + self.item['amount'])
-                msg = f"Вы собрали {self.item['amount']} тонн топлива."
-            elif self.item['name'] == 'Боеприпасы':
-                 msg = f"Вы собрали боеприпасы."
-                 
-        elif self.item['type'] == 'module':
-            await self.view.cog.db.add_module_to_inventory(fleet.id, self.item['module_id'], 1)
-            msg = f"Вы подобрали модуль: {self.item['name']}"
-
-        self.disabled = True
-        self.style = discord.ButtonStyle.success
-        await interaction.response.send_message(f"✅ {msg}", ephemeral=True)
-        await interaction.message.edit(view=self.view)
+                if item['type'] == 'resource':
+                    if item['name'] == 'Топливо':
+                        methane += amount
+                        lines.append(f"⛽ Топливо: {amount} т")
+                    elif item['name'] == 'Боеприпасы':
+                        lines.append(f"🔸 Боеприпасы x{amount}")
+                elif item['type'] == 'module':
+                    modules.append((item['module_id'], amount))
+                    lines.append(f"🔧 {item['name']} x{amount}")
+
+            await self.cog.db.credit_salvage(fleet.id, methane, modules)
+
+            self.refresh()
+            if not self.remaining:
+                self.stop()
+            await interaction.response.edit_message(view=self if self.remaining else None)
+
+        await interaction.followup.send("✅ **Собрано:**\n" + "\n".join(lines)[:1900], ephemeral=True)
+
+class DebrisSelect(discord.ui.Select):
+    def __init__(self):
+        super().__init__(min_values=0, max_values=1, options=[discord.SelectOption(label="-", value="-1")], row=0)
+
+    async def callback(self, interaction: discord.Interaction):
+        view = self.view
+        # Выбор хранится между страницами: заменяем только варианты текущей страницы
+        page_values = {int(o.value) for o in self.options}
+        view.selected -= page_values
+        view.selected |= {int(v) for v in self.values if int(v) >= 0}
+        view.refresh()
+        await interaction.response.edit_message(view=view)
 
 async def setup(bot):
     await bot.add_cog(Combat(bot))
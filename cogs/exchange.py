@@ -0,0 +1,174 @@
+import asyncio
+
+import discord
+from discord.ext import commands
+from models.database import Database
+from utils.helpers import format_currency
+from utils.constants import ORDER_BOOK_LEVELS_SHOWN, ORDER_MAX_PRICE, ORDER_MAX_QUANTITY
+from utils.order_book import Exchange, Order, SIDE_BUY, SIDE_SELL
+
+
+class PlayerExchange(commands.Cog):
+    """Биржа игроков: лимитные заявки на модули"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.db: Database = bot.db
+        self.exchange = Exchange()
+        # Сведение и запись сделок сервера идут строго по очереди
+        self._locks = {}
+
+    async def cog_load(self):
+        self.exchange.load(await self.db.get_open_orders())
+
+    def lock(self, guild_id: int) -> asyncio.Lock:
+        lock = self._locks.get(guild_id)
+        if lock is None:
+            lock = self._locks[guild_id] = asyncio.Lock()
+        return lock
+
+    async def cancel_fleet_orders(self, guild_id: int, fleet_id: int) -> list:
+        """Снять все заявки флотилии с возвратом залога и убрать их из стакана"""
+        async with self.lock(guild_id):
+            orders = await self.db.cancel_fleet_orders(fleet_id)
+            for order in orders:
+                self.exchange.remove(order['id'])
+        return orders
+
+    async def place(self, ctx, side: str, module_id: int, quantity: int, price: int):
+        if quantity <= 0 or price <= 0:
+            await ctx.send("❌ Количество и цена должны быть положительными.")
+            return
+        if quantity > ORDER_MAX_QUANTITY or price > ORDER_MAX_PRICE:
+            await ctx.send(f"❌ Не больше {ORDER_MAX_QUANTITY} шт. и {format_currency(ORDER_MAX_PRICE)} за шт. в одной заявке.")
+            return
+
+        fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send("❌ У вас нет флотилии.")
+            return
+
+        module = await self.db.get_module(module_id)
+        if not module:
+            await ctx.send(f"❌ Модуль с ID {module_id} не существует.")
+            return
+
+        async with self.lock(ctx.guild.id):
+            order = Order(0, ctx.guild.id, fleet.id, module_id, side, price, quantity)
+            book = self.exchange.book(ctx.guild.id, module_id)
+            fills = book.match(order)
+            if fills is None:
+                await ctx.send("❌ Заявка исполнилась бы о вашу же встречную заявку. Сначала отмените её (`!биржа`).")
+                return
+            try:
+                order_id = await self.db.place_order(
+                    ctx.guild.id, fleet.id, module_id, side, price, quantity,
+                    [(f.maker.id, f.maker.fleet_id, f.quantity, f.price) for f in fills]
+                )
+            except Exception:
+                # Транзакция откатилась - стакан в памяти тоже
+                book.revert(order, fills)
+                raise
+            if order_id is None:
+                book.revert(order, fills)
+                if side == SIDE_BUY:
+                    await ctx.send(f"❌ Недостаточно средств! Нужно {format_currency(price * quantity)}")
+                else:
+                    await ctx.send("❌ Недостаточно предметов на складе.")
+                return
+            self.exchange.forget_filled(fills)
+            if order_id:
+                order.id = order_id
+                self.exchange.add(order)
+
+        filled = quantity - order.remaining
+        verb = "Куплено" if side == SIDE_BUY else "Продано"
+        lines = []
+        if filled:
+            total = sum(f.quantity * f.price for f in fills)
+            lines.append(f"✅ {verb}: **{module['name']}** x{filled} на {format_currency(total)}")
+        if order.remaining:
+            kind = "покупку" if side == SIDE_BUY else "продажу"
+            lines.append(f"📋 Заявка #{order.id} на {kind}: x{order.remaining} по {format_currency(price)}")
+        await ctx.send("\n".join(lines))
+
+    @commands.command(name="заявка_купить", aliases=["bid"])
+    async def place_bid(self, ctx, module_id: int, quantity: int, price: int):
+        """
+        Лимитная заявка на покупку модуля у игроков
+        Использование: !заявка_купить [ID] [кол-во] [цена за шт.]
+        """
+        await self.place(ctx, SIDE_BUY, module_id, quantity, price)
+
+    @commands.command(name="заявка_продать", aliases=["ask"])
+    async def place_ask(self, ctx, module_id: int, quantity: int, price: int):
+        """
+        Лимитная заявка на продажу модуля со склада игрокам
+        Использование: !заявка_продать [ID] [кол-во] [цена за шт.]
+        """
+        await self.place(ctx, SIDE_SELL, module_id, quantity, price)
+
+    @commands.command(name="заявка_отменить", aliases=["cancel_order"])
+    async def cancel(self, ctx, order_id: int):
+        """Отменить свою заявку и вернуть залог"""
+        fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send("❌ У вас нет флотилии.")
+            return
+
+        async with self.lock(ctx.guild.id):
+            order = await self.db.cancel_order(order_id, fleet.id)
+            if order is None:
+                await ctx.send("❌ У вас нет такой заявки.")
+                return
+            self.exchange.remove(order_id)
+
+        if order['side'] == SIDE_BUY:
+            await ctx.send(f"✅ Заявка #{order_id} отменена, возвращено {format_currency(order['price'] * order['remaining'])}")
+        else:
+            await ctx.send(f"✅ Заявка #{order_id} отменена, на склад возвращено {order['remaining']} шт.")
+
+    @commands.command(name="биржа", aliases=["orders", "стакан"])
+    async def show_book(self, ctx, module_id: int = None):
+        """
+        Стакан заявок по модулю или свои заявки
+        Использование: !биржа [ID]
+        """
+        if module_id is None:
+            fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+            if not fleet:
+                await ctx.send("❌ У вас нет флотилии.")
+                return
+            orders = self.exchange.fleet_orders(fleet.id)
+            if not orders:
+                await ctx.send("📋 У вас нет открытых заявок. Стакан модуля: `!биржа [ID]`")
+                return
+            modules = {m['id']: m['name'] for m in await self.db.get_all_modules()}
+            embed = discord.Embed(title=f"📋 Заявки флотилии {fleet.name}", color=0x3498db)
+            embed.description = "\n".join(
+                f"#{o.id} {'🟢 Покупка' if o.side == SIDE_BUY else '🔴 Продажа'} "
+                f"**{modules.get(o.module_id, o.module_id)}** x{o.remaining}/{o.quantity} по {format_currency(o.price)}"
+                for o in orders
+            )[:4096]
+            await ctx.send(embed=embed)
+            return
+
+        module = await self.db.get_module(module_id)
+        if not module:
+            await ctx.send(f"❌ Модуль с ID {module_id} не существует.")
+            return
+
+        book = self.exchange.book(ctx.guild.id, module_id)
+        embed = discord.Embed(title=f"📊 Биржа: {module['name']} (ID: {module_id})", color=0x3498db)
+        for side, title in ((SIDE_SELL, "🔴 Продают"), (SIDE_BUY, "🟢 Покупают")):
+            levels = book.depth(side, ORDER_BOOK_LEVELS_SHOWN)
+            embed.add_field(
+                name=title,
+                value="\n".join(f"{format_currency(price)} — x{count}" for price, count in levels) or "—",
+                inline=True
+            )
+        await ctx.send(embed=embed)
+
+
+async def setup(bot):
+    await bot.add_cog(PlayerExchange(bot))
@@ -3,6 +3,8 @@ from discord.ext import commands
 from models.database import Database
 from models.schemas import ShipStatus
 from utils.helpers import parse_ship_input, format_currency
+from utils.fitting import preset_loadout
+from utils.locations import CATALOG
 
 class FleetManager(commands.Cog):
     """Управление флотом игрока"""
@@ -167,28 +169,11 @@ class FleetManager(commands.Cog):
 
     async def equip_default_modules(self, ship):
         """Устанавливает базовые модули из пресетов"""
-        from utils.ship_presets import SHIP_PRESETS
-        
-        project_key = ship.project.lower()
-        if project_key not in SHIP_PRESETS:
-            return
-
-        preset = SHIP_PRESETS[project_key]
-        all_modules = await self.db.get_all_modules()
-        
-        def find_id(name_part):
-            for m in all_modules:
-                if name_part.lower() in m['name'].lower():
-                    return m['id']
-            return None
-
-        for mod_name, count in preset["loadout"]:
-            mod_id = find_id(mod_name)
-            if mod_id:
-                try:
-                    await self.db.add_module_to_ship(ship.id, mod_id, count)
-                except Exception as e:
-                    print(f"Error adding module {mod_name}: {e}")
+        if not CATALOG.ready:
+            CATALOG.rebuild(await self.db.get_all_modules())
+        loadout = preset_loadout(ship.project, CATALOG)
+        if loadout:
+            await self.db.add_modules_to_ship(ship.id, loadout)
     
     @commands.command(name="корабль", aliases=["ship", "stats", "статистика"])
     async def show_ship_stats(self, ctx, *, callsign: str):
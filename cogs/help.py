@@ -48,7 +48,16 @@ class HelpCog(commands.Cog):
             value="`!ход` - Следующий игровой ход\n"
                   "`!дать_ресурсы @игрок [тип] [количество]` - Выдать ресурсы\n"
                   "`!сбросить @игрок` - Удалить флот\n"
-                  "`!перелет @игрок [км] [название] [спец]` - Переместить флот",
+                  "`!перелет @игрок [км] [название]` - Перелёт по маршруту карты (с км - напрямую)\n"
+                  "`!локация_добавить \"Название\" [спец]` / `!локация_удалить` - Локации карты\n"
+                  "`!маршрут_добавить \"A\" \"B\" [км]` / `!маршрут_удалить \"A\" \"B\"` - Маршруты",
+            inline=False
+        )
+
+        embed.add_field(
+            name="🗺️ Навигация",
+            value="`!карта` - Локации и прямые маршруты\n"
+                  "`!маршрут [название]` - Кратчайший путь и расход метана",
             inline=False
         )
 
@@ -56,16 +65,34 @@ class HelpCog(commands.Cog):
             name="🏪 Рынок и Инвентарь",
             value="`!склад` - Показать инвентарь\n"
                   "`!магазин` - Товары в текущей локации\n"
-                  "`!купить [ID] [кол-во]` - Купить модуль\n"
-                  "`!продать [ID] [кол-во]` - Продать модуль\n"
-                  "`!оснастить [позывной] [ID]` - Установить модуль\n"
-                  "`!снять [позывной] [ID]` - Снять модуль",
+                  "`!найти оружие урон>500 вес<300 сорт:-залп` - Поиск модулей по характеристикам\n"
+                  "`!купить [ID или название] [кол-во]` - Купить модуль\n"
+                  "`!продать [ID или название] [кол-во]` - Продать модуль\n"
+                  "`!корзина [ID:кол-во ...]` - Добавить в корзину или показать её\n"
+                  "`!корзина_убрать [ID]` / `!корзина_очистить` - Правка корзины\n"
+                  "`!оформить` - Купить всю корзину одной операцией\n"
+                  "`!продать_пакет [ID:кол-во ...]` - Продать несколько позиций разом\n"
+                  "`!заявка_купить` / `!заявка_продать [ID] [кол-во] [цена]` - Заявки на бирже игроков\n"
+                  "`!биржа [ID]` - Стакан модуля или свои заявки, `!заявка_отменить [№]` - Отмена\n"
+                  "`!оснастить [позывной] 12 7:2 -3` - Установить и снять модули одной операцией\n"
+                  "`!снять [позывной] [ID[:кол-во] ...]` - Снять модули на склад\n"
+                  "`!шаблон_сохранить [имя] [позывной]` / `!шаблоны` / `!шаблон_удалить [имя]` - Шаблоны оснастки\n"
+                  "`!шаблон_применить [имя] [позывной или класс]` - Переоснастить по шаблону одной операцией",
             inline=False
         )
 
         embed.add_field(
             name="⚔️ Боевая система",
             value="`!бой @враг [дистанция]` - Начать сражение\n"
+                  "`!бой @враг [дистанция] авто` - Провести бой целиком и показать итог\n"
+                  "`!бой @враг [дистанция] масса` - Массовый бой: одинаковые корабли сражаются стеками, всегда автоматически, без доктрин и манёвров\n"
+                  "`!бой_альянс @союзник против @враг [дистанция]` - Бой союзов: несколько флотилий на сторону\n"
+                  "Кнопки ⏩/⏪ в бою меняют дистанцию: у пушек, артиллерии и ракет разная дальность\n"
+                  "Доктрина целеуказания - последним аргументом или меню в бою: `фокус`, `угроза`, `добивание`, `про`, `случайно`\n"
+                  "`!боевая_статистика [@игрок]` - Боевая статистика\n"
+                  "`!рекорды [победы/уничтожено/урон]` - Рекорды и лидеры сервера\n"
+                  "`!история [@игрок]` - Последние бои, `!повтор <id>` - повтор боя по ходам\n"
+                  "Ракеты можно перехватить: ПРО Палаш-1 и ловушки АСО-75 защищают свой корабль\n"
                   "В бою учитываются модули кораблей и их состояние.",
             inline=False
         )
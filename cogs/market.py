@@ -1,50 +1,74 @@
+import logging
+
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from models.database import Database
-from models.schemas import ModuleType
 from utils.helpers import format_currency
+from utils.constants import SELL_PRICE_MULTIPLIER, CART_MAX_LINES, PRICE_FLUSH_SECONDS
 from utils.game_mechanics import MODULE_PROTOTYPES, seed_modules
+from models.schemas import ShipStatus
+from utils.fitting import (
+    parse_refit, refit_loadout, fit_stats, loadout_diff, stock_shortages, preset_loadout
+)
+from utils.locations import CATALOG
+from utils.module_query import parse_query, format_stat
+from utils.pricing import PricingEngine
+
+logger = logging.getLogger('elaim_bot')
+
+# Название ресурса -> поле флота
+RESOURCE_ALIASES = {
+    "rations": "rations", "пайки": "rations", "провиант": "rations",
+    "methane": "methane", "метан": "methane", "топливо": "methane", "fuel": "methane",
+}
+RESOURCE_NAMES = {"rations": "🍞 Пайки", "methane": "⛽ Метан"}
+
+
+def parse_order(tokens, resolve=None):
+    """
+    Разбор позиций вида `ID`, `ID:кол-во`, `метан:кол-во`; с resolve (ShopCatalog.resolve)
+    вместо ID допускается название модуля.
+    Возвращает {module_id или ресурс: кол-во} (повторы складываются) или None при ошибке.
+    """
+    order = {}
+    for token in tokens:
+        name, _, count = token.partition(":")
+        if count and not count.isdigit():
+            return None
+        count = int(count) if count else 1
+        if name.lower() in RESOURCE_ALIASES:
+            key = RESOURCE_ALIASES[name.lower()]
+        else:
+            key = resolve(name) if resolve else (int(name) if name.isdigit() else None)
+        if key is None or count <= 0:
+            return None
+        order[key] = order.get(key, 0) + count
+    return order
 
 class ShopView(discord.ui.View):
-    def __init__(self, items, fleet, discount, methane_discount, items_per_page=8):
+    def __init__(self, catalog, fleet):
         super().__init__(timeout=60)
-        self.items = items
+        # Каталог специализации уже собран и оценён: страницы только отображаются
+        self.catalog = catalog
         self.fleet = fleet
-        self.discount = discount
-        self.methane_discount = methane_discount
-        self.items_per_page = items_per_page
         self.current_page = 0
-        self.total_pages = (len(items) - 1) // items_per_page + 1 if items else 1
+        self.total_pages = catalog.total_pages
 
     def create_embed(self):
+        spec = self.catalog.spec
         embed = discord.Embed(
             title=f"🏪 Магазин - {self.fleet.location}",
-            description=f"Специализация: **{self.fleet.location_spec}**\nСкидка: **{int((1-self.discount)*100)}%**\nСтраница {self.current_page + 1}/{self.total_pages}",
+            description=f"Специализация: **{self.fleet.location_spec}**\nСкидка: **{int((1-spec.discount)*100)}%**\nСтраница {self.current_page + 1}/{self.total_pages}",
             color=0xf1c40f
         )
         
         # Resources (always on first page)
         if self.current_page == 0:
-            rations_price = 10
-            methane_price = 5
-            res_text = (
-                f"🍞 **Пайки** (`rations`)\nЦена: {format_currency(int(rations_price * self.discount))}\n"
-                f"⛽ **Метан** (`methane`)\nЦена: {format_currency(int(methane_price * self.methane_discount))}"
-            )
-            embed.add_field(name="📦 Ресурсы", value=res_text, inline=False)
+            embed.add_field(name="📦 Ресурсы", value=self.catalog.resources_field, inline=False)
 
         # Modules
-        start = self.current_page * self.items_per_page
-        end = start + self.items_per_page
-        page_items = self.items[start:end]
-
-        for mod in page_items:
-            price = int(mod['price'] * self.discount)
-            embed.add_field(
-                name=f"{mod['name']} (ID: {mod['id']})",
-                value=f"Цена: {format_currency(price)}\nВес: {mod['weight']}т",
-                inline=True
-            )
+        for name, value in self.catalog.pages[self.current_page]:
+            embed.add_field(name=name, value=value, inline=True)
             
         embed.set_footer(text="Купить: !купить [ID или rations/methane] [Кол-во]")
         return embed
@@ -71,11 +95,95 @@ class Market(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.db: Database = bot.db
+        # Общий каталог: магазин, оснащение, пресеты и поиск модулей по названию
+        self.catalog = CATALOG
+        # Корзины в памяти: (guild_id, user_id) -> {module_id или ресурс: кол-во}
+        self.carts = {}
+        # Рыночные индексы локаций; изменения пишутся в БД пакетами
+        self.pricing = PricingEngine()
+
+    async def cog_load(self):
+        self.pricing.load(await self.db.get_market_prices())
+        self.flush_prices.start()
+
+    async def cog_unload(self):
+        self.flush_prices.cancel()
+        await self.save_prices()
+
+    @tasks.loop(seconds=PRICE_FLUSH_SECONDS)
+    async def flush_prices(self):
+        await self.save_prices()
+
+    async def save_prices(self):
+        """Сбрасывает изменённые рыночные индексы в БД одной транзакцией"""
+        batch = self.pricing.take_dirty()
+        if batch is None:
+            return
+        try:
+            await self.db.save_market_prices(*batch)
+        except Exception as e:
+            self.pricing.restore_dirty(batch)
+            logger.error(f"Ошибка записи рыночных цен: {e}")
     
     @commands.Cog.listener()
     async def on_ready(self):
         """Seed modules on startup"""
         await seed_modules(self.db)
+        await self.refresh_catalog()
+
+    @commands.Cog.listener()
+    async def on_game_turn(self, guild_id: int):
+        """Затухание спроса и предложения на рынках сервера после !ход"""
+        self.pricing.decay(guild_id)
+        await self.save_prices()
+
+    async def refresh_catalog(self):
+        """Пересобирает каталоги специализаций. Вызывать при изменении модулей или цен."""
+        self.catalog.rebuild(await self.db.get_all_modules())
+
+    async def get_catalog(self, fleet):
+        """Каталог текущей локации флота с рыночными ценами"""
+        if not self.catalog.ready:
+            await self.refresh_catalog()
+        return self.catalog.for_market(fleet.location_spec, self.pricing.market(fleet.guild_id, fleet.location))
+
+    async def find_module(self, ctx, query: str):
+        """Модуль каталога по ID или названию; сообщает об ошибке и возвращает None"""
+        if not self.catalog.ready:
+            await self.refresh_catalog()
+        module_id = self.catalog.resolve(query)
+        if module_id is not None:
+            return self.catalog.modules[module_id]
+        candidates = self.catalog.candidates(query)
+        if candidates:
+            names = ", ".join(f"**{m.name}** (ID: {m.id})" for m in candidates)
+            await ctx.send(f"❓ Уточните модуль: {names}")
+        else:
+            await ctx.send(f"❌ Модуль '{query}' не найден.")
+        return None
+
+    def suggestions(self, tokens) -> str:
+        """Подсказка по первому нераспознанному названию модуля в позициях"""
+        for token in tokens:
+            name = token.lstrip("+-").partition(":")[0]
+            if name.isdigit() or name.lower() in RESOURCE_ALIASES or self.catalog.resolve(name) is not None:
+                continue
+            candidates = self.catalog.candidates(name)
+            if candidates:
+                names = ", ".join(f"**{m.name}** (ID: {m.id})" for m in candidates)
+                return f"\n❓ Уточните '{name}': {names}"
+            return ""
+        return ""
+
+    async def resolver(self):
+        if not self.catalog.ready:
+            await self.refresh_catalog()
+        return self.catalog.resolve
+
+    def sell_price(self, fleet, module, count: int) -> int:
+        """Цена выкупа за штуку при продаже count модулей рынку локации (средняя по партии)"""
+        factor = self.pricing.quote(fleet.guild_id, fleet.location, module.id, -count)
+        return int(module.base_price * factor * SELL_PRICE_MULTIPLIER)
 
     # --- INVENTORY ---
 
@@ -104,36 +212,7 @@ class Market(commands.Cog):
         embed.description = text
         await ctx.send(embed=embed)
 
-    # --- SHOP & MOVEMENT ---
-
-    @commands.command(name="перелет", aliases=["travel", "move"])
-    @commands.has_permissions(administrator=True) # Admin only as requested
-    async def admin_move_fleet(self, ctx, member: discord.Member, distance: int, location_name: str, *, spec: str):
-        """
-        [АДМИН] Переместить флот игрока
-        !перелет @игрок [расстояние] "Название" [Специализация]
-        Пример: !перелет @User 300 "Кушан" Топливохранилище
-        """
-        fleet = await self.db.get_fleet_by_user(member.id, ctx.guild.id)
-        if not fleet:
-            await ctx.send(f"❌ У {member.mention} нет флотилии.")
-            return
-            
-        await self.db.update_fleet_location(fleet.id, location_name, spec)
-        
-        fleet_full = await self.db.get_fleet_with_ships(fleet.id)
-        methane_cost = int((fleet_full.methane_per_100km / 100) * distance)
-        
-        # Deduct fuel
-        new_methane = max(0, fleet.methane - methane_cost)
-        await self.db.update_fleet_resources(fleet.id, methane=new_methane)
-        
-        await ctx.send(
-            f"🚀 **Перелет завершен**\n"
-            f"Флот: {fleet.name}\n"
-            f"Новая локация: {location_name} ({spec})\n"
-            f"Потрачено топлива: {methane_cost} тонн (Ост: {new_methane})"
-        )
+    # --- SHOP ---
 
     @commands.command(name="магазин", aliases=["shop", "store"])
     async def show_shop(self, ctx):
@@ -145,32 +224,15 @@ class Market(commands.Cog):
         if not fleet:
             await ctx.send("❌ У вас нет флотилии.")
             return
-            
-        spec = fleet.location_spec.lower()
-        discount = 0.7 if "база флота" in spec else 1.0
-        methane_discount = 0.5 if "топливохранилище" in spec else 1.0
-        
-        available_types = []
-        if "база флота" in spec:
-             available_types = [ModuleType.WEAPON, ModuleType.AMMO, ModuleType.FUEL_TANK, ModuleType.HULL, ModuleType.ARMOR, ModuleType.ENGINE]
-        elif "торговцы" in spec:
-            available_types = [t for t in ModuleType]
-        elif "топливохранилище" in spec:
-            available_types = [ModuleType.FUEL_TANK]
-        else:
-             available_types = [ModuleType.ARMOR, ModuleType.FUEL_TANK]
 
-        all_modules = await self.db.get_all_modules()
-        shop_modules = [m for m in all_modules if m['type'] in available_types or "торговцы" in spec or "база" in spec]
-        
-        view = ShopView(shop_modules, fleet, discount, methane_discount)
+        view = ShopView(await self.get_catalog(fleet), fleet)
         await ctx.send(embed=view.create_embed(), view=view)
 
     @commands.command(name="купить", aliases=["buy"])
     async def buy_item(self, ctx, item_identifier: str, amount: int = 1):
         """
         Купить предмет или ресурс
-        Использование: !купить [ID или rations/methane] [количество]
+        Использование: !купить [ID, название или rations/methane] [количество]
         """
         if amount <= 0:
             await ctx.send("❌ Количество должно быть положительным.")
@@ -181,126 +243,488 @@ class Market(commands.Cog):
             await ctx.send("❌ У вас нет флотилии.")
             return
             
-        spec = fleet.location_spec.lower()
-        discount = 0.7 if "база флота" in spec else 1.0
+        catalog = await self.get_catalog(fleet)
 
-        if item_identifier.lower() in ["rations", "пайки", "провиант"]:
-            price = int(10 * discount) * amount
-            if fleet.gold < price:
+        resource = RESOURCE_ALIASES.get(item_identifier.lower())
+        if resource == "rations":
+            unit_price = catalog.resource_price('rations', amount)
+            price = unit_price * amount
+            if await self.db.buy_resource(fleet.id, 'rations', amount, unit_price) is None:
                 await ctx.send(f"❌ Недостаточно средств! Нужно {format_currency(price)}")
                 return
-            await self.db.update_fleet_resources(fleet.id, gold=fleet.gold - price, rations=fleet.rations + amount)
+            self.pricing.record_trade(fleet.guild_id, fleet.location, 'rations', amount)
             await ctx.send(f"✅ Куплено: **Пайки** x{amount} за {format_currency(price)}")
             return
 
-        if item_identifier.lower() in ["methane", "метан", "топливо", "fuel"]:
-            fuel_discount = 0.5 if "топливохранилище" in spec else 1.0
-            price = int(5 * fuel_discount) * amount
-            if fleet.gold < price:
+        if resource == "methane":
+            unit_price = catalog.resource_price('methane', amount)
+            price = unit_price * amount
+            if await self.db.buy_resource(fleet.id, 'methane', amount, unit_price) is None:
                 await ctx.send(f"❌ Недостаточно средств! Нужно {format_currency(price)}")
                 return
-            await self.db.update_fleet_resources(fleet.id, gold=fleet.gold - price, methane=fleet.methane + amount)
+            self.pricing.record_trade(fleet.guild_id, fleet.location, 'methane', amount)
             await ctx.send(f"✅ Куплено: **Метан** {amount} тонн за {format_currency(price)}")
             return
 
-        if not item_identifier.isdigit():
-            await ctx.send("❌ Неверный ID модуля или название ресурса.")
+        found = await self.find_module(ctx, item_identifier)
+        if not found:
             return
             
-        item_id = int(item_identifier)
-        module = await self.db.get_module(item_id)
+        item_id = found.id
+        # Цена за штуку - средняя по всей партии: крупная покупка сама двигает цену
+        module = catalog.quote(item_id, amount)
         if not module:
-            await ctx.send("❌ Предмет не найден.")
+            await ctx.send("❌ Этот предмет не продаётся в текущей локации.")
             return
             
-        total_price = int(module['price'] * discount * amount)
-        if fleet.gold < total_price:
+        total_price = module.price * amount
+        # Списание и зачисление на склад - одна транзакция с проверкой баланса
+        if await self.db.buy_module(fleet.id, item_id, amount, module.price) is None:
             await ctx.send(f"❌ Недостаточно средств! Нужно {format_currency(total_price)}")
             return
             
-        await self.db.update_fleet_resources(fleet.id, gold=fleet.gold - total_price)
-        await self.db.add_module_to_inventory(fleet.id, item_id, amount)
-        await ctx.send(f"✅ Куплено: {module['name']} x{amount} за {format_currency(total_price)}")
+        self.pricing.record_trade(fleet.guild_id, fleet.location, item_id, amount)
+        await ctx.send(f"✅ Куплено: {module.name} x{amount} за {format_currency(total_price)}")
 
     @commands.command(name="продать", aliases=["sell"])
-    async def sell_item(self, ctx, item_id: int, amount: int = 1):
-        """Продать предмет из инвентаря (50% от стоимости)"""
+    async def sell_item(self, ctx, item_identifier: str, amount: int = 1):
+        """Продать предмет из инвентаря (50% от рыночной стоимости в локации)"""
+        if amount <= 0:
+            await ctx.send("❌ Количество должно быть положительным.")
+            return
+
         fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
         if not fleet:
             await ctx.send("❌ У вас нет флотилии.")
             return
         
-        module = await self.db.get_module(item_id)
+        module = await self.find_module(ctx, item_identifier)
         if not module:
-            await ctx.send(f"❌ Модуль с ID {item_id} не существует.")
             return
         
-        success = await self.db.remove_module_from_inventory(fleet.id, item_id, amount)
-        if not success:
+        item_id = module.id
+        unit_price = self.sell_price(fleet, module, amount)
+        if await self.db.sell_module(fleet.id, item_id, amount, unit_price) is None:
             await ctx.send("❌ Недостаточно предметов на складе.")
             return
             
-        sell_price = int(module['price'] * 0.5 * amount)
-        await self.db.update_fleet_resources(fleet.id, gold=fleet.gold + sell_price)
-        await ctx.send(f"✅ Продано: {module['name']} x{amount} за {format_currency(sell_price)}")
+        self.pricing.record_trade(fleet.guild_id, fleet.location, item_id, -amount)
+        await ctx.send(f"✅ Продано: {module.name} x{amount} за {format_currency(unit_price * amount)}")
 
-    @commands.command(name="оснастить", aliases=["equip", "fit"])
-    async def equip_ship(self, ctx, callsign: str, module_id: int):
-        """Установить модуль со склада на корабль"""
+    # --- SEARCH ---
+
+    @commands.command(name="найти", aliases=["find", "search"])
+    async def find_modules(self, ctx, *terms: str):
+        """
+        Поиск модулей по характеристикам
+        Пример: !найти оружие урон>500 вес<300 сорт:-залп лимит:5
+        Характеристики: вес, цена, урон, точность, выстрелы, тяга, прочность, залп, тяга_на_тонну, залп_на_тонну
+        """
+        if not terms:
+            await ctx.send("❌ Укажите условия. Пример: `!найти двигатель сорт:-тяга_на_тонну`")
+            return
+        try:
+            query = parse_query(terms)
+        except ValueError as e:
+            await ctx.send(f"❌ {e}")
+            return
+
+        if not self.catalog.ready:
+            await self.refresh_catalog()
+        index = self.catalog.stat_index
+        rows = index.query(query)
+        if not rows:
+            await ctx.send("🔍 Ничего не найдено.")
+            return
+
+        columns = query.columns
+        lines = []
+        for row in rows:
+            module = self.catalog.modules[index.ids[row]]
+            shown = " | ".join(f"{column}: {format_stat(index.value(row, column))}" for column in columns)
+            lines.append(f"**{module.name}** (ID: {module.id}) — {module.type}, {module.weight}т, "
+                         f"{format_currency(module.base_price)}" + (f"\n└ {shown}" if shown else ""))
+        embed = discord.Embed(title=f"🔍 Поиск: {' '.join(terms)}"[:256],
+                              description="\n".join(lines)[:4096], color=0x3498db)
+        embed.set_footer(text=f"Показано {len(rows)} из каталога в {len(index)} модулей")
+        await ctx.send(embed=embed)
+
+    # --- CART ---
+
+    def price_order(self, catalog, order):
+        """
+        Оценка заказа по каталогу локации.
+        Возвращает (модули [(id, кол-во, цена)], ресурсы {ресурс: (кол-во, цена)}, строки, итог, не продаются).
+        """
+        modules, resources, lines, missing = [], {}, [], []
+        total = 0
+        for key, count in order.items():
+            if isinstance(key, str):
+                price = catalog.resource_price(key, count)
+                resources[key] = (count, price)
+                name = RESOURCE_NAMES[key]
+            else:
+                item = catalog.quote(key, count)
+                if not item:
+                    module = self.catalog.modules.get(key)
+                    missing.append(module.name if module else f"ID {key}")
+                    continue
+                price = item.price
+                modules.append((key, count, price))
+                name = f"{item.name} (ID: {key})"
+            total += price * count
+            lines.append(f"**{name}** x{count} — {format_currency(price * count)}")
+        return modules, resources, lines, total, missing
+
+    @commands.command(name="корзина", aliases=["cart"])
+    async def cart(self, ctx, *items: str):
+        """
+        Добавить позиции в корзину или показать её
+        Использование: !корзина 12:4 7 метан:500
+        """
         fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
         if not fleet:
             await ctx.send("❌ У вас нет флотилии.")
             return
-        
-        ships = await self.db.get_ships_by_fleet(fleet.id)
-        target_ship = next((s for s in ships if s.callsign.lower() == callsign.lower()), None)
-        if not target_ship:
+
+        key = (ctx.guild.id, ctx.author.id)
+        cart = self.carts.get(key, {})
+        if items:
+            order = parse_order(items, await self.resolver())
+            if order is None:
+                await ctx.send("❌ Неверная позиция или неизвестный модуль. Формат: `ID` или название, `ID:кол-во`, `метан:кол-во`."
+                               + self.suggestions(items))
+                return
+            merged = dict(cart)
+            for item, count in order.items():
+                merged[item] = merged.get(item, 0) + count
+            if len(merged) > CART_MAX_LINES:
+                await ctx.send(f"❌ В корзине не больше {CART_MAX_LINES} позиций.")
+                return
+            cart = self.carts[key] = merged
+
+        if not cart:
+            await ctx.send("🛒 Корзина пуста. Добавить: `!корзина ID:кол-во ...`")
+            return
+
+        catalog = await self.get_catalog(fleet)
+        _, _, lines, total, missing = self.price_order(catalog, cart)
+        embed = discord.Embed(
+            title=f"🛒 Корзина - {fleet.location}",
+            description="\n".join(lines) or "—",
+            color=0xf1c40f
+        )
+        if missing:
+            embed.add_field(name="⚠️ Не продаётся здесь", value="\n".join(missing), inline=False)
+        embed.add_field(name="Итого", value=f"{format_currency(total)} (баланс {format_currency(fleet.gold)})", inline=False)
+        embed.set_footer(text="!оформить - купить всё | !корзина_убрать ID | !корзина_очистить")
+        await ctx.send(embed=embed)
+
+    @commands.command(name="корзина_убрать", aliases=["cart_remove"])
+    async def cart_remove(self, ctx, item_identifier: str):
+        """Убрать позицию из корзины"""
+        cart = self.carts.get((ctx.guild.id, ctx.author.id), {})
+        order = parse_order([item_identifier], await self.resolver())
+        item = next(iter(order)) if order else None
+        if item not in cart:
+            await ctx.send("❌ Такой позиции нет в корзине.")
+            return
+        del cart[item]
+        await ctx.send("✅ Позиция убрана из корзины.")
+
+    @commands.command(name="корзина_очистить", aliases=["cart_clear"])
+    async def cart_clear(self, ctx):
+        """Очистить корзину"""
+        self.carts.pop((ctx.guild.id, ctx.author.id), None)
+        await ctx.send("🗑️ Корзина очищена.")
+
+    @commands.command(name="оформить", aliases=["checkout"])
+    async def checkout(self, ctx):
+        """Купить всё содержимое корзины одной операцией по ценам текущей локации"""
+        fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send("❌ У вас нет флотилии.")
+            return
+
+        key = (ctx.guild.id, ctx.author.id)
+        cart = self.carts.get(key)
+        if not cart:
+            await ctx.send("🛒 Корзина пуста.")
+            return
+
+        catalog = await self.get_catalog(fleet)
+        modules, resources, lines, total, missing = self.price_order(catalog, cart)
+        if missing:
+            await ctx.send(f"❌ В текущей локации не продаётся: {', '.join(missing)}. Уберите эти позиции.")
+            return
+
+        # Баланс проверяется и списывается в той же транзакции, что и зачисление всех позиций
+        gold = await self.db.checkout(fleet.id, modules, resources)
+        if gold is None:
+            await ctx.send(f"❌ Недостаточно средств! Нужно {format_currency(total)}")
+            return
+
+        del self.carts[key]
+        for item, count in cart.items():
+            self.pricing.record_trade(fleet.guild_id, fleet.location, item, count)
+        embed = discord.Embed(title="✅ Заказ оформлен", description="\n".join(lines), color=0x2ecc71)
+        embed.add_field(name="Итого", value=f"{format_currency(total)} (остаток {format_currency(gold)})", inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.command(name="продать_пакет", aliases=["sell_bulk", "распродать"])
+    async def sell_bulk(self, ctx, *items: str):
+        """
+        Продать несколько позиций со склада одной операцией
+        Использование: !продать_пакет 12:4 7
+        """
+        order = parse_order(items, await self.resolver())
+        if not order or any(isinstance(item, str) for item in order):
+            await ctx.send("❌ Укажите модули в формате `ID` (или название) и `ID:кол-во`." + self.suggestions(items))
+            return
+
+        fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send("❌ У вас нет флотилии.")
+            return
+
+        if not self.catalog.ready:
+            await self.refresh_catalog()
+        sale, lines = [], []
+        total = 0
+        for module_id, count in order.items():
+            module = self.catalog.modules.get(module_id)
+            if not module:
+                await ctx.send(f"❌ Модуль с ID {module_id} не существует.")
+                return
+            unit_price = self.sell_price(fleet, module, count)
+            sale.append((module_id, count, unit_price))
+            total += unit_price * count
+            lines.append(f"**{module.name}** x{count} — {format_currency(unit_price * count)}")
+
+        if await self.db.sell_modules(fleet.id, sale) is None:
+            await ctx.send("❌ Недостаточно предметов на складе. Ничего не продано.")
+            return
+
+        for module_id, count, _ in sale:
+            self.pricing.record_trade(fleet.guild_id, fleet.location, module_id, -count)
+        embed = discord.Embed(title="✅ Продано", description="\n".join(lines), color=0x2ecc71)
+        embed.add_field(name="Выручка", value=format_currency(total), inline=False)
+        await ctx.send(embed=embed)
+
+    # --- FITTING ---
+
+    async def refit(self, ctx, callsign: str, changes):
+        """Применить изменения оснастки одной транзакцией и показать итоговые характеристики"""
+        if not changes:
+            await ctx.send("❌ Укажите модули: `ID`, `ID:кол-во`, `-ID` для снятия.")
+            return
+
+        fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send("❌ У вас нет флотилии.")
+            return
+
+        ship = await self.db.get_ship_by_callsign(fleet.id, callsign)
+        if not ship:
             await ctx.send(f"❌ Корабль '{callsign}' не найден.")
             return
 
-        inv = await self.db.get_inventory(fleet.id)
-        inv_item = next((i for i in inv if i['module_id'] == module_id), None)
-        if not inv_item or inv_item['count'] < 1:
-            await ctx.send("❌ Модуль отсутствует на складе.")
+        if not self.catalog.ready:
+            await self.refresh_catalog()
+        unknown = [module_id for module_id in changes if module_id not in self.catalog.modules]
+        if unknown:
+            await ctx.send(f"❌ Модуль с ID {unknown[0]} не существует.")
             return
 
-        module = inv_item['module']
-        current_modules = await self.db.get_ship_modules(target_ship.id)
-        
-        curr_weight = sum(m['weight'] * m['count'] for m in current_modules)
-        curr_thrust = sum(m['module']['stats'].get('thrust', 0) * m['count'] for m in current_modules if m['type'] == 'двигатель')
-        
-        new_weight = curr_weight + module['weight']
-        new_thrust = curr_thrust + module['stats'].get('thrust', 0) if module['type'] == 'двигатель' else curr_thrust
-        
-        if new_weight > new_thrust:
-            await ctx.send(f"⚠️ **Внимание:** Корабль перегружен! (Тяга {new_thrust} < Вес {new_weight})")
-        
-        await self.db.remove_module_from_inventory(fleet.id, module_id, 1)
-        await self.db.add_module_to_ship(target_ship.id, module_id, 1)
-        await ctx.send(f"✅ Модуль **{module['name']}** установлен на **{target_ship.callsign}**")
+        fitted = {sm.module_id: sm.count for sm in ship.modules}
+        stock = await self.db.get_inventory_counts(fleet.id, [m for m, delta in changes.items() if delta > 0])
+        for module_id, delta in changes.items():
+            name = self.catalog.modules[module_id].name
+            if delta > 0 and stock.get(module_id, 0) < delta:
+                await ctx.send(f"❌ На складе нет {name} x{delta} (есть {stock.get(module_id, 0)}).")
+                return
+            if delta < 0 and fitted.get(module_id, 0) < -delta:
+                await ctx.send(f"❌ На **{ship.callsign}** не установлено {name} x{-delta}.")
+                return
+
+        if not await self.db.refit_ship(fleet.id, ship.id, changes):
+            await ctx.send("❌ Склад или оснастка изменились во время операции. Ничего не изменено.")
+            return
+
+        before = fit_stats(ship)
+        after = fit_stats(refit_loadout(ship, changes, self.catalog.modules))
+        embed = discord.Embed(title=f"🔧 Переоснащение {ship.callsign}", color=0x3498db)
+        embed.description = "\n".join(
+            f"{'➕' if delta > 0 else '➖'} **{self.catalog.modules[module_id].name}** x{abs(delta)}"
+            for module_id, delta in changes.items()
+        )
+        embed.add_field(name="Вес / Тяга", value=f"{before.weight}/{before.thrust} → **{after.weight}/{after.thrust}**")
+        embed.add_field(name="TWR", value=f"{before.twr:.2f} → **{after.twr:.2f}**")
+        embed.add_field(name="Уклонение", value=f"{before.evasion:.0%} → **{after.evasion:.0%}**")
+        if not after.flyable:
+            embed.add_field(name="⚠️ Внимание",
+                            value=f"Корабль перегружен! (Тяга {after.thrust} < Вес {after.weight})", inline=False)
+            embed.color = 0xe67e22
+        await ctx.send(embed=embed)
+
+    @commands.command(name="оснастить", aliases=["equip", "fit"])
+    async def equip_ship(self, ctx, callsign: str, *modules: str):
+        """
+        Установить модули со склада и снять лишние одной операцией
+        Использование: !оснастить [позывной] 12 7:2 -3
+        """
+        changes = parse_refit(modules, resolve=await self.resolver())
+        if changes is None:
+            await ctx.send("❌ Неверный формат или неизвестный модуль. Пример: `!оснастить Орёл 12 Сталь-1:2 -3`"
+                           + self.suggestions(modules))
+            return
+        await self.refit(ctx, callsign, changes)
 
     @commands.command(name="снять", aliases=["unequip", "strip"])
-    async def unequip_ship(self, ctx, callsign: str, module_id: int):
-        """Снять модуль с корабля на склад"""
+    async def unequip_ship(self, ctx, callsign: str, *modules: str):
+        """
+        Снять модули с корабля на склад
+        Использование: !снять [позывной] 12 7:2
+        """
+        changes = parse_refit(modules, sign=-1, resolve=await self.resolver())
+        if changes is None:
+            await ctx.send("❌ Неверный формат или неизвестный модуль. Пример: `!снять Орёл 12 Сталь-1:2`"
+                           + self.suggestions(modules))
+            return
+        await self.refit(ctx, callsign, changes)
+
+    # --- LOADOUT TEMPLATES ---
+
+    @commands.command(name="шаблон_сохранить", aliases=["save_loadout"])
+    async def save_template(self, ctx, name: str, *, callsign: str):
+        """
+        Сохранить оснастку корабля как шаблон
+        Использование: !шаблон_сохранить [имя] [позывной]
+        """
         fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
         if not fleet:
             await ctx.send("❌ У вас нет флотилии.")
             return
 
-        ships = await self.db.get_ships_by_fleet(fleet.id)
-        target_ship = next((s for s in ships if s.callsign.lower() == callsign.lower()), None)
-        if not target_ship:
+        ship = await self.db.get_ship_by_callsign(fleet.id, callsign)
+        if not ship:
             await ctx.send(f"❌ Корабль '{callsign}' не найден.")
             return
-            
-        success = await self.db.remove_module_from_ship(target_ship.id, module_id, 1)
-        if not success:
-            await ctx.send("❌ Этот модуль не установлен на корабле.")
+
+        loadout = {sm.module_id: sm.count for sm in ship.modules if sm.count > 0}
+        await self.db.save_loadout_template(fleet.id, name, loadout)
+        await ctx.send(f"✅ Шаблон **{name}** сохранён с **{ship.callsign}** ({sum(loadout.values())} модулей).")
+
+    @commands.command(name="шаблоны", aliases=["loadouts"])
+    async def list_templates(self, ctx):
+        """Показать сохранённые шаблоны оснастки"""
+        fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send("❌ У вас нет флотилии.")
+            return
+
+        templates = await self.db.get_loadout_templates(fleet.id)
+        if not templates:
+            await ctx.send("📐 Шаблонов нет. Сохранить: `!шаблон_сохранить [имя] [позывной]`")
+            return
+
+        if not self.catalog.ready:
+            await self.refresh_catalog()
+        embed = discord.Embed(title=f"📐 Шаблоны оснастки {fleet.name}", color=0x3498db)
+        for template in templates[:25]:
+            value = "\n".join(
+                f"• {self.catalog.modules[m].name if m in self.catalog.modules else f'ID {m}'} x{count}"
+                for m, count in template['modules'].items()
+            ) or "—"
+            embed.add_field(name=template['name'], value=value[:1024], inline=True)
+        await ctx.send(embed=embed)
+
+    @commands.command(name="шаблон_удалить", aliases=["delete_loadout"])
+    async def delete_template(self, ctx, *, name: str):
+        """Удалить шаблон оснастки"""
+        fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send("❌ У вас нет флотилии.")
             return
 
-        await self.db.add_module_to_inventory(fleet.id, module_id, 1)
-        await ctx.send(f"✅ Модуль снят и отправлен на склад.")
+        if not await self.db.delete_loadout_template(fleet.id, name):
+            await ctx.send(f"❌ Шаблон '{name}' не найден.")
+            return
+        await ctx.send(f"🗑️ Шаблон **{name}** удалён.")
+
+    @commands.command(name="шаблон_применить", aliases=["apply_loadout"])
+    async def apply_template(self, ctx, name: str, *, target: str):
+        """
+        Привести оснастку корабля или всех кораблей класса к шаблону одной операцией
+        Использование: !шаблон_применить [имя или проект] [позывной или класс]
+        """
+        fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send("❌ У вас нет флотилии.")
+            return
+
+        if not self.catalog.ready:
+            await self.refresh_catalog()
+        template = await self.db.get_loadout_template(fleet.id, name)
+        if template is None:
+            template = preset_loadout(name, self.catalog)
+        if template is None:
+            await ctx.send(f"❌ Шаблон '{name}' не найден.")
+            return
+
+        # Цель: позывной, иначе класс кораблей (уничтоженные не оснащаются)
+        ships = await self.db.get_fleet_ships(fleet.id)
+        folded = target.casefold()
+        targets = [s for s in ships if s['callsign'].casefold() == folded]
+        if not targets:
+            ship_class = folded.replace(" ", "_").replace("ё", "е")
+            targets = [s for s in ships
+                       if s['ship_class'] == ship_class and s['status'] != ShipStatus.DESTROYED.value]
+        if not targets:
+            await ctx.send(f"❌ Нет корабля или класса кораблей '{target}'.")
+            return
+
+        loadouts = await self.db.get_fleet_loadouts(fleet.id)
+        plan = {}
+        for ship in targets:
+            diff = loadout_diff(loadouts.get(ship['id'], {}), template)
+            if diff:
+                plan[ship['id']] = diff
+        if not plan:
+            await ctx.send(f"✅ Оснастка уже соответствует шаблону **{name}**.")
+            return
+
+        module_ids = list({m for changes in plan.values() for m in changes})
+        shortages = stock_shortages(plan, await self.db.get_inventory_counts(fleet.id, module_ids))
+        if shortages:
+            lines = "\n".join(
+                f"• {self.catalog.modules[m].name if m in self.catalog.modules else f'ID {m}'}: не хватает {count}"
+                for m, count in shortages
+            )
+            await ctx.send(f"❌ Недостаточно модулей на складе:\n{lines[:1900]}")
+            return
+
+        if not await self.db.refit_ships(fleet.id, plan):
+            await ctx.send("❌ Склад или оснастка изменились во время операции. Ничего не изменено.")
+            return
+
+        callsigns = {s['id']: s['callsign'] for s in targets}
+        moves = sum(abs(delta) for changes in plan.values() for delta in changes.values())
+        embed = discord.Embed(
+            title=f"📐 Шаблон {name} применён",
+            description=f"Кораблей переоснащено: **{len(plan)}** из {len(targets)}, перемещено модулей: **{moves}**",
+            color=0x2ecc71
+        )
+        summary = "\n".join(
+            f"**{callsigns[ship_id]}**: " + ", ".join(
+                f"{'+' if delta > 0 else ''}{delta} {self.catalog.modules[m].name if m in self.catalog.modules else m}"
+                for m, delta in changes.items()
+            )
+            for ship_id, changes in plan.items()
+        )
+        embed.add_field(name="Изменения", value=summary[:1024], inline=False)
+        await ctx.send(embed=embed)
+
 
 async def setup(bot):
     await bot.add_cog(Market(bot))
\ No newline at end of file
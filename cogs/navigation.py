@@ -0,0 +1,192 @@
+from typing import Optional
+
+import discord
+from discord.ext import commands
+from models.database import Database
+from utils.constants import START_LOCATION, START_LOCATION_SPEC
+from utils.world_map import Leg, Route, WorldMap, location_key
+
+
+class Navigation(commands.Cog):
+    """Карта мира, маршруты и перелёты"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.db: Database = bot.db
+        # guild_id -> WorldMap; сбрасывается при любом изменении карты
+        self.maps = {}
+
+    async def world_map(self, guild_id: int) -> WorldMap:
+        world = self.maps.get(guild_id)
+        if world is None:
+            world = self.maps[guild_id] = WorldMap(*await self.db.get_world_map(guild_id),
+                                                   home=(START_LOCATION, START_LOCATION_SPEC))
+        return world
+
+    # --- MAP ---
+
+    @commands.command(name="карта", aliases=["map"])
+    async def show_map(self, ctx):
+        """Показать локации и прямые маршруты"""
+        world = await self.world_map(ctx.guild.id)
+        if not len(world):
+            await ctx.send("🗺️ Карта пуста. Администратор добавляет локации: `!локация_добавить`.")
+            return
+
+        embed = discord.Embed(title="🗺️ Карта мира", color=0x1abc9c)
+        for location in world.locations[:25]:
+            links = ", ".join(
+                f"{world.locations[v].name} ({km} км)" for v, km in sorted(world.edges[location.index].items(),
+                                                                          key=lambda edge: edge[1])
+            )
+            embed.add_field(name=f"{location.name} — {location.spec}", value=(links or "нет маршрутов")[:1024],
+                            inline=False)
+        await ctx.send(embed=embed)
+
+    @commands.command(name="локация_добавить", aliases=["add_location"])
+    @commands.has_permissions(administrator=True)
+    async def add_location(self, ctx, name: str, *, spec: str):
+        """
+        [АДМИН] Добавить или изменить локацию
+        Пример: !локация_добавить "Кушан" Топливохранилище
+        """
+        await self.db.save_map_location(ctx.guild.id, location_key(name), name, spec)
+        self.maps.pop(ctx.guild.id, None)
+        await ctx.send(f"✅ Локация **{name}** ({spec}) сохранена.")
+
+    @commands.command(name="локация_удалить", aliases=["remove_location"])
+    @commands.has_permissions(administrator=True)
+    async def remove_location(self, ctx, *, name: str):
+        """[АДМИН] Удалить локацию вместе с её маршрутами"""
+        if not await self.db.delete_map_location(ctx.guild.id, location_key(name)):
+            await ctx.send(f"❌ Локация '{name}' не найдена.")
+            return
+        self.maps.pop(ctx.guild.id, None)
+        await ctx.send(f"🗑️ Локация **{name}** удалена.")
+
+    @commands.command(name="маршрут_добавить", aliases=["add_route"])
+    @commands.has_permissions(administrator=True)
+    async def add_route(self, ctx, start: str, end: str, distance: int):
+        """
+        [АДМИН] Добавить или изменить прямой маршрут между локациями
+        Пример: !маршрут_добавить "Столица" "Кушан" 300
+        """
+        if distance <= 0:
+            await ctx.send("❌ Расстояние должно быть положительным.")
+            return
+        world = await self.world_map(ctx.guild.id)
+        a, b = world.location(start), world.location(end)
+        if a is None or b is None or a == b:
+            await ctx.send("❌ Обе локации должны быть на карте и различаться.")
+            return
+        await self.db.save_map_route(ctx.guild.id, location_key(a.name), location_key(b.name), distance)
+        self.maps.pop(ctx.guild.id, None)
+        await ctx.send(f"✅ Маршрут **{a.name}** ↔ **{b.name}**: {distance} км.")
+
+    @commands.command(name="маршрут_удалить", aliases=["remove_route"])
+    @commands.has_permissions(administrator=True)
+    async def remove_route(self, ctx, start: str, end: str):
+        """[АДМИН] Удалить прямой маршрут"""
+        if not await self.db.delete_map_route(ctx.guild.id, location_key(start), location_key(end)):
+            await ctx.send("❌ Такого маршрута нет.")
+            return
+        self.maps.pop(ctx.guild.id, None)
+        await ctx.send(f"🗑️ Маршрут **{start}** ↔ **{end}** удалён.")
+
+    # --- ROUTES & TRAVEL ---
+
+    async def plan(self, ctx, fleet, destination: str, distance: Optional[int] = None):
+        """
+        Маршрут флота и расход метана; сообщает об ошибке и возвращает None.
+        С distance - прямой перелёт на указанное расстояние в обход маршрутов карты
+        (для флотов вне карты, например в удалённой локации).
+        """
+        world = await self.world_map(ctx.guild.id)
+        target = world.location(destination)
+        if target is None:
+            await ctx.send(f"❌ Локации '{destination}' нет на карте (`!карта`).")
+            return None
+        if distance is not None:
+            route = Route([Leg(fleet.location, target.name, distance)], distance)
+        elif world.location(fleet.location) is None:
+            await ctx.send(f"❌ Текущая локация флота '{fleet.location}' не отмечена на карте. "
+                           f"Администратор может перебросить флот напрямую: `!перелет @игрок [км] {target.name}`")
+            return None
+        else:
+            route = world.route(fleet.location, target.name)
+        if route is None:
+            await ctx.send(f"❌ Нет маршрута из {fleet.location} в {target.name}.")
+            return None
+        fleet_full = await self.db.get_fleet_with_ships(fleet.id)
+        return target, route, route.methane(fleet_full.methane_per_100km)
+
+    @commands.command(name="маршрут", aliases=["route"])
+    async def show_route(self, ctx, *, destination: str):
+        """
+        Кратчайший маршрут из текущей локации и расход метана
+        Пример: !маршрут Кушан
+        """
+        fleet = await self.db.get_fleet_by_user(ctx.author.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send("❌ У вас нет флотилии.")
+            return
+
+        planned = await self.plan(ctx, fleet, destination)
+        if planned is None:
+            return
+        target, route, methane = planned
+
+        embed = discord.Embed(
+            title=f"🧭 Маршрут {fleet.location} → {target.name}",
+            description="\n".join(f"{i}. {leg.start} → {leg.end}: {leg.distance} км"
+                                  for i, leg in enumerate(route.legs, 1)) or "Флот уже здесь.",
+            color=0x1abc9c
+        )
+        embed.add_field(name="Расстояние", value=f"{route.distance} км")
+        embed.add_field(name="Метан", value=f"{methane} т (есть {fleet.methane} т)")
+        if methane > fleet.methane:
+            embed.add_field(name="⚠️ Топливо", value=f"Не хватает {methane - fleet.methane} т метана", inline=False)
+            embed.color = 0xe74c3c
+        await ctx.send(embed=embed)
+
+    @commands.command(name="перелет", aliases=["travel", "move"])
+    @commands.has_permissions(administrator=True) # Admin only as requested
+    async def admin_move_fleet(self, ctx, member: discord.Member, distance: Optional[int] = None, *,
+                               destination: str):
+        """
+        [АДМИН] Переместить флот игрока по кратчайшему маршруту карты
+        !перелет @игрок [км] [Название]
+        Пример: !перелет @User Кушан
+        С расстоянием - прямой перелёт без маршрутов карты: !перелет @User 300 Кушан
+        """
+        if distance is not None and distance <= 0:
+            await ctx.send("❌ Расстояние должно быть положительным.")
+            return
+
+        fleet = await self.db.get_fleet_by_user(member.id, ctx.guild.id)
+        if not fleet:
+            await ctx.send(f"❌ У {member.mention} нет флотилии.")
+            return
+
+        planned = await self.plan(ctx, fleet, destination, distance)
+        if planned is None:
+            return
+        target, route, methane_cost = planned
+
+        # Перемещение и списание метана - один условный UPDATE
+        new_methane = await self.db.update_fleet_location(fleet.id, target.name, target.spec, methane_cost)
+        if new_methane is None:
+            await ctx.send(f"❌ Недостаточно метана: нужно {methane_cost} т, есть {fleet.methane} т.")
+            return
+
+        await ctx.send(
+            f"🚀 **Перелет завершен**\n"
+            f"Флот: {fleet.name}\n"
+            f"Маршрут: {' → '.join(route.stops) or target.name} ({route.distance} км)\n"
+            f"Новая локация: {target.name} ({target.spec})\n"
+            f"Потрачено топлива: {methane_cost} тонн (Ост: {new_methane})"
+        )
+
+
+async def setup(bot):
+    await bot.add_cog(Navigation(bot))
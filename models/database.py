@@ -1,7 +1,7 @@
 import sqlite3
 import json
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from contextlib import asynccontextmanager
 from datetime import datetime
 import aiosqlite
@@ -9,6 +9,8 @@ from models.schemas import Fleet, FleetWithShips, Ship, ShipModule, Module, Ship
 
 logger = logging.getLogger('elaim_bot')
 
+USER_STAT_FIELDS = ('battles_won', 'battles_lost', 'ships_destroyed', 'total_damage_dealt', 'credits')
+
 
 def parse_datetime(value):
     """Parse datetime from SQLite timestamp string"""
@@ -111,7 +113,93 @@ class Database:
                     FOREIGN KEY (module_id) REFERENCES modules(id),
                     UNIQUE(fleet_id, module_id)
                 );
+
+                CREATE TABLE IF NOT EXISTS battles (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id INTEGER NOT NULL,
+                    seed INTEGER NOT NULL,
+                    mode TEXT NOT NULL,
+                    distance INTEGER NOT NULL,
+                    turns INTEGER NOT NULL,
+                    outcome TEXT NOT NULL,
+                    attacker_name TEXT NOT NULL,
+                    defender_name TEXT NOT NULL,
+                    log BLOB NOT NULL,
+                    battle_key TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+                CREATE INDEX IF NOT EXISTS idx_battles_guild_date ON battles(guild_id, created_at);
+
+                CREATE TABLE IF NOT EXISTS battle_participants (
+                    battle_id INTEGER NOT NULL,
+                    fleet_id INTEGER NOT NULL,
+                    user_id INTEGER NOT NULL,
+                    side INTEGER NOT NULL,
+                    won INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (battle_id, fleet_id),
+                    FOREIGN KEY (battle_id) REFERENCES battles(id)
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_battle_participants_fleet ON battle_participants(fleet_id, battle_id);
+
+                CREATE TABLE IF NOT EXISTS market_orders (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    guild_id INTEGER NOT NULL,
+                    fleet_id INTEGER NOT NULL,
+                    module_id INTEGER NOT NULL,
+                    side TEXT NOT NULL,
+                    price INTEGER NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    remaining INTEGER NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (fleet_id) REFERENCES fleets(id),
+                    FOREIGN KEY (module_id) REFERENCES modules(id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_market_orders_fleet ON market_orders(fleet_id);
+
+                CREATE TABLE IF NOT EXISTS loadout_templates (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    fleet_id INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    modules TEXT NOT NULL DEFAULT '{}',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (fleet_id) REFERENCES fleets(id),
+                    UNIQUE(fleet_id, key)
+                );
+
+                CREATE TABLE IF NOT EXISTS map_locations (
+                    guild_id INTEGER NOT NULL,
+                    key TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    spec TEXT NOT NULL,
+                    PRIMARY KEY (guild_id, key)
+                ) WITHOUT ROWID;
+
+                CREATE TABLE IF NOT EXISTS map_routes (
+                    guild_id INTEGER NOT NULL,
+                    a_key TEXT NOT NULL,
+                    b_key TEXT NOT NULL,
+                    distance INTEGER NOT NULL,
+                    PRIMARY KEY (guild_id, a_key, b_key)
+                ) WITHOUT ROWID;
+
+                CREATE TABLE IF NOT EXISTS market_prices (
+                    guild_id INTEGER NOT NULL,
+                    location TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    demand REAL NOT NULL DEFAULT 0,
+                    stock REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (guild_id, location, item)
+                ) WITHOUT ROWID;
             """)
+            # Databases created before battle_key existed get the column added in place
+            async with db.execute("PRAGMA table_info(battles)") as cursor:
+                columns = {row[1] for row in await cursor.fetchall()}
+            if "battle_key" not in columns:
+                await db.execute("ALTER TABLE battles ADD COLUMN battle_key TEXT")
+            await db.execute(
+                "CREATE UNIQUE INDEX IF NOT EXISTS idx_battles_key ON battles(guild_id, battle_key)"
+            )
             await db.commit()
             logger.info("Database initialized successfully")
 
@@ -213,6 +301,21 @@ class Database:
                     ship_dict['created_at'] = parse_datetime(ship_dict['created_at'])
                 return Ship(**ship_dict)
 
+    async def get_ship_by_callsign(self, fleet_id: int, callsign: str) -> Optional[Ship]:
+        """Get a fleet's ship by callsign (case-insensitive) with its modules"""
+        async with aiosqlite.connect(self.db_path) as db:
+            # Exact match goes through the UNIQUE(fleet_id, callsign) index
+            async with db.execute(
+                "SELECT id FROM ships WHERE fleet_id = ? AND callsign = ?", (fleet_id, callsign)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if row is None:
+                # SQLite NOCASE folds ASCII only, so Cyrillic callsigns are folded here
+                folded = callsign.casefold()
+                async with db.execute("SELECT id, callsign FROM ships WHERE fleet_id = ?", (fleet_id,)) as cursor:
+                    row = next((r for r in await cursor.fetchall() if r[1].casefold() == folded), None)
+        return await self.get_ship(row[0]) if row else None
+
     async def add_ship(self, fleet_id: int, ship_class: str, project: str, callsign: str,
                       current_crew: int, required_crew: int, status: str = "в_строю") -> Ship:
         """Add a ship to a fleet"""
@@ -226,15 +329,39 @@ class Database:
             ship_id = cursor.lastrowid
             return await self.get_ship(ship_id)
 
-    async def add_module_to_ship(self, ship_id: int, module_id: int, count: int = 1) -> int:
-        """Add a module to a ship"""
+    async def add_module_to_ship(self, ship_id: int, module_id: int, count: int = 1) -> None:
+        """Add a module to a ship (stacks with an already fitted module)"""
         async with aiosqlite.connect(self.db_path) as db:
-            cursor = await db.execute(
-                "INSERT INTO ship_modules (ship_id, module_id, count) VALUES (?, ?, ?)",
+            await db.execute(
+                """INSERT INTO ship_modules (ship_id, module_id, count) VALUES (?, ?, ?)
+                   ON CONFLICT(ship_id, module_id) DO UPDATE SET count = count + excluded.count""",
                 (ship_id, module_id, count)
             )
             await db.commit()
-            return cursor.lastrowid
+
+    async def add_modules_to_ship(self, ship_id: int, loadout: Dict[int, int]) -> None:
+        """Add a whole {module_id: count} loadout to a ship in one statement batch"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.executemany(
+                """INSERT INTO ship_modules (ship_id, module_id, count) VALUES (?, ?, ?)
+                   ON CONFLICT(ship_id, module_id) DO UPDATE SET count = count + excluded.count""",
+                [(ship_id, module_id, count) for module_id, count in loadout.items()]
+            )
+            await db.commit()
+
+    async def remove_module_from_ship(self, ship_id: int, module_id: int, count: int = 1) -> bool:
+        """Remove modules from a ship; False if fewer than count are fitted"""
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                if not await self._take_from_ship(db, ship_id, module_id, count):
+                    await db.rollback()
+                    return False
+                await db.commit()
+                return True
+            except Exception:
+                await db.rollback()
+                raise
 
     async def get_fleet_ships(self, fleet_id: int) -> List[Dict[str, Any]]:
         """Get all ships in a fleet"""
@@ -276,28 +403,59 @@ class Database:
         return None
 
     async def update_user_stats(self, user_id: int, **kwargs) -> None:
-        """Update user statistics"""
-        async with aiosqlite.connect(self.db_path) as db:
-            # Check if user exists
-            async with db.execute("SELECT id FROM user_stats WHERE user_id = ?", (user_id,)) as cursor:
-                exists = await cursor.fetchone()
-            
-            if not exists:
-                # Create new record
-                await db.execute(
-                    "INSERT INTO user_stats (user_id) VALUES (?)",
-                    (user_id,)
-                )
-            
-            # Update stats
-            update_fields = ", ".join([f"{k} = ?" for k in kwargs.keys()])
-            values = list(kwargs.values()) + [user_id]
+        """Update user statistics (single UPSERT)"""
+        if not kwargs:
+            return
+        fields = [k for k in kwargs if k in USER_STAT_FIELDS]
+        if len(fields) != len(kwargs):
+            raise ValueError(f"Unknown user_stats fields: {set(kwargs) - set(fields)}")
+        async with aiosqlite.connect(self.db_path) as db:
             await db.execute(
-                f"UPDATE user_stats SET {update_fields} WHERE user_id = ?",
-                values
+                f"""INSERT INTO user_stats (user_id, {", ".join(fields)})
+                    VALUES (?, {", ".join("?" for _ in fields)})
+                    ON CONFLICT(user_id) DO UPDATE SET {", ".join(f"{k} = excluded.{k}" for k in fields)}""",
+                [user_id] + [kwargs[k] for k in fields]
             )
             await db.commit()
 
+    async def get_stats_leaderboard(self, guild_id: int, metric: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """Top players of a guild by a user_stats metric"""
+        if metric not in USER_STAT_FIELDS:
+            raise ValueError(f"Unknown metric: {metric}")
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                f"""SELECT us.user_id, f.name AS fleet_name, f.leader_name, us.battles_won, us.battles_lost,
+                       us.ships_destroyed, us.total_damage_dealt
+                    FROM user_stats us
+                    JOIN fleets f ON f.user_id = us.user_id AND f.guild_id = ?
+                    WHERE us.{metric} > 0
+                    ORDER BY us.{metric} DESC
+                    LIMIT ?""",
+                (guild_id, limit)
+            ) as cursor:
+                rows = await cursor.fetchall()
+                return [dict(row) for row in rows]
+
+    async def get_stats_records(self, guild_id: int) -> Dict[str, Dict[str, Any]]:
+        """Record holder of a guild for every user_stats metric, in one query"""
+        metrics = [m for m in USER_STAT_FIELDS if m != 'credits']
+        query = " UNION ALL ".join(
+            f"""SELECT * FROM (
+                    SELECT '{m}' AS metric, us.user_id, f.name AS fleet_name, us.{m} AS value
+                    FROM user_stats us
+                    JOIN fleets f ON f.user_id = us.user_id AND f.guild_id = :guild_id
+                    WHERE us.{m} > 0
+                    ORDER BY us.{m} DESC LIMIT 1
+                )"""
+            for m in metrics
+        )
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(query, {"guild_id": guild_id}) as cursor:
+                rows = await cursor.fetchall()
+                return {row['metric']: dict(row) for row in rows}
+
     async def get_fleet_by_user(self, user_id: int, guild_id: int) -> Optional[Fleet]:
         """Get fleet by user_id and guild_id"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -388,6 +546,183 @@ class Database:
                     ships.append(Ship(**ship_dict))
                 return ships
 
+    async def update_ship_status(self, ship_id: int, status: ShipStatus) -> None:
+        """Update ship damage status"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                "UPDATE ships SET status = ? WHERE id = ?",
+                (ShipStatus(status).value, ship_id)
+            )
+            await db.commit()
+
+    async def apply_battle_results(self, ship_statuses: List[Tuple[int, ShipStatus]],
+                                   stats: List[Tuple[int, int, int, int, int]] = (),
+                                   history: Optional[Tuple[int, Dict[str, Any], list, bytes]] = None) -> Optional[int]:
+        """
+        Persist the outcome of a battle in a single transaction.
+        ship_statuses: (ship_id, status)
+        stats: (user_id, battles_won, battles_lost, ships_destroyed, total_damage_dealt) - increments
+        history: (guild_id, battle row, [(fleet_id, user_id, side, won)], compressed log) - battle record
+        Returns the id of the stored battle record, if any.
+        The battle key is unique per guild: if the record already exists, the battle
+        was applied before and nothing is written (returns None).
+        Loot is not part of this transaction: debris is credited when a player
+        picks it up (credit_salvage).
+        """
+        battle_id = None
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                if history:
+                    guild_id, battle, participants, log = history
+                    cursor = await db.execute(
+                        """INSERT INTO battles (guild_id, seed, mode, distance, turns, outcome,
+                                                attacker_name, defender_name, log, battle_key)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                           ON CONFLICT(guild_id, battle_key) DO NOTHING""",
+                        (guild_id, battle['seed'], battle['mode'], battle['distance'], battle['turns'],
+                         battle['outcome'], battle['attacker_name'], battle['defender_name'], log,
+                         battle['key'])
+                    )
+                    if cursor.rowcount == 0:
+                        # Already applied: statuses and stats were written with the first record
+                        await db.rollback()
+                        return None
+                    battle_id = cursor.lastrowid
+                    await db.executemany(
+                        """INSERT INTO battle_participants (battle_id, fleet_id, user_id, side, won)
+                           VALUES (?, ?, ?, ?, ?)""",
+                        [(battle_id, *row) for row in participants]
+                    )
+                await db.executemany(
+                    "UPDATE ships SET status = ? WHERE id = ?",
+                    [(ShipStatus(status).value, ship_id) for ship_id, status in ship_statuses]
+                )
+                if stats:
+                    await db.executemany(
+                        """INSERT INTO user_stats (user_id, battles_won, battles_lost, ships_destroyed, total_damage_dealt)
+                           VALUES (?, ?, ?, ?, ?)
+                           ON CONFLICT(user_id) DO UPDATE SET
+                               battles_won = battles_won + excluded.battles_won,
+                               battles_lost = battles_lost + excluded.battles_lost,
+                               ships_destroyed = ships_destroyed + excluded.ships_destroyed,
+                               total_damage_dealt = total_damage_dealt + excluded.total_damage_dealt""",
+                        stats
+                    )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        return battle_id
+
+    async def get_battle(self, guild_id: int, battle_id: int) -> Optional[Dict[str, Any]]:
+        """Get a stored battle with its compressed log"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT * FROM battles WHERE id = ? AND guild_id = ?", (battle_id, guild_id)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+
+    async def get_battle_history(self, guild_id: int, fleet_id: Optional[int] = None,
+                                 limit: int = 10) -> List[Dict[str, Any]]:
+        """Latest battles of a guild or of one fleet, without the log blob"""
+        columns = "b.id, b.mode, b.distance, b.turns, b.outcome, b.attacker_name, b.defender_name, b.created_at"
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            if fleet_id is None:
+                query = f"""SELECT {columns} FROM battles b
+                            WHERE b.guild_id = ? ORDER BY b.created_at DESC, b.id DESC LIMIT ?"""
+                params = (guild_id, limit)
+            else:
+                # Обход по индексу участников: последние бои флота без сканирования battles
+                query = f"""SELECT {columns}, p.side, p.won FROM battle_participants p
+                            JOIN battles b ON b.id = p.battle_id
+                            WHERE p.fleet_id = ? AND b.guild_id = ?
+                            ORDER BY p.battle_id DESC LIMIT ?"""
+                params = (fleet_id, guild_id, limit)
+            async with db.execute(query, params) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def get_fleets_by_users(self, guild_id: int, user_ids: List[int]) -> Dict[int, Fleet]:
+        """Get fleets of several users of a guild in one query, keyed by user_id"""
+        if not user_ids:
+            return {}
+        placeholders = ", ".join("?" for _ in user_ids)
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                f"""SELECT id, user_id, guild_id, name, leader_name, gold, rations, methane, 
+                   turn_count, location, location_spec, created_at, updated_at 
+                   FROM fleets WHERE guild_id = ? AND user_id IN ({placeholders})""",
+                (guild_id, *user_ids)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        fleets = {}
+        for row in rows:
+            row_dict = dict(row)
+            row_dict['created_at'] = parse_datetime(row_dict['created_at'])
+            row_dict['updated_at'] = parse_datetime(row_dict['updated_at'])
+            fleets[row_dict['user_id']] = Fleet(**row_dict)
+        return fleets
+
+    async def get_combat_ships(self, fleet_ids: List[int]) -> Dict[int, List[Ship]]:
+        """
+        Load combat-ready ships of several fleets with their modules in a single query.
+        Destroyed and critically damaged ships are filtered out in SQL.
+        Returns {fleet_id: [Ship]} (fleets without combat-ready ships map to []).
+        """
+        result: Dict[int, List[Ship]] = {fleet_id: [] for fleet_id in fleet_ids}
+        if not fleet_ids:
+            return result
+        placeholders = ", ".join("?" for _ in fleet_ids)
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                f"""SELECT s.id, s.fleet_id, s.ship_class, s.project, s.callsign, s.current_crew,
+                       s.required_crew, s.status, s.created_at,
+                       sm.id AS sm_id, sm.module_id, sm.count,
+                       m.name, m.type, m.weight, m.price, m.stats
+                    FROM ships s
+                    LEFT JOIN ship_modules sm ON sm.ship_id = s.id
+                    LEFT JOIN modules m ON m.id = sm.module_id
+                    WHERE s.fleet_id IN ({placeholders}) AND s.status NOT IN (?, ?)
+                    ORDER BY s.id""",
+                (*fleet_ids, ShipStatus.DESTROYED.value, ShipStatus.CRITICAL_DAMAGE.value)
+            ) as cursor:
+                rows = await cursor.fetchall()
+
+        ships: Dict[int, dict] = {}
+        modules_cache: Dict[int, Module] = {}
+        for row in rows:
+            ship = ships.get(row['id'])
+            if ship is None:
+                ship = ships[row['id']] = {
+                    'id': row['id'], 'fleet_id': row['fleet_id'], 'ship_class': row['ship_class'],
+                    'project': row['project'], 'callsign': row['callsign'],
+                    'current_crew': row['current_crew'], 'required_crew': row['required_crew'],
+                    'status': row['status'], 'created_at': parse_datetime(row['created_at']),
+                    'modules': []
+                }
+            if row['sm_id'] is None or row['name'] is None:
+                continue
+            # Каталожные модули разбираются один раз на запрос
+            module = modules_cache.get(row['module_id'])
+            if module is None:
+                module = modules_cache[row['module_id']] = Module(
+                    id=row['module_id'], name=row['name'], type=row['type'], weight=row['weight'],
+                    price=row['price'],
+                    stats=json.loads(row['stats']) if isinstance(row['stats'], str) else row['stats']
+                )
+            ship['modules'].append(ShipModule(
+                id=row['sm_id'], ship_id=row['id'], module_id=row['module_id'], count=row['count'], module=module
+            ))
+
+        for ship in ships.values():
+            result[ship['fleet_id']].append(Ship(**ship))
+        return result
+
     async def remove_ship(self, ship_id: int) -> None:
         """Remove a ship and its modules"""
         async with aiosqlite.connect(self.db_path) as db:
@@ -459,56 +794,594 @@ class Database:
     async def add_module_to_inventory(self, fleet_id: int, module_id: int, count: int = 1) -> None:
         """Add module to fleet inventory"""
         async with aiosqlite.connect(self.db_path) as db:
-            # Check if already exists
-            async with db.execute(
-                "SELECT count FROM fleet_inventory WHERE fleet_id = ? AND module_id = ?",
-                (fleet_id, module_id)
-            ) as cursor:
-                row = await cursor.fetchone()
-                if row:
-                    # Update count
+            await self._put_to_inventory(db, fleet_id, module_id, count)
+            await db.commit()
+
+    async def credit_salvage(self, fleet_id: int, methane: int = 0,
+                             modules: List[Tuple[int, int]] = ()) -> None:
+        """Credit collected debris (methane and (module_id, count) pairs) in one transaction"""
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                if methane:
                     await db.execute(
-                        "UPDATE fleet_inventory SET count = count + ? WHERE fleet_id = ? AND module_id = ?",
-                        (count, fleet_id, module_id)
+                        "UPDATE fleets SET methane = methane + ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                        (methane, fleet_id)
                     )
-                else:
-                    # Insert new
-                    await db.execute(
-                        "INSERT INTO fleet_inventory (fleet_id, module_id, count) VALUES (?, ?, ?)",
-                        (fleet_id, module_id, count)
+                if modules:
+                    await db.executemany(
+                        """INSERT INTO fleet_inventory (fleet_id, module_id, count) VALUES (?, ?, ?)
+                           ON CONFLICT(fleet_id, module_id) DO UPDATE SET count = count + excluded.count""",
+                        [(fleet_id, module_id, count) for module_id, count in modules]
                     )
-            await db.commit()
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
 
     async def remove_module_from_inventory(self, fleet_id: int, module_id: int, count: int = 1) -> bool:
-        """Remove module from fleet inventory"""
+        """Remove module from fleet inventory; False if there are fewer than count"""
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                if not await self._take_from_inventory(db, fleet_id, module_id, count):
+                    await db.rollback()
+                    return False
+                await db.commit()
+                return True
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def get_inventory_counts(self, fleet_id: int, module_ids: List[int]) -> Dict[int, int]:
+        """Inventory counts of the given modules (UNIQUE(fleet_id, module_id) index lookups)"""
+        if not module_ids:
+            return {}
+        placeholders = ", ".join("?" * len(module_ids))
         async with aiosqlite.connect(self.db_path) as db:
-            # Check current count
             async with db.execute(
-                "SELECT count FROM fleet_inventory WHERE fleet_id = ? AND module_id = ?",
-                (fleet_id, module_id)
+                f"SELECT module_id, count FROM fleet_inventory WHERE fleet_id = ? AND module_id IN ({placeholders})",
+                (fleet_id, *module_ids)
+            ) as cursor:
+                return {module_id: count for module_id, count in await cursor.fetchall()}
+
+    # --- MARKET OPERATIONS ---
+    # Each operation is one transaction. Stock and funds are checked by the
+    # conditional UPDATE itself, so concurrent calls cannot overdraw or duplicate.
+
+    @staticmethod
+    async def _put_to_inventory(db, fleet_id: int, module_id: int, count: int) -> None:
+        await db.execute(
+            """INSERT INTO fleet_inventory (fleet_id, module_id, count) VALUES (?, ?, ?)
+               ON CONFLICT(fleet_id, module_id) DO UPDATE SET count = count + excluded.count""",
+            (fleet_id, module_id, count)
+        )
+
+    @staticmethod
+    async def _take_from_inventory(db, fleet_id: int, module_id: int, count: int) -> bool:
+        cursor = await db.execute(
+            """UPDATE fleet_inventory SET count = count - ?
+               WHERE fleet_id = ? AND module_id = ? AND count >= ?""",
+            (count, fleet_id, module_id, count)
+        )
+        if cursor.rowcount == 0:
+            return False
+        await db.execute(
+            "DELETE FROM fleet_inventory WHERE fleet_id = ? AND module_id = ? AND count <= 0",
+            (fleet_id, module_id)
+        )
+        return True
+
+    @staticmethod
+    async def _take_from_ship(db, ship_id: int, module_id: int, count: int) -> bool:
+        cursor = await db.execute(
+            "UPDATE ship_modules SET count = count - ? WHERE ship_id = ? AND module_id = ? AND count >= ?",
+            (count, ship_id, module_id, count)
+        )
+        if cursor.rowcount == 0:
+            return False
+        await db.execute(
+            "DELETE FROM ship_modules WHERE ship_id = ? AND module_id = ? AND count <= 0",
+            (ship_id, module_id)
+        )
+        return True
+
+    @staticmethod
+    async def _charge(db, fleet_id: int, amount: int, **credit) -> Optional[int]:
+        """Charge gold if the balance allows it and credit resources. Returns the new balance or None."""
+        sets = "".join(f", {field} = {field} + ?" for field in credit)
+        async with db.execute(
+            f"""UPDATE fleets SET gold = gold - ?{sets}, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ? AND gold >= ? RETURNING gold""",
+            (amount, *credit.values(), fleet_id, amount)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return row[0] if row else None
+
+    async def buy_module(self, fleet_id: int, module_id: int, count: int, unit_price: int) -> Optional[int]:
+        """Buy modules into inventory. Returns the new gold balance, None if funds are insufficient."""
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                gold = await self._charge(db, fleet_id, unit_price * count)
+                if gold is None:
+                    await db.rollback()
+                    return None
+                await self._put_to_inventory(db, fleet_id, module_id, count)
+                await db.commit()
+                return gold
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def buy_resource(self, fleet_id: int, resource: str, amount: int, unit_price: int) -> Optional[int]:
+        """Buy rations or methane. Returns the new gold balance, None if funds are insufficient."""
+        if resource not in ('rations', 'methane'):
+            raise ValueError(f"Unknown resource: {resource}")
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                gold = await self._charge(db, fleet_id, unit_price * amount, **{resource: amount})
+                if gold is None:
+                    await db.rollback()
+                    return None
+                await db.commit()
+                return gold
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def sell_module(self, fleet_id: int, module_id: int, count: int, unit_price: int) -> Optional[int]:
+        """Sell modules from inventory. Returns the new gold balance, None if stock is insufficient."""
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                if not await self._take_from_inventory(db, fleet_id, module_id, count):
+                    await db.rollback()
+                    return None
+                gold = await self._charge(db, fleet_id, -unit_price * count)
+                await db.commit()
+                return gold
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def refit_ship(self, fleet_id: int, ship_id: int, changes: Dict[int, int]) -> bool:
+        """
+        Apply {module_id: delta} to a ship of the fleet in one transaction: positive deltas are
+        fitted from inventory, negative ones are returned to it. False if any line is short (nothing is applied).
+        """
+        return await self.refit_ships(fleet_id, {ship_id: changes})
+
+    async def refit_ships(self, fleet_id: int, plan: Dict[int, Dict[int, int]]) -> bool:
+        """
+        Apply {ship_id: {module_id: delta}} to ships of the fleet in one transaction.
+        Inventory moves are netted per module, so modules stripped from one ship can be
+        fitted to another in the same batch. False if any ship or line is short (nothing is applied).
+        """
+        ship_ids = list(plan)
+        if not ship_ids:
+            return True
+        net: Dict[int, int] = {}
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                placeholders = ", ".join("?" * len(ship_ids))
+                async with db.execute(
+                    f"SELECT COUNT(*) FROM ships WHERE fleet_id = ? AND id IN ({placeholders})",
+                    (fleet_id, *ship_ids)
+                ) as cursor:
+                    if (await cursor.fetchone())[0] != len(ship_ids):
+                        await db.rollback()
+                        return False
+                fits = []
+                for ship_id, changes in plan.items():
+                    for module_id, delta in changes.items():
+                        net[module_id] = net.get(module_id, 0) + delta
+                        if delta < 0:
+                            if not await self._take_from_ship(db, ship_id, module_id, -delta):
+                                await db.rollback()
+                                return False
+                        elif delta > 0:
+                            fits.append((ship_id, module_id, delta))
+                await db.executemany(
+                    """INSERT INTO ship_modules (ship_id, module_id, count) VALUES (?, ?, ?)
+                       ON CONFLICT(ship_id, module_id) DO UPDATE SET count = count + excluded.count""",
+                    fits
+                )
+                for module_id, delta in net.items():
+                    if delta > 0:
+                        if not await self._take_from_inventory(db, fleet_id, module_id, delta):
+                            await db.rollback()
+                            return False
+                    elif delta < 0:
+                        await self._put_to_inventory(db, fleet_id, module_id, -delta)
+                await db.commit()
+                return True
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def get_fleet_loadouts(self, fleet_id: int) -> Dict[int, Dict[int, int]]:
+        """{ship_id: {module_id: count}} for every ship of the fleet in one query"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                """SELECT s.id, sm.module_id, sm.count FROM ships s
+                   LEFT JOIN ship_modules sm ON sm.ship_id = s.id
+                   WHERE s.fleet_id = ?""",
+                (fleet_id,)
+            ) as cursor:
+                loadouts: Dict[int, Dict[int, int]] = {}
+                for ship_id, module_id, count in await cursor.fetchall():
+                    loadout = loadouts.setdefault(ship_id, {})
+                    if module_id is not None:
+                        loadout[module_id] = count
+                return loadouts
+
+    # --- LOADOUT TEMPLATES ---
+
+    async def save_loadout_template(self, fleet_id: int, name: str, loadout: Dict[int, int]) -> None:
+        """Create or overwrite a fleet's named loadout {module_id: count}"""
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                """INSERT INTO loadout_templates (fleet_id, key, name, modules) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(fleet_id, key) DO UPDATE SET name = excluded.name, modules = excluded.modules""",
+                (fleet_id, name.casefold(), name, json.dumps(loadout))
+            )
+            await db.commit()
+
+    async def get_loadout_template(self, fleet_id: int, name: str) -> Optional[Dict[int, int]]:
+        """A fleet's loadout template by name (case-insensitive)"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT modules FROM loadout_templates WHERE fleet_id = ? AND key = ?",
+                (fleet_id, name.casefold())
             ) as cursor:
                 row = await cursor.fetchone()
-                if not row:
+        if row is None:
+            return None
+        return {int(module_id): count for module_id, count in json.loads(row[0]).items()}
+
+    async def get_loadout_templates(self, fleet_id: int) -> List[Dict[str, Any]]:
+        """All templates of a fleet: [{name, modules: {module_id: count}}]"""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                "SELECT name, modules FROM loadout_templates WHERE fleet_id = ? ORDER BY key",
+                (fleet_id,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        return [{'name': name, 'modules': {int(k): v for k, v in json.loads(modules).items()}}
+                for name, modules in rows]
+
+    async def delete_loadout_template(self, fleet_id: int, name: str) -> bool:
+        """Delete a template; False if there was none"""
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "DELETE FROM loadout_templates WHERE fleet_id = ? AND key = ?", (fleet_id, name.casefold())
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+
+    async def checkout(self, fleet_id: int, modules: List[Tuple[int, int, int]],
+                       resources: Optional[Dict[str, Tuple[int, int]]] = None) -> Optional[int]:
+        """
+        Buy a whole order in one transaction.
+        modules - [(module_id, count, unit_price)], resources - {'rations'|'methane': (amount, unit_price)}.
+        Returns the new gold balance, None if funds are insufficient (nothing is applied).
+        """
+        resources = resources or {}
+        for resource in resources:
+            if resource not in ('rations', 'methane'):
+                raise ValueError(f"Unknown resource: {resource}")
+        total = sum(count * price for _, count, price in modules)
+        total += sum(amount * price for amount, price in resources.values())
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                gold = await self._charge(db, fleet_id, total,
+                                          **{resource: amount for resource, (amount, _) in resources.items()})
+                if gold is None:
+                    await db.rollback()
+                    return None
+                await db.executemany(
+                    """INSERT INTO fleet_inventory (fleet_id, module_id, count) VALUES (?, ?, ?)
+                       ON CONFLICT(fleet_id, module_id) DO UPDATE SET count = count + excluded.count""",
+                    [(fleet_id, module_id, count) for module_id, count, _ in modules]
+                )
+                await db.commit()
+                return gold
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def sell_modules(self, fleet_id: int, lines: List[Tuple[int, int, int]]) -> Optional[int]:
+        """
+        Sell several inventory lines [(module_id, count, unit_price)] in one transaction.
+        Returns the new gold balance, None if any line is short (nothing is applied).
+        """
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                for module_id, count, _ in lines:
+                    if not await self._take_from_inventory(db, fleet_id, module_id, count):
+                        await db.rollback()
+                        return None
+                gold = await self._charge(db, fleet_id, -sum(count * price for _, count, price in lines))
+                await db.commit()
+                return gold
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def equip_module(self, fleet_id: int, ship_id: int, module_id: int, count: int = 1) -> bool:
+        """Move modules from inventory onto a ship of the same fleet"""
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                async with db.execute(
+                    "SELECT 1 FROM ships WHERE id = ? AND fleet_id = ?", (ship_id, fleet_id)
+                ) as cursor:
+                    owned = await cursor.fetchone()
+                if not owned or not await self._take_from_inventory(db, fleet_id, module_id, count):
+                    await db.rollback()
                     return False
-                
-                current_count = row['count']
-                if current_count < count:
+                await db.execute(
+                    """INSERT INTO ship_modules (ship_id, module_id, count) VALUES (?, ?, ?)
+                       ON CONFLICT(ship_id, module_id) DO UPDATE SET count = count + excluded.count""",
+                    (ship_id, module_id, count)
+                )
+                await db.commit()
+                return True
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def unequip_module(self, fleet_id: int, ship_id: int, module_id: int, count: int = 1) -> bool:
+        """Move modules from a ship of the fleet back to its inventory"""
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                async with db.execute(
+                    "SELECT 1 FROM ships WHERE id = ? AND fleet_id = ?", (ship_id, fleet_id)
+                ) as cursor:
+                    owned = await cursor.fetchone()
+                if not owned or not await self._take_from_ship(db, ship_id, module_id, count):
+                    await db.rollback()
                     return False
-                
-                if current_count == count:
-                    # Remove entirely
-                    await db.execute(
-                        "DELETE FROM fleet_inventory WHERE fleet_id = ? AND module_id = ?",
-                        (fleet_id, module_id)
-                    )
+                await self._put_to_inventory(db, fleet_id, module_id, count)
+                await db.commit()
+                return True
+            except Exception:
+                await db.rollback()
+                raise
+
+    # --- MARKET PRICES ---
+
+    async def get_market_prices(self) -> List[Dict[str, Any]]:
+        """All stored demand/stock indices"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT guild_id, location, item, demand, stock FROM market_prices"
+            ) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def save_market_prices(self, upserts: List[Tuple[int, str, str, float, float]],
+                                 deletes: List[Tuple[int, str, str]]) -> None:
+        """Write a batch of changed indices in one transaction"""
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                await db.executemany(
+                    """INSERT INTO market_prices (guild_id, location, item, demand, stock) VALUES (?, ?, ?, ?, ?)
+                       ON CONFLICT(guild_id, location, item) DO UPDATE SET
+                       demand = excluded.demand, stock = excluded.stock""",
+                    upserts
+                )
+                await db.executemany(
+                    "DELETE FROM market_prices WHERE guild_id = ? AND location = ? AND item = ?",
+                    deletes
+                )
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+
+    # --- PLAYER ORDERS ---
+    # Open orders hold their escrow: gold price * remaining for bids, modules for asks.
+
+    async def get_open_orders(self) -> List[Dict[str, Any]]:
+        """All open orders, oldest first"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                """SELECT id, guild_id, fleet_id, module_id, side, price, quantity, remaining
+                   FROM market_orders ORDER BY id"""
+            ) as cursor:
+                return [dict(row) for row in await cursor.fetchall()]
+
+    async def place_order(self, guild_id: int, fleet_id: int, module_id: int, side: str, price: int,
+                          quantity: int, fills: List[Tuple[int, int, int, int]]) -> Optional[int]:
+        """
+        Escrow a new limit order and settle its fills in one transaction.
+        fills - [(maker_order_id, maker_fleet_id, quantity, price)] matched against the book.
+        Returns the id of the resting order, 0 if it was filled completely,
+        None if the placer lacks gold (bid) or modules (ask) - nothing is applied.
+        """
+        filled = sum(q for _, _, q, _ in fills)
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                if side == 'buy':
+                    # Escrow at the limit price; the difference to the fill prices is refunded
+                    if await self._charge(db, fleet_id, price * quantity) is None:
+                        await db.rollback()
+                        return None
+                    refund = sum(q * (price - p) for _, _, q, p in fills)
+                    if refund:
+                        await self._charge(db, fleet_id, -refund)
+                    if filled:
+                        await self._put_to_inventory(db, fleet_id, module_id, filled)
+                    for _, maker_fleet_id, q, p in fills:
+                        await self._charge(db, maker_fleet_id, -q * p)
                 else:
-                    # Decrease count
-                    await db.execute(
-                        "UPDATE fleet_inventory SET count = count - ? WHERE fleet_id = ? AND module_id = ?",
-                        (count, fleet_id, module_id)
+                    if not await self._take_from_inventory(db, fleet_id, module_id, quantity):
+                        await db.rollback()
+                        return None
+                    proceeds = sum(q * p for _, _, q, p in fills)
+                    if proceeds:
+                        await self._charge(db, fleet_id, -proceeds)
+                    for _, maker_fleet_id, q, _ in fills:
+                        await self._put_to_inventory(db, maker_fleet_id, module_id, q)
+
+                await db.executemany(
+                    "UPDATE market_orders SET remaining = remaining - ? WHERE id = ?",
+                    [(q, maker_id) for maker_id, _, q, _ in fills]
+                )
+                await db.executemany(
+                    "DELETE FROM market_orders WHERE id = ? AND remaining <= 0",
+                    [(maker_id,) for maker_id, _, _, _ in fills]
+                )
+
+                order_id = 0
+                if filled < quantity:
+                    cursor = await db.execute(
+                        """INSERT INTO market_orders (guild_id, fleet_id, module_id, side, price, quantity, remaining)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                        (guild_id, fleet_id, module_id, side, price, quantity, quantity - filled)
                     )
+                    order_id = cursor.lastrowid
                 await db.commit()
-                return True
+                return order_id
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def cancel_order(self, order_id: int, fleet_id: int) -> Optional[Dict[str, Any]]:
+        """Cancel an order of the fleet and return its escrow. Returns the removed order or None."""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                async with db.execute(
+                    """DELETE FROM market_orders WHERE id = ? AND fleet_id = ?
+                       RETURNING id, module_id, side, price, remaining""",
+                    (order_id, fleet_id)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    await db.rollback()
+                    return None
+                order = dict(row)
+                if order['side'] == 'buy':
+                    await self._charge(db, fleet_id, -order['price'] * order['remaining'])
+                else:
+                    await self._put_to_inventory(db, fleet_id, order['module_id'], order['remaining'])
+                await db.commit()
+                return order
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def cancel_fleet_orders(self, fleet_id: int) -> List[Dict[str, Any]]:
+        """Cancel every open order of the fleet and return their escrow. Returns the removed orders."""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                async with db.execute(
+                    """DELETE FROM market_orders WHERE fleet_id = ?
+                       RETURNING id, module_id, side, price, remaining""",
+                    (fleet_id,)
+                ) as cursor:
+                    orders = [dict(row) for row in await cursor.fetchall()]
+                refund = sum(o['price'] * o['remaining'] for o in orders if o['side'] == 'buy')
+                if refund:
+                    await self._charge(db, fleet_id, -refund)
+                for order in orders:
+                    if order['side'] != 'buy':
+                        await self._put_to_inventory(db, fleet_id, order['module_id'], order['remaining'])
+                await db.commit()
+                return orders
+            except Exception:
+                await db.rollback()
+                raise
+
+    # --- WORLD MAP ---
+
+    async def get_world_map(self, guild_id: int) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """(locations, routes) of a guild's map"""
+        async with aiosqlite.connect(self.db_path) as db:
+            db.row_factory = aiosqlite.Row
+            async with db.execute(
+                "SELECT key, name, spec FROM map_locations WHERE guild_id = ? ORDER BY name", (guild_id,)
+            ) as cursor:
+                locations = [dict(row) for row in await cursor.fetchall()]
+            async with db.execute(
+                "SELECT a_key, b_key, distance FROM map_routes WHERE guild_id = ?", (guild_id,)
+            ) as cursor:
+                routes = [dict(row) for row in await cursor.fetchall()]
+        return locations, routes
+
+    async def save_map_location(self, guild_id: int, key: str, name: str, spec: str) -> None:
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                """INSERT INTO map_locations (guild_id, key, name, spec) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(guild_id, key) DO UPDATE SET name = excluded.name, spec = excluded.spec""",
+                (guild_id, key, name, spec)
+            )
+            await db.commit()
+
+    async def delete_map_location(self, guild_id: int, key: str) -> bool:
+        """Delete a location together with its routes"""
+        async with aiosqlite.connect(self.db_path) as db:
+            try:
+                await db.execute("BEGIN IMMEDIATE")
+                cursor = await db.execute(
+                    "DELETE FROM map_locations WHERE guild_id = ? AND key = ?", (guild_id, key)
+                )
+                await db.execute(
+                    "DELETE FROM map_routes WHERE guild_id = ? AND (a_key = ? OR b_key = ?)", (guild_id, key, key)
+                )
+                await db.commit()
+                return cursor.rowcount > 0
+            except Exception:
+                await db.rollback()
+                raise
+
+    async def save_map_route(self, guild_id: int, a_key: str, b_key: str, distance: int) -> None:
+        """Create or update an undirected route (stored once, keys ordered)"""
+        a_key, b_key = sorted((a_key, b_key))
+        async with aiosqlite.connect(self.db_path) as db:
+            await db.execute(
+                """INSERT INTO map_routes (guild_id, a_key, b_key, distance) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(guild_id, a_key, b_key) DO UPDATE SET distance = excluded.distance""",
+                (guild_id, a_key, b_key, distance)
+            )
+            await db.commit()
+
+    async def delete_map_route(self, guild_id: int, a_key: str, b_key: str) -> bool:
+        a_key, b_key = sorted((a_key, b_key))
+        async with aiosqlite.connect(self.db_path) as db:
+            cursor = await db.execute(
+                "DELETE FROM map_routes WHERE guild_id = ? AND a_key = ? AND b_key = ?", (guild_id, a_key, b_key)
+            )
+            await db.commit()
+            return cursor.rowcount > 0
+
+    async def update_fleet_location(self, fleet_id: int, location: str, location_spec: str,
+                                    methane_cost: int = 0) -> Optional[int]:
+        """Move a fleet, burning methane_cost if it has enough. Returns the methane left or None."""
+        async with aiosqlite.connect(self.db_path) as db:
+            async with db.execute(
+                """UPDATE fleets SET location = ?, location_spec = ?, methane = methane - ?,
+                   updated_at = CURRENT_TIMESTAMP
+                   WHERE id = ? AND methane >= ? RETURNING methane""",
+                (location, location_spec, methane_cost, fleet_id, methane_cost)
+            ) as cursor:
+                row = await cursor.fetchone()
+            await db.commit()
+        return row[0] if row else None
 
     async def close(self):
         """Close database connection"""
@@ -0,0 +1,92 @@
+"""
+Сжатая история боя для таблицы battles и команды !повтор.
+
+Лог хранится как компактный JSON (списки вместо словарей, корабли по id) под zlib.
+Текст событий не сохраняется - страницы повтора собираются заново при просмотре.
+"""
+import json
+import zlib
+from typing import List
+
+LOG_FORMAT_VERSION = 1
+
+OUTCOME_ATTACKERS = "attackers"
+OUTCOME_DEFENDERS = "defenders"
+OUTCOME_DRAW = "draw"
+OUTCOME_RETREAT = "retreat"
+
+OUTCOME_NAMES = {
+    OUTCOME_ATTACKERS: "Победа атакующих",
+    OUTCOME_DEFENDERS: "Победа защитников",
+    OUTCOME_DRAW: "Ничья",
+    OUTCOME_RETREAT: "Отступление",
+}
+
+# Коды событий в логе
+EVENT_TURN = "t"          # [код, ход, урон атак., уничтожено атак., урон защ., уничтожено защ., [id погибших]]
+EVENT_DISTANCE = "d"      # [код, ход, было, стало]
+EVENT_DOCTRINE = "p"      # [код, ход, fleet_id, доктрина]
+
+TURNS_PER_PAGE = 2
+KILLS_PER_TURN_SHOWN = 15
+
+
+def encode_log(record: dict) -> bytes:
+    payload = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    return zlib.compress(payload.encode("utf-8"), 9)
+
+
+def decode_log(blob: bytes) -> dict:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def render_pages(battle: dict, record: dict) -> List[str]:
+    """
+    Страницы повтора: обзор сторон, затем ходы по TURNS_PER_PAGE на страницу.
+    battle - строка таблицы battles, record - распакованный лог.
+    """
+    ships = record["ships"]
+
+    def name(ship_id):
+        ship = ships.get(str(ship_id))
+        return ship[1] if ship else f"#{ship_id}"
+
+    counts = [0, 0]
+    for side, _ in ships.values():
+        counts[side] += 1
+    sides = record["sides"]
+    pages = [
+        f"⚔️ **{battle['attacker_name']}** vs **{battle['defender_name']}**\n"
+        f"Дата: {battle['created_at']}\n"
+        f"Дистанция: {battle['distance']} км | Ходов: {battle['turns']} | Сид: `{battle['seed']}`\n\n"
+        f"🗡️ Атакующие: {', '.join(f[1] for f in sides[0])} — {counts[0]} кораблей\n"
+        f"🛡️ Защитники: {', '.join(f[1] for f in sides[1])} — {counts[1]} кораблей\n\n"
+        f"🏆 **{OUTCOME_NAMES.get(battle['outcome'], battle['outcome'])}**"
+    ]
+
+    fleet_names = {f[0]: f[1] for side in sides for f in side}
+    blocks = []
+    current = []
+    for event in record["events"]:
+        code = event[0]
+        if code == EVENT_DISTANCE:
+            current.append(f"↔️ Ход {event[1]}: дистанция {event[2]} → {event[3]} км")
+        elif code == EVENT_DOCTRINE:
+            current.append(f"🎯 Ход {event[1]}: {fleet_names.get(event[2], event[2])} — доктрина `{event[3]}`")
+        elif code == EVENT_TURN:
+            _, turn, a_dmg, a_kills, d_dmg, d_kills, killed = event
+            lines = [f"**Ход {turn}**", f"⚔️ Атакующие: {a_dmg:,} урона, уничтожено {a_kills}",
+                     f"🛡️ Защитники: {d_dmg:,} урона, уничтожено {d_kills}"]
+            if killed:
+                shown = ", ".join(name(ship_id) for ship_id in killed[:KILLS_PER_TURN_SHOWN])
+                more = len(killed) - KILLS_PER_TURN_SHOWN
+                lines.append(f"💀 {shown}" + (f" и ещё {more}" if more > 0 else ""))
+            current.extend(lines)
+            blocks.append("\n".join(current))
+            current = []
+    if current:
+        blocks.append("\n".join(current))
+
+    for start in range(0, len(blocks), TURNS_PER_PAGE):
+        pages.append("\n\n".join(blocks[start:start + TURNS_PER_PAGE]))
+    return pages
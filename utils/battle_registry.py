@@ -0,0 +1,100 @@
+import asyncio
+import itertools
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.constants import MAX_BATTLES_PER_FLEET, MAX_BATTLES_PER_GUILD, BATTLE_TTL_SECONDS
+
+
+@dataclass
+class BattleEntry:
+    """Запись реестра: бой, его блокировка и участники"""
+    battle_id: int
+    guild_id: int
+    fleet_ids: Tuple[int, ...]
+    battle: object
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    started_at: float = field(default_factory=time.monotonic)
+    # Время последнего действия игроков; по нему выселяются брошенные бои
+    last_activity: float = field(default_factory=time.monotonic)
+
+    def touch(self) -> None:
+        self.last_activity = time.monotonic()
+
+
+class BattleRegistry:
+    """
+    Реестр активных боёв.
+    Каждый бой получает собственный asyncio.Lock, чтобы ходы не выполнялись параллельно,
+    а число одновременных боёв ограничено на флот и на гильдию.
+    """
+
+    def __init__(self, per_fleet: int = MAX_BATTLES_PER_FLEET, per_guild: int = MAX_BATTLES_PER_GUILD,
+                 ttl: float = BATTLE_TTL_SECONDS):
+        self.per_fleet = per_fleet
+        self.per_guild = per_guild
+        self.ttl = ttl
+        self._ids = itertools.count(1)
+        self._battles: Dict[int, BattleEntry] = {}
+        self._by_fleet: Dict[int, set] = {}
+        self._by_guild: Dict[int, set] = {}
+
+    def __len__(self) -> int:
+        return len(self._battles)
+
+    def __contains__(self, battle_id: int) -> bool:
+        return battle_id in self._battles
+
+    def get(self, battle_id: int) -> Optional[BattleEntry]:
+        return self._battles.get(battle_id)
+
+    def check_limits(self, guild_id: int, fleet_ids: Iterable[int]) -> Optional[str]:
+        """Возвращает текст ошибки, если новый бой превысит лимиты, иначе None"""
+        self.evict_expired()
+        if len(self._by_guild.get(guild_id, ())) >= self.per_guild:
+            return f"На сервере уже идёт максимум боёв ({self.per_guild})."
+        for fleet_id in fleet_ids:
+            if len(self._by_fleet.get(fleet_id, ())) >= self.per_fleet:
+                return "Один из флотов уже участвует в бою."
+        return None
+
+    def register(self, guild_id: int, fleet_ids: Iterable[int], battle) -> BattleEntry:
+        """Регистрирует бой. Лимиты должны быть проверены через check_limits."""
+        fleet_ids = tuple(dict.fromkeys(fleet_ids))
+        entry = BattleEntry(next(self._ids), guild_id, fleet_ids, battle)
+        self._battles[entry.battle_id] = entry
+        self._by_guild.setdefault(guild_id, set()).add(entry.battle_id)
+        for fleet_id in fleet_ids:
+            self._by_fleet.setdefault(fleet_id, set()).add(entry.battle_id)
+        return entry
+
+    def release(self, battle_id: int) -> Optional[BattleEntry]:
+        """Удаляет бой из реестра. Повторный вызов безопасен."""
+        entry = self._battles.pop(battle_id, None)
+        if not entry:
+            return None
+        self._discard(self._by_guild, entry.guild_id, battle_id)
+        for fleet_id in entry.fleet_ids:
+            self._discard(self._by_fleet, fleet_id, battle_id)
+        return entry
+
+    def evict_expired(self) -> List[BattleEntry]:
+        """
+        Выселяет бои без действий игроков дольше ttl (например, брошенные сообщения).
+        Бой, ход которого сейчас выполняется (блокировка занята), не трогается.
+        """
+        deadline = time.monotonic() - self.ttl
+        expired = [e for e in self._battles.values() if e.last_activity < deadline and not e.lock.locked()]
+        for entry in expired:
+            self.release(entry.battle_id)
+        return expired
+
+    @staticmethod
+    def _discard(index: Dict[int, set], key: int, battle_id: int) -> None:
+        ids = index.get(key)
+        if ids is None:
+            return
+        ids.discard(battle_id)
+        if not ids:
+            del index[key]
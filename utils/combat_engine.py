@@ -0,0 +1,394 @@
+from array import array
+from collections import deque
+import math
+import random
+from typing import Dict, List, Optional, Tuple
+
+from models.schemas import Ship, ShipStatus
+from utils.constants import MAX_BATTLE_TURNS, MAX_BATTLE_DISTANCE, BATTLE_LOG_TAIL
+from utils.game_mechanics import get_combat_profile, fire_weapons, range_index
+from utils.interception import MissileSalvo
+from utils.battle_log import (
+    LOG_FORMAT_VERSION, EVENT_TURN, EVENT_DISTANCE, EVENT_DOCTRINE,
+    OUTCOME_ATTACKERS, OUTCOME_DEFENDERS, OUTCOME_DRAW, OUTCOME_RETREAT
+)
+from utils.targeting import DOCTRINE_RANDOM, TargetingIndex
+
+
+def _as_list(fleets) -> list:
+    return list(fleets) if isinstance(fleets, (list, tuple)) else [fleets]
+
+
+def hp_status(hp: float, max_hp: float) -> ShipStatus:
+    """Статус повреждений по остатку прочности"""
+    if hp <= 0:
+        return ShipStatus.DESTROYED
+    hp_percent = hp / max_hp if max_hp else 0
+    if hp_percent < 0.3:
+        return ShipStatus.CRITICAL_DAMAGE
+    if hp_percent < 0.6:
+        return ShipStatus.MODERATE_DAMAGE
+    if hp_percent < 0.9:
+        return ShipStatus.LIGHT_DAMAGE
+    return ShipStatus.OPERATIONAL
+
+
+class CombatSide:
+    """
+    Одна сторона боя в виде набора массивов (struct-of-arrays).
+    Корабль - это индекс i во всех массивах. Живые корабли хранятся в плотном списке
+    с обратным индексом, поэтому выбор случайной цели и удаление погибшего - O(1).
+    """
+
+    def __init__(self, ships: List[Ship]):
+        # Профили общие для одинаковой оснастки и берутся из кэша
+        profiles = [get_combat_profile(s) for s in ships]
+        n = len(ships)
+
+        self.ids = array('q', (s.id for s in ships))
+        self.fleet_ids = array('q', (s.fleet_id for s in ships))
+        self.callsigns = [s.callsign for s in ships]
+        self.hp = array('d', (p.hp for p in profiles))
+        self.max_hp = array('d', self.hp)
+        self.evasion = array('d', (p.evasion for p in profiles))
+        # Таблицы орудий - кортежи WeaponGroup, без копии на каждый экземпляр модуля
+        self.weapons = [p.weapons for p in profiles]
+        self.guns = [p.guns for p in profiles]
+        self.missiles = [p.missiles for p in profiles]
+        self.pd_intercepts = array('l', (p.pd_intercepts for p in profiles))
+        self.pd_accuracy = array('d', (p.pd_accuracy for p in profiles))
+        # Ловушки расходуются за бой
+        self.decoys = array('l', (p.decoys for p in profiles))
+        self.threat = array('d', (p.threat for p in profiles))
+        self.missile_threat = array('d', (p.missile_threat for p in profiles))
+        self.defence = array('l', (p.defence for p in profiles))
+        self.alive_mask = bytearray(b'\x01') * n
+        # Итоги для user_stats копятся в памяти по флотам и пишутся один раз в конце боя
+        self.fleet_damage: Dict[int, int] = {}
+        self.fleet_kills: Dict[int, int] = {}
+        self._alive = array('l', range(n))
+        self._pos = array('l', range(n))
+        # Корабли без прочности в бой не вступают
+        for i in range(n):
+            if self.hp[i] <= 0:
+                self._kill(i)
+        # Индексы доктрин строятся после отсева, только над живыми
+        self.targeting = TargetingIndex(self)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def alive_count(self) -> int:
+        return len(self._alive)
+
+    def alive_indices(self) -> Tuple[int, ...]:
+        """Снимок живых кораблей (порядок не гарантирован)"""
+        return tuple(self._alive)
+
+    def random_alive(self, rng: Optional[random.Random] = None) -> int:
+        return self._alive[int((rng or random).random() * len(self._alive))]
+
+    def apply_damage(self, i: int, damage: float) -> bool:
+        """Наносит урон кораблю i. Возвращает True, если корабль погиб от этого урона."""
+        if not self.alive_mask[i]:
+            return False
+        self.hp[i] -= damage
+        killed = self.hp[i] <= 0
+        if killed:
+            self._kill(i)
+        if damage:
+            self.targeting.on_damage(i, killed)
+        return killed
+
+    def _kill(self, i: int) -> None:
+        # swap-remove из плотного списка живых
+        self.alive_mask[i] = 0
+        pos = self._pos[i]
+        last = self._alive[-1]
+        self._alive[pos] = last
+        self._pos[last] = pos
+        self._alive.pop()
+
+    def credit(self, fleet_id: int, damage: int, kills: int) -> None:
+        if damage:
+            self.fleet_damage[fleet_id] = self.fleet_damage.get(fleet_id, 0) + damage
+        if kills:
+            self.fleet_kills[fleet_id] = self.fleet_kills.get(fleet_id, 0) + kills
+
+    def status_lines(self) -> List[str]:
+        return [f"{self.callsigns[i]}: {max(0, int(self.hp[i]))} HP" for i in range(len(self))]
+
+
+class BattleState:
+    """
+    Состояние боя. Каждая сторона может состоять из нескольких флотов (союзный бой):
+    их корабли сводятся в одну CombatSide и обрабатываются одним проходом движка.
+    """
+    mode = "ships"
+
+    def __init__(self, attacker_fleets, defender_fleets, attacker_ships, defender_ships, distance, seed=None):
+        self.attacker_fleets = _as_list(attacker_fleets)
+        self.defender_fleets = _as_list(defender_fleets)
+        # Ведущие флоты сторон
+        self.attacker_fleet = self.attacker_fleets[0]
+        self.defender_fleet = self.defender_fleets[0]
+        self.distance = distance
+        self.start_distance = distance
+        # Свой генератор на бой: ход воспроизводим по сиду и действиям игроков
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        self.rng = random.Random(self.seed)
+        # Компактный журнал для истории боёв (см. utils.battle_log)
+        self.events = []
+        self.turn = 1
+        self.max_turns = MAX_BATTLE_TURNS
+        # Хвост лога для embed; полный лог не копится в памяти
+        self.logs = deque(maxlen=BATTLE_LOG_TAIL)
+        self.turn_summaries = []
+        self.destroyed = []
+        self.finished = False
+        self.applied = False
+        # fleet_id -> доктрина целеуказания; по умолчанию случайные цели
+        self.doctrines: Dict[int, str] = {}
+
+        self.attackers = CombatSide(attacker_ships)
+        self.defenders = CombatSide(defender_ships)
+
+        # Map IDs to original objects for final updates
+        self.a_ships_map = {s.id: s for s in attacker_ships}
+        self.d_ships_map = {s.id: s for s in defender_ships}
+
+    @property
+    def participant_ids(self):
+        """user_id всех командиров обеих сторон"""
+        return {f.user_id for f in self.attacker_fleets + self.defender_fleets}
+
+    @property
+    def attacker_name(self):
+        return " + ".join(f.name for f in self.attacker_fleets)
+
+    @property
+    def defender_name(self):
+        return " + ".join(f.name for f in self.defender_fleets)
+
+    def change_distance(self, delta: int) -> int:
+        """Сближение (delta < 0) или отход между ходами. Возвращает новую дистанцию."""
+        before = self.distance
+        self.distance = min(MAX_BATTLE_DISTANCE, max(0, self.distance + delta))
+        if self.distance != before:
+            self.events.append([EVENT_DISTANCE, self.turn, before, self.distance])
+        return self.distance
+
+    def set_doctrine(self, fleet_id: int, doctrine: str) -> None:
+        self.doctrines[fleet_id] = doctrine
+        self.events.append([EVENT_DOCTRINE, self.turn, fleet_id, doctrine])
+
+    @property
+    def is_over(self):
+        return (not self.attackers.alive_count or not self.defenders.alive_count
+                or self.turn > self.max_turns)
+
+    def _side_volley(self, shooters: CombatSide, targets: CombatSide, round_log):
+        """
+        Залп одной стороны. Возвращает (урон, уничтожено). round_log=None - без текстового лога.
+        Фазы: пуск ракет и ствольный огонь, перехват ракет ПРО и ловушками, попадания ракет.
+        """
+        damage = 0
+        kills = 0
+        selectors = {}
+        distance = self.distance
+        km = range_index(distance)
+        salvo = MissileSalvo(self.rng)
+
+        def hit(i, t, dmg):
+            nonlocal damage, kills
+            # В статистику идёт только снятая прочность, без перебития
+            dmg = min(dmg, int(math.ceil(targets.hp[t])))
+            damage += dmg
+            killed = targets.apply_damage(t, dmg)
+            shooters.credit(shooters.fleet_ids[i], dmg, int(killed))
+            if killed:
+                kills += 1
+                self.destroyed.append(targets.ids[t])
+                if round_log is not None:
+                    round_log.append(f"💀 **{targets.callsigns[t]}** уничтожен!")
+
+        # 1. Пуск ракет и ствольный огонь
+        for i in shooters.alive_indices():
+            if not targets.alive_count:
+                break
+            name = shooters.callsigns[i]
+            if not shooters.weapons[i]:
+                if round_log is not None:
+                    round_log.append(f"⚠️ **{name}** не имеет вооружения!")
+                continue
+
+            fleet_id = shooters.fleet_ids[i]
+            selector = selectors.get(fleet_id)
+            if selector is None:
+                doctrine = self.doctrines.get(fleet_id, DOCTRINE_RANDOM)
+                selector = selectors[fleet_id] = targets.targeting.selector(doctrine)
+            t = selector.pick(self.rng)
+
+            if shooters.missiles[i]:
+                launched = salvo.launch(i, shooters.missiles[i], t, targets.evasion[t], km)
+                if round_log is not None:
+                    for w_name, on_course, shots in launched:
+                        round_log.append(f"🚀 **{name}** ({w_name}): {on_course}/{shots} ракет на курсе к **{targets.callsigns[t]}**")
+            if shooters.guns[i]:
+                dmg = fire_weapons(shooters.guns[i], name, targets.callsigns[t], targets.evasion[t], distance, round_log,
+                                   self.rng)
+                if dmg:
+                    hit(i, t, dmg)
+
+        if not salvo:
+            return damage, kills
+
+        # 2. Перехват
+        report = salvo.intercept(targets.pd_intercepts, targets.pd_accuracy, targets.decoys)
+        if round_log is not None:
+            for t, (incoming, shot_down, seduced) in report.items():
+                if (shot_down or seduced) and targets.alive_mask[t]:
+                    round_log.append(
+                        f"🛡️ **{targets.callsigns[t]}**: ПРО сбила {shot_down}, ловушки увели {seduced} из {incoming}"
+                    )
+
+        # 3. Попадания: ракеты по уже уничтоженной цели пропадают
+        for i, t, w_name, count, dmg in salvo.impacts():
+            if not targets.alive_mask[t]:
+                continue
+            if round_log is not None:
+                round_log.append(
+                    f"💥 **{shooters.callsigns[i]}** ({w_name}) поразил **{targets.callsigns[t]}** {count} ракетами! Урон: {int(dmg)}"
+                )
+            hit(i, t, int(dmg))
+        return damage, kills
+
+    def run_turn(self, verbose=True):
+        """Проводит один ход боя и возвращает его лог (пустой при verbose=False)"""
+        round_log = [] if verbose else None
+        destroyed_before = len(self.destroyed)
+
+        # 1. Attacker Volley
+        a_dmg, a_kills = self._side_volley(self.attackers, self.defenders, round_log)
+        # 2. Defender Volley
+        d_dmg, d_kills = self._side_volley(self.defenders, self.attackers, round_log)
+
+        self.turn_summaries.append((self.turn, a_dmg, a_kills, d_dmg, d_kills))
+        self.events.append([EVENT_TURN, self.turn, int(a_dmg), a_kills, int(d_dmg), d_kills,
+                            self.destroyed[destroyed_before:]])
+        self.turn += 1
+        if round_log is None:
+            return []
+        self.logs.extend(round_log)
+        return round_log
+
+    def winner(self):
+        """Победившие флоты (список) или None при ничьей"""
+        a_alive = self.attackers.alive_count > 0
+        d_alive = self.defenders.alive_count > 0
+        if a_alive and not d_alive:
+            return self.attacker_fleets
+        if d_alive and not a_alive:
+            return self.defender_fleets
+        return None
+
+    def result_text(self, reason="normal"):
+        if reason == "retreat":
+            return "Бой прерван отступлением"
+        winner = self.winner()
+        if winner:
+            return f"Победа {' + '.join(f.name for f in winner)}!"
+        return "Ничья"
+
+    def outcome(self, reason="normal"):
+        if reason == "retreat":
+            return OUTCOME_RETREAT
+        winner = self.winner()
+        if winner is self.attacker_fleets:
+            return OUTCOME_ATTACKERS
+        if winner is self.defender_fleets:
+            return OUTCOME_DEFENDERS
+        return OUTCOME_DRAW
+
+    @property
+    def key(self) -> str:
+        """Идентификатор боя: сид и флоты сторон. По нему БД не даёт записать итоги дважды"""
+        sides = "|".join(",".join(str(f.id) for f in fleets)
+                         for fleets in (self.attacker_fleets, self.defender_fleets))
+        return f"{self.seed}:{sides}"
+
+    def history_record(self, reason="normal"):
+        """Строка для таблицы battles и список участников; лог сжимается в БД-слое"""
+        ships = {}
+        for side, ships_map in enumerate((self.a_ships_map, self.d_ships_map)):
+            for ship_id, ship in ships_map.items():
+                ships[ship_id] = [side, ship.callsign]
+        outcome = self.outcome(reason)
+        winners = {OUTCOME_ATTACKERS: 0, OUTCOME_DEFENDERS: 1}.get(outcome)
+        participants = [
+            (fleet.id, fleet.user_id, side, int(winners == side))
+            for side, fleets in enumerate((self.attacker_fleets, self.defender_fleets))
+            for fleet in fleets
+        ]
+        record = {
+            "v": LOG_FORMAT_VERSION,
+            "sides": [[[f.id, f.name, f.user_id] for f in fleets]
+                      for fleets in (self.attacker_fleets, self.defender_fleets)],
+            "ships": ships,
+            "events": self.events,
+        }
+        battle = {
+            "key": self.key,
+            "seed": self.seed,
+            "mode": self.mode,
+            "distance": self.start_distance,
+            "turns": self.turn - 1,
+            "outcome": outcome,
+            "attacker_name": self.attacker_name,
+            "defender_name": self.defender_name,
+        }
+        return battle, participants, record
+
+    def final_statuses(self):
+        """Статусы повреждений по итоговому HP: [(ship_id, status)]"""
+        statuses = []
+        for side in (self.attackers, self.defenders):
+            for i in range(len(side)):
+                if side.alive_mask[i]:
+                    status = hp_status(side.hp[i], side.max_hp[i])
+                else:
+                    status = ShipStatus.DESTROYED
+                statuses.append((side.ids[i], status))
+        return statuses
+
+    def result_stats(self, reason="normal"):
+        """Приращения user_stats: [(user_id, won, lost, destroyed, damage)]"""
+        winner = self.winner() if reason == "normal" else None
+        rows = []
+        for fleets, side in ((self.attacker_fleets, self.attackers), (self.defender_fleets, self.defenders)):
+            for fleet in fleets:
+                won = lost = 0
+                if winner is not None:
+                    won = int(winner is fleets)
+                    lost = 1 - won
+                rows.append((fleet.user_id, won, lost, side.fleet_kills.get(fleet.id, 0),
+                             int(side.fleet_damage.get(fleet.id, 0))))
+        return rows
+
+    def compressed_log(self):
+        """Сжатый лог: одна строка на ход"""
+        return [
+            f"`{turn:>2}` ⚔️ {a_dmg:,} урона" + (f" (💀{a_kills})" if a_kills else "") +
+            f" | 🛡️ {d_dmg:,} урона" + (f" (💀{d_kills})" if d_kills else "")
+            for turn, a_dmg, a_kills, d_dmg, d_kills in self.turn_summaries
+        ]
+
+    def status_fields(self):
+        return "\n".join(self.attackers.status_lines()), "\n".join(self.defenders.status_lines())
+
+    def get_progress_bar(self):
+        percent = (self.turn / self.max_turns)
+        filled = int(percent * 10)
+        bar = "█" * filled + "░" * (10 - filled)
+        return f"[{bar}] {self.turn}/{self.max_turns}"
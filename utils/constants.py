@@ -92,16 +92,44 @@ RATIONS_PER_CREW = 1      # Пайки на человека
 RATIONS_BASE_PRICE = 10   # ЗР за 1 паёк
 METHANE_BASE_PRICE = 5    # ЗР за 1 тонну метана
 
+# Стартовая локация флотилий; всегда есть на карте сервера
+START_LOCATION = "Столица"
+START_LOCATION_SPEC = "База Флота"
+
 # Скидки по локациям
 DISCOUNT_FLEET_BASE = 0.7       # База Флота: -30%
 DISCOUNT_FUEL_DEPOT = 0.5       # Топливохранилище: метан -50%
 SELL_PRICE_MULTIPLIER = 0.5     # Продажа: 50% от стоимости
+CART_MAX_LINES = 25             # Позиций в корзине
+
+# Рыночное ценообразование: множитель = 1 + эластичность * (спрос - предложение) / глубина
+PRICE_ELASTICITY = 0.25
+PRICE_DEPTH_MODULE = 10         # Модулей, сдвигающих цену на PRICE_ELASTICITY
+PRICE_DEPTH_RESOURCE = 1000     # Единиц ресурса, сдвигающих цену на PRICE_ELASTICITY
+PRICE_FACTOR_MIN = 0.5
+PRICE_FACTOR_MAX = 2.0
+PRICE_DECAY = 0.75              # Индексы спроса и предложения за ход
+PRICE_FLUSH_SECONDS = 60        # Период пакетной записи цен в БД
+ORDER_BOOK_LEVELS_SHOWN = 5     # Ценовых уровней стакана в !биржа
+ORDER_MAX_PRICE = 1_000_000_000 # Предельная цена заявки за шт.
+ORDER_MAX_QUANTITY = 100_000    # Предельный объём заявки
 
 # Боевая система
 MAX_BATTLE_TURNS = 10
 MAX_BATTLE_DISTANCE = 20
+DEFAULT_BATTLE_DISTANCE = 10
+BATTLE_DISTANCE_STEP = 2        # Сближение/отход за одно нажатие, км
 RETREAT_CHANCE = 0.5
 MIN_HIT_CHANCE = 0.05
+MAX_BATTLES_PER_FLEET = 1       # Одновременных боёв на флот
+MAX_BATTLES_PER_GUILD = 10      # Одновременных боёв на сервер
+BATTLE_TTL_SECONDS = 900        # Бой без действий игроков выселяется из реестра
+BATTLE_LOG_TAIL = 50            # Строк лога боя, хранимых в памяти
+COMBAT_PROFILE_CACHE_SIZE = 1024  # Профилей оснастки в кэше
+POINT_DEFENCE_MODULES = ("Палаш-1",)  # Системы ПРО
+DECOY_MODULES = ("АСО-75",)           # Ловушки
+PD_SHOTS_PER_MISSILE = 5        # Выстрелов ПРО на перехват одной ракеты
+DECOY_SEDUCE_CHANCE = 0.35      # Шанс, что ловушка уведёт ракету
 
 # Стартовые ресурсы
 STARTING_GOLD = 10000
@@ -110,3 +138,4 @@ STARTING_METHANE = 200
 
 # Пагинация
 SHOP_ITEMS_PER_PAGE = 8
+DEBRIS_ITEMS_PER_PAGE = 25      # Лимит вариантов в select-меню Discord
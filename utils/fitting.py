@@ -0,0 +1,113 @@
+"""
+Сервис оснащения кораблей.
+
+Изменения оснастки задаются списком `ID`, `ID:кол-во` (установить) и `-ID[:кол-во]`
+(снять) и применяются одной транзакцией (Database.refit_ship). Итоговые вес, тяга,
+TWR и уклонение берутся из кэша боевых профилей по новой оснастке, а не
+пересчитываются по модулям.
+
+Шаблон оснастки - {module_id: кол-во}. Применение шаблона сводится к минимальной
+разнице с текущей оснасткой каждого корабля; потребность в складе считается по
+всей пачке кораблей сразу (снятое с одного корабля идёт на другой).
+"""
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from models.schemas import Module, Ship, ShipModule
+from utils.game_mechanics import get_combat_profile
+from utils.locations import CatalogItem, ShopCatalog
+from utils.ship_presets import SHIP_PRESETS
+
+
+class FitStats(NamedTuple):
+    weight: int
+    thrust: int
+    twr: float
+    evasion: float
+
+    @property
+    def flyable(self) -> bool:
+        return self.thrust >= self.weight
+
+
+def parse_refit(tokens: Iterable[str], sign: int = 1,
+                resolve: Optional[Callable[[str], Optional[int]]] = None) -> Optional[Dict[int, int]]:
+    """
+    {module_id: изменение} по токенам `ID`, `ID:кол-во`, `-ID[:кол-во]`; нулевые итоги отбрасываются.
+    Вместо ID допускается название, если передан resolve (ShopCatalog.resolve).
+    sign=-1 инвертирует все токены (команда снятия). None при ошибке разбора.
+    """
+    changes: Dict[int, int] = {}
+    for token in tokens:
+        direction = sign
+        if token[:1] in "+-":
+            direction *= -1 if token[0] == "-" else 1
+            token = token[1:]
+        name, _, count = token.partition(":")
+        if count and not count.isdigit():
+            return None
+        count = int(count) if count else 1
+        module_id = resolve(name) if resolve else (int(name) if name.isdigit() else None)
+        if module_id is None or count <= 0:
+            return None
+        changes[module_id] = changes.get(module_id, 0) + direction * count
+    return {module_id: delta for module_id, delta in changes.items() if delta}
+
+
+def module_from_catalog(item: CatalogItem) -> Module:
+    return Module(id=item.id, name=item.name, type=item.type, weight=item.weight,
+                  price=item.base_price, stats=item.stats)
+
+
+def refit_loadout(ship: Ship, changes: Dict[int, int], modules: Dict[int, CatalogItem]) -> Ship:
+    """Копия корабля с применёнными изменениями оснастки (без обращения к БД)"""
+    fitted = {sm.module_id: sm for sm in ship.modules}
+    result = []
+    for module_id, sm in fitted.items():
+        count = sm.count + changes.get(module_id, 0)
+        if count > 0:
+            result.append(sm.model_copy(update={"count": count}))
+    for module_id, delta in changes.items():
+        if module_id not in fitted and delta > 0:
+            result.append(ShipModule(ship_id=ship.id, module_id=module_id, count=delta,
+                                     module=module_from_catalog(modules[module_id])))
+    return ship.model_copy(update={"modules": result})
+
+
+def fit_stats(ship: Ship) -> FitStats:
+    """Характеристики оснастки из кэшированного боевого профиля"""
+    profile = get_combat_profile(ship)
+    twr = profile.thrust / profile.weight if profile.weight else 0.0
+    return FitStats(profile.weight, profile.thrust, twr, profile.evasion)
+
+
+def loadout_diff(current: Dict[int, int], template: Dict[int, int]) -> Dict[int, int]:
+    """Минимальные изменения {module_id: delta}, приводящие оснастку к шаблону"""
+    diff = {}
+    for module_id in current.keys() | template.keys():
+        delta = template.get(module_id, 0) - current.get(module_id, 0)
+        if delta:
+            diff[module_id] = delta
+    return diff
+
+
+def stock_shortages(plan: Dict[int, Dict[int, int]], stock: Dict[int, int]) -> List[Tuple[int, int]]:
+    """Нехватка на складе для всей пачки: [(module_id, недостаёт)] по чистой потребности"""
+    net: Dict[int, int] = {}
+    for changes in plan.values():
+        for module_id, delta in changes.items():
+            net[module_id] = net.get(module_id, 0) + delta
+    return [(module_id, need - stock.get(module_id, 0))
+            for module_id, need in net.items() if need > stock.get(module_id, 0)]
+
+
+def preset_loadout(project: str, catalog: ShopCatalog) -> Optional[Dict[int, int]]:
+    """Встроенный пресет проекта (SHIP_PRESETS) как шаблон; названия модулей ищутся по индексу каталога"""
+    preset = SHIP_PRESETS.get(project.lower())
+    if preset is None:
+        return None
+    loadout = {}
+    for name, count in preset["loadout"]:
+        module_id = catalog.names.resolve(name)
+        if module_id is not None:
+            loadout[module_id] = loadout.get(module_id, 0) + count
+    return loadout
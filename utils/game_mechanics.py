@@ -1,6 +1,14 @@
-from typing import Dict, List, Tuple
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+import hashlib
+import math
 import random
 from models.schemas import Ship, ModuleType, ShipStatus
+from utils.constants import (
+    MIN_HIT_CHANCE, COMBAT_PROFILE_CACHE_SIZE, POINT_DEFENCE_MODULES, DECOY_MODULES,
+    MAX_BATTLE_DISTANCE, DEFAULT_BATTLE_DISTANCE, PD_SHOTS_PER_MISSILE
+)
 
 # --- MODULE DEFINITIONS (Prototypes) ---
 # In a real app these might be in the DB, but for simplicity we define them here
@@ -79,100 +87,294 @@ async def seed_modules(db):
                     (mod["name"], mod["type"].value, mod["weight"], mod["price"], json.dumps(mod["stats"]))
                 )
         await conn.commit()
+    # Каталог мог измениться - профили оснастки пересобираются
+    invalidate_combat_profile()
 
 # --- COMBAT MECHANICS ---
 
+# Кривые точности по дистанции: (км, множитель точности), между точками - линейно.
+# Артиллерия и РСЗО плохи вблизи, ракетам нужна дистанция взведения,
+# пушки, ПРО и неуправляемые бомбы теряют точность с расстоянием.
+RANGE_FALLOFF = {
+    "autocannon":    ((0, 1.0), (3, 1.0), (20, 0.3)),
+    "point_defence": ((0, 1.0), (2, 1.0), (20, 0.2)),
+    "artillery":     ((0, 0.6), (2, 0.6), (5, 1.0), (15, 1.0), (20, 0.85)),
+    "mlrs":          ((0, 0.7), (6, 1.0), (16, 1.0), (20, 0.9)),
+    "missile":       ((0, 0.5), (1, 0.5), (3, 1.0), (20, 0.95)),
+    "bomb":          ((0, 1.0), (2, 1.0), (20, 0.4)),
+}
+
+
+def classify_weapon(name: str, stats: dict) -> str:
+    """Класс орудия по характеристикам модуля (каталог в БД не хранит класс явно)"""
+    if stats.get("weapon_class") in RANGE_FALLOFF:
+        return stats["weapon_class"]
+    ammo_type = stats.get("ammo_type")
+    if ammo_type in ("missile", "bomb"):
+        return ammo_type
+    if name in POINT_DEFENCE_MODULES:
+        return "point_defence"
+    if stats.get("shots", 1) >= 20:
+        return "mlrs"
+    if stats.get("damage", 10) >= 600:
+        return "artillery"
+    return "autocannon"
+
+
+def range_index(distance: float) -> int:
+    """Дистанция в индекс таблицы: целые км в пределах [0, MAX_BATTLE_DISTANCE]"""
+    return min(MAX_BATTLE_DISTANCE, max(0, int(distance)))
+
+
+@lru_cache(maxsize=None)
+def range_table(weapon_class: str, accuracy: float) -> Tuple[float, ...]:
+    """Точность орудия на каждом целом км от 0 до MAX_BATTLE_DISTANCE. Считается один раз на (класс, точность)."""
+    points = RANGE_FALLOFF[weapon_class]
+    table = []
+    for km in range(MAX_BATTLE_DISTANCE + 1):
+        multiplier = points[-1][1]
+        for (x0, y0), (x1, y1) in zip(points, points[1:]):
+            if x0 <= km <= x1:
+                multiplier = y0 + (y1 - y0) * (km - x0) / (x1 - x0) if x1 > x0 else y1
+                break
+        table.append(accuracy * multiplier)
+    return tuple(table)
+
+
+class WeaponGroup(NamedTuple):
+    """
+    Группа одинаковых орудий корабля: shots - суммарное число выстрелов за залп.
+    ranges - точность по дистанции, индекс = км (см. range_table).
+    """
+    name: str
+    damage: int
+    accuracy: float
+    shots: int
+    ammo_type: Optional[str] = None
+    weapon_class: str = "autocannon"
+    ranges: Tuple[float, ...] = ()
+
+
+def build_weapon_groups(ship: Ship) -> Tuple[WeaponGroup, ...]:
+    """Собирает таблицу орудий: одна запись на тип модуля вместо копии на каждый экземпляр"""
+    groups = []
+    for sm in ship.modules:
+        if sm.module and sm.module.type == ModuleType.WEAPON and sm.count > 0:
+            stats = sm.module.stats
+            weapon_class = classify_weapon(sm.module.name, stats)
+            accuracy = stats.get("accuracy", 0.5)
+            groups.append(WeaponGroup(
+                name=sm.module.name,
+                damage=stats.get("damage", 10),
+                accuracy=accuracy,
+                shots=stats.get("shots", 1) * sm.count,
+                ammo_type=stats.get("ammo_type"),
+                weapon_class=weapon_class,
+                ranges=range_table(weapon_class, accuracy)
+            ))
+    return tuple(groups)
+
+class CombatProfile(NamedTuple):
+    """Боевой профиль оснастки. Общий для всех кораблей с одинаковой оснасткой."""
+    hp: int
+    evasion: float
+    weapons: Tuple[WeaponGroup, ...]
+    weight: int
+    thrust: int
+    # Оценки для доктрин целеуказания
+    threat: float = 0.0          # Ожидаемый урон залпа без учёта уклонения цели
+    missile_threat: float = 0.0  # То же, только ракеты
+    defence: int = 0             # Выстрелы ПРО + ловушки
+    # Фазы ракетного боя: ракеты летят отдельно от ствольного огня и могут быть перехвачены
+    guns: Tuple[WeaponGroup, ...] = ()
+    missiles: Tuple[WeaponGroup, ...] = ()
+    pd_intercepts: int = 0       # Перехватов ПРО за ход
+    pd_accuracy: float = 0.0     # Шанс перехвата одной ракеты
+    decoys: int = 0              # Запас ловушек на бой
+
+
+# fingerprint -> CombatProfile, LRU
+_PROFILE_CACHE: "OrderedDict[str, CombatProfile]" = OrderedDict()
+
+
+def loadout_fingerprint(ship: Ship) -> str:
+    """Хэш (класс, экипаж, отсортированные (id модуля, количество))"""
+    loadout = sorted((sm.module_id, sm.count) for sm in ship.modules if sm.module)
+    key = repr((ship.ship_class, ship.current_crew, loadout)).encode()
+    return hashlib.blake2b(key, digest_size=16).hexdigest()
+
+def get_combat_profile(ship: Ship) -> CombatProfile:
+    """Возвращает кэшированный профиль, собирая его только при первом обращении"""
+    fingerprint = loadout_fingerprint(ship)
+    profile = _PROFILE_CACHE.get(fingerprint)
+    if profile is not None:
+        _PROFILE_CACHE.move_to_end(fingerprint)
+        return profile
+
+    weapons = build_weapon_groups(ship)
+    decoys = sum(sm.module.stats.get("capacity", 0) * sm.count
+                 for sm in ship.modules if sm.module and sm.module.name in DECOY_MODULES)
+    point_defence = [w for w in weapons if w.weapon_class == "point_defence"]
+    pd_shots = sum(w.shots for w in point_defence)
+    profile = CombatProfile(
+        hp=ship.total_hp,
+        evasion=ship.evasion,
+        weapons=weapons,
+        weight=ship.total_weight,
+        thrust=ship.total_thrust,
+        threat=sum(w.damage * w.shots * w.accuracy for w in weapons),
+        missile_threat=sum(w.damage * w.shots * w.accuracy for w in weapons if w.ammo_type == "missile"),
+        defence=pd_shots + decoys,
+        guns=tuple(w for w in weapons if w.ammo_type != "missile"),
+        missiles=tuple(w for w in weapons if w.ammo_type == "missile"),
+        pd_intercepts=pd_shots // PD_SHOTS_PER_MISSILE,
+        # ПРО работает по ракетам на подлёте, поэтому точность берётся на 0 км
+        pd_accuracy=max((w.ranges[0] for w in point_defence), default=0.0),
+        decoys=decoys
+    )
+    _PROFILE_CACHE[fingerprint] = profile
+    if len(_PROFILE_CACHE) > COMBAT_PROFILE_CACHE_SIZE:
+        _PROFILE_CACHE.popitem(last=False)
+    return profile
+
+def invalidate_combat_profile(fingerprint: Optional[str] = None) -> None:
+    """Сбрасывает профиль оснастки (при переоснащении) или весь кэш (fingerprint=None)"""
+    if fingerprint is None:
+        _PROFILE_CACHE.clear()
+    else:
+        _PROFILE_CACHE.pop(fingerprint, None)
+
 def calculate_ship_combat_stats(ship: Ship) -> dict:
     """Aggregates ship stats for combat"""
-    total_hp = ship.total_hp
-    evasion = ship.evasion
-    
-    weapons = []
-    for sm in ship.modules:
-        if sm.module and sm.module.type == ModuleType.WEAPON:
-            # Add weapon instance for each count
-            for _ in range(sm.count):
-                w_stats = sm.module.stats.copy()
-                w_stats['name'] = sm.module.name # Include name for logs
-                weapons.append(w_stats)
-    
+    profile = get_combat_profile(ship)
     return {
-        "hp": total_hp,
-        "evasion": evasion,
-        "weapons": weapons,
+        "hp": profile.hp,
+        "evasion": profile.evasion,
+        "weapons": profile.weapons,
         "callsign": ship.callsign,
         "id": ship.id
     }
 
-def simulate_volley(attacker_stats: dict, defender_stats: dict) -> Tuple[List[str], int]:
+def fire_weapons(weapons: Tuple[WeaponGroup, ...], attacker_name: str, defender_name: str,
+                 defender_evasion: float, distance: int = DEFAULT_BATTLE_DISTANCE,
+                 logs: Optional[List[str]] = None, rng: Optional[random.Random] = None) -> int:
     """
-    Simulates one volley from attacker to defender.
-    Returns (logs, total_damage)
+    Core of a volley: rolls every shot of every weapon group.
+    Appends log lines when logs is given, returns total damage.
+    rng - the battle's own generator; the module-level random is used when omitted.
     """
-    logs = []
-    attacker_name = attacker_stats['callsign']
-    defender_name = defender_stats['callsign']
-    defender_evasion = defender_stats.get('evasion', 0.0)
-    
     total_damage = 0
-    
-    if not attacker_stats['weapons']:
-         logs.append(f"⚠️ **{attacker_name}** не имеет вооружения!")
-         return logs, 0
+    rand = (rng or random).random
+    km = range_index(distance)
+
+    for weapon in weapons:
+        w_name, dmg, shots = weapon.name, weapon.damage, weapon.shots
+        # Hit chance = Accuracy at this distance - Defender Evasion
+        # Example: Acc 0.8 - Eva 0.2 = 0.6 (60%)
+        hit_chance = weapon.ranges[km] - defender_evasion
+        if hit_chance < MIN_HIT_CHANCE: hit_chance = MIN_HIT_CHANCE
 
-    for weapon in attacker_stats['weapons']:
-        # Weapon stats
-        dmg = weapon.get("damage", 10)
-        acc = weapon.get("accuracy", 0.5)
-        shots = weapon.get("shots", 1)
-        w_name = weapon.get("name", "Орудие")
-        
         hits = 0
         for _ in range(shots):
-            # Hit chance = Weapon Accuracy - Defender Evasion
-            # Example: Acc 0.8 - Eva 0.2 = 0.6 (60%)
-            # If evasion is high, hit chance drops.
-            hit_chance = acc - defender_evasion
-            if hit_chance < 0.05: hit_chance = 0.05 # Min 5% chance
-            
-            if random.random() < hit_chance:
+            if rand() < hit_chance:
                 hits += 1
-        
+
         if hits > 0:
             volley_dmg = hits * dmg
             total_damage += volley_dmg
-            logs.append(f"💥 **{attacker_name}** ({w_name}) попал {hits}/{shots} раз по **{defender_name}**! Урон: {volley_dmg}")
-        else:
+            if logs is not None:
+                logs.append(f"💥 **{attacker_name}** ({w_name}) попал {hits}/{shots} раз по **{defender_name}**! Урон: {volley_dmg}")
+        elif logs is not None:
             logs.append(f"💨 **{attacker_name}** ({w_name}) промахнулся по **{defender_name}**!")
-            
+
+    return total_damage
+
+def simulate_volley(attacker_stats: dict, defender_stats: dict,
+                    distance: int = DEFAULT_BATTLE_DISTANCE) -> Tuple[List[str], int]:
+    """
+    Simulates one volley from attacker to defender.
+    Returns (logs, total_damage)
+    """
+    logs = []
+    attacker_name = attacker_stats['callsign']
+
+    if not attacker_stats['weapons']:
+         logs.append(f"⚠️ **{attacker_name}** не имеет вооружения!")
+         return logs, 0
+
+    total_damage = fire_weapons(
+        attacker_stats['weapons'], attacker_name, defender_stats['callsign'],
+        defender_stats.get('evasion', 0.0), distance, logs
+    )
     return logs, total_damage
 
+# До этого числа испытаний биномиальное распределение разыгрывается точно
+EXACT_BINOMIAL_LIMIT = 30
+
+
+def binomial(n: int, p: float, rng: Optional[random.Random] = None) -> int:
+    """
+    Число успехов из n испытаний: точно для малых n, нормальное приближение для больших.
+    rng - генератор боя (по умолчанию модуль random).
+    """
+    rng = rng or random
+    if n <= 0 or p <= 0:
+        return 0
+    if p >= 1:
+        return n
+    if n <= EXACT_BINOMIAL_LIMIT:
+        rand = rng.random
+        return sum(1 for _ in range(n) if rand() < p)
+    mean = n * p
+    hits = int(round(rng.gauss(mean, math.sqrt(mean * (1 - p)))))
+    return min(n, max(0, hits))
+
+
+def allocate(total: int, shares: List[float], rng: Optional[random.Random] = None) -> List[int]:
+    """
+    Делит total выстрелов по долям систематической выборкой со случайным сдвигом:
+    сумма всегда равна total, а в среднем каждая доля получает total * share.
+    """
+    result = []
+    cumulative = (rng or random).random()
+    previous = 0
+    for share in shares:
+        cumulative += total * share
+        current = int(cumulative)
+        result.append(current - previous)
+        previous = current
+    # Погрешность округления float уходит последней доле
+    result[-1] += total - sum(result)
+    return result
+
+
 def generate_debris_field(ships: List[Ship], guaranteed_weapons: bool = False) -> List[dict]:
     """
     Generates debris from destroyed/damaged ships for the "Battlefield" menu.
+    Identical drops are merged into stacks keyed by (type, module_id / resource name, modifier).
     """
-    debris = []
-    
+    stacks: Dict[tuple, dict] = {}
+
+    def add(key, item, amount):
+        stack = stacks.get(key)
+        if stack is None:
+            stack = stacks[key] = dict(item, amount=0)
+        stack["amount"] += amount
+
     for ship in ships:
         # 1. Fuel Debris
         if random.random() < 0.6:
-            debris.append({
-                "type": "resource",
-                "name": "Топливо",
-                "amount": random.randint(50, 500), # Tons
-                "modifier": "explosive" if random.random() < 0.3 else None,
-                "timer": random.randint(30, 60) # Seconds to explosion
-            })
+            modifier = "explosive" if random.random() < 0.3 else None
+            add(("resource", "Топливо", modifier),
+                {"type": "resource", "name": "Топливо", "modifier": modifier},
+                random.randint(50, 500)) # Tons
             
         # 2. Ammo/Weapon Debris
         if random.random() < 0.4:
-             debris.append({
-                "type": "resource",
-                "name": "Боеприпасы",
-                "amount": random.randint(10, 50),
-                "modifier": "explosive" if random.random() < 0.4 else "radiation" if random.random() < 0.2 else None,
-                "timer": random.randint(30, 50)
-            })
+            modifier = "explosive" if random.random() < 0.4 else "radiation" if random.random() < 0.2 else None
+            add(("resource", "Боеприпасы", modifier),
+                {"type": "resource", "name": "Боеприпасы", "modifier": modifier},
+                random.randint(10, 50))
 
         # 3. Module Debris
         for sm in ship.modules:
@@ -182,12 +384,9 @@ def generate_debris_field(ships: List[Ship], guaranteed_weapons: bool = False) -
             is_guaranteed = guaranteed_weapons and sm.module.type == ModuleType.WEAPON
             
             if is_guaranteed or random.random() < 0.25: # 25% chance otherwise
-                 debris.append({
-                     "type": "module",
-                     "module_id": sm.module.id,
-                     "name": sm.module.name,
-                     "modifier": "radiation" if random.random() < 0.3 and not is_guaranteed else None,
-                     "timer": 60 
-                 })
+                modifier = "radiation" if random.random() < 0.3 and not is_guaranteed else None
+                add(("module", sm.module.id, modifier),
+                    {"type": "module", "module_id": sm.module.id, "name": sm.module.name, "modifier": modifier},
+                    1)
                  
-    return debris
+    return list(stacks.values())
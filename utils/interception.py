@@ -0,0 +1,88 @@
+"""
+Ракетная фаза боя: пуск -> перехват ПРО и ловушками -> попадание.
+
+Ракеты всего залпа стороны копятся в MissileSalvo (плоские массивы, по записи на
+стрелка, тип ракеты и цель), после чего перехват и попадания считаются пакетно
+по целям, а не по каждой ракете.
+"""
+import random
+from array import array
+from typing import Dict, List, MutableSequence, Optional, Sequence, Tuple
+
+from utils.constants import DECOY_SEDUCE_CHANCE, MIN_HIT_CHANCE
+from utils.game_mechanics import WeaponGroup, allocate, binomial
+
+
+class MissileSalvo:
+    """Ракеты в полёте за один залп стороны"""
+
+    def __init__(self, rng: Optional[random.Random] = None):
+        # Генератор боя; все броски пуска и перехвата идут через него
+        self.rng = rng
+        self.shooter = array('l')
+        self.target = array('l')
+        self.count = array('l')
+        self.damage = array('d')
+        self.weapon: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.target)
+
+    def add(self, shooter: int, target: int, weapon: WeaponGroup, count: int) -> None:
+        self.shooter.append(shooter)
+        self.target.append(target)
+        self.count.append(count)
+        self.damage.append(weapon.damage)
+        self.weapon.append(weapon.name)
+
+    def launch(self, shooter: int, missiles: Sequence[WeaponGroup], target: int,
+               evasion: float, km: int) -> List[Tuple[str, int, int]]:
+        """
+        Фаза пуска: ракеты, взявшие цель с учётом дальности и уклонения, встают в очередь.
+        Возвращает [(ракета, на курсе, выпущено)] для лога.
+        """
+        launched = []
+        for weapon in missiles:
+            shots = weapon.shots
+            hit_chance = weapon.ranges[km] - evasion
+            if hit_chance < MIN_HIT_CHANCE:
+                hit_chance = MIN_HIT_CHANCE
+            on_course = binomial(shots, hit_chance, self.rng)
+            if on_course:
+                self.add(shooter, target, weapon, on_course)
+            launched.append((weapon.name, on_course, shots))
+        return launched
+
+    def intercept(self, pd_intercepts: Sequence[int], pd_accuracy: Sequence[float],
+                  decoys: MutableSequence[int]) -> Dict[int, Tuple[int, int, int]]:
+        """
+        Фаза перехвата по каждой цели: сначала ПРО (ограничено числом перехватов за ход),
+        затем ловушки (расходуются по одной на ракету). Уменьшает count на месте.
+        Возвращает {цель: (подлетало, сбито ПРО, уведено ловушками)}.
+        """
+        by_target: Dict[int, List[int]] = {}
+        for k, t in enumerate(self.target):
+            by_target.setdefault(t, []).append(k)
+
+        report = {}
+        count = self.count
+        for t, entries in by_target.items():
+            incoming = sum(count[k] for k in entries)
+            shot_down = binomial(min(incoming, pd_intercepts[t]), pd_accuracy[t], self.rng)
+            engaged = min(incoming - shot_down, decoys[t])
+            decoys[t] -= engaged
+            seduced = binomial(engaged, DECOY_SEDUCE_CHANCE, self.rng)
+            lost = shot_down + seduced
+            if lost:
+                # Потери делятся между пусками пропорционально числу ракет
+                shares = [count[k] / incoming for k in entries]
+                for k, n in zip(entries, allocate(lost, shares, self.rng)):
+                    count[k] = max(0, count[k] - n)
+            report[t] = (incoming, shot_down, seduced)
+        return report
+
+    def impacts(self):
+        """Фаза попадания: (стрелок, цель, ракета, попало, урон) по уцелевшим пускам"""
+        for k in range(len(self.target)):
+            if self.count[k]:
+                yield self.shooter[k], self.target[k], self.weapon[k], self.count[k], self.count[k] * self.damage[k]
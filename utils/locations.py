@@ -0,0 +1,253 @@
+"""
+Реестр локаций и специализаций и предрасчитанные каталоги магазина.
+
+Названия локаций и специализаций интернируются в целочисленные id один раз.
+Для каждой специализации каталог магазина собирается заранее: ассортимент,
+цены со скидкой и готовые поля embed по страницам. Каталог пересобирается
+только при изменении модулей или цен (rebuild), открытие и листание магазина
+работают с готовыми страницами.
+
+Рыночные множители локации (utils.pricing) накладываются поверх каталога
+специализации через MarketCatalog: цена товара считается за O(1), страницы
+пересобираются только после сделок в этой локации. Сделка оценивается через quote -
+по среднему множителю на весь её объём.
+
+Общий каталог CATALOG используется магазином, оснащением и пресетами кораблей;
+вместе с ним пересобираются индекс названий модулей (utils.name_index) и колоночный
+индекс характеристик для запросов !найти (utils.module_query).
+"""
+import json
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from models.schemas import ModuleType
+from utils.constants import (
+    RATIONS_BASE_PRICE, METHANE_BASE_PRICE, DISCOUNT_FLEET_BASE, DISCOUNT_FUEL_DEPOT,
+    SHOP_ITEMS_PER_PAGE
+)
+from utils.helpers import format_currency
+from utils.module_query import ModuleStatIndex
+from utils.name_index import NameIndex
+
+
+class Specialization(NamedTuple):
+    id: int
+    name: str
+    keyword: str                          # Подстрока в location_spec флота
+    module_types: Tuple[ModuleType, ...]
+    discount: float = 1.0
+    methane_discount: float = 1.0
+
+
+ALL_MODULE_TYPES = tuple(ModuleType)
+
+SPEC_FLEET_BASE = 0
+SPEC_TRADERS = 1
+SPEC_FUEL_DEPOT = 2
+SPEC_OTHER = 3
+
+SPECIALIZATIONS: Tuple[Specialization, ...] = (
+    Specialization(SPEC_FLEET_BASE, "База Флота", "база флота", ALL_MODULE_TYPES, discount=DISCOUNT_FLEET_BASE),
+    Specialization(SPEC_TRADERS, "Торговцы", "торговцы", ALL_MODULE_TYPES),
+    Specialization(SPEC_FUEL_DEPOT, "Топливохранилище", "топливохранилище", (ModuleType.FUEL_TANK,),
+                   methane_discount=DISCOUNT_FUEL_DEPOT),
+    Specialization(SPEC_OTHER, "Прочее", "", (ModuleType.ARMOR, ModuleType.FUEL_TANK)),
+)
+
+
+class LocationRegistry:
+    """Интернирование названий локаций и специализаций"""
+
+    def __init__(self):
+        self._locations: Dict[str, int] = {}
+        self._location_names: List[str] = []
+        self._spec_by_text: Dict[str, int] = {}
+
+    def location_id(self, name: str) -> int:
+        key = name.strip().lower()
+        location_id = self._locations.get(key)
+        if location_id is None:
+            location_id = self._locations[key] = len(self._location_names)
+            self._location_names.append(name.strip())
+        return location_id
+
+    def location_name(self, location_id: int) -> str:
+        return self._location_names[location_id]
+
+    def spec_id(self, location_spec: str) -> int:
+        """Специализация по свободному тексту; разбор подстрок выполняется один раз на строку"""
+        spec_id = self._spec_by_text.get(location_spec)
+        if spec_id is None:
+            text = location_spec.lower()
+            spec_id = next(s.id for s in SPECIALIZATIONS if s.keyword in text)
+            self._spec_by_text[location_spec] = spec_id
+        return spec_id
+
+    def spec(self, location_spec: str) -> Specialization:
+        return SPECIALIZATIONS[self.spec_id(location_spec)]
+
+
+LOCATIONS = LocationRegistry()
+
+
+class CatalogItem(NamedTuple):
+    id: int
+    name: str
+    type: str
+    weight: int
+    base_price: int
+    price: int                            # Цена в этой специализации
+    stats: dict = {}
+
+
+def _resources_field(rations_price: int, methane_price: int) -> str:
+    return (
+        f"🍞 **Пайки** (`rations`)\nЦена: {format_currency(rations_price)}\n"
+        f"⛽ **Метан** (`methane`)\nЦена: {format_currency(methane_price)}"
+    )
+
+
+def _paginate(items: List[CatalogItem], items_per_page: int) -> List[List[Tuple[str, str]]]:
+    """Поля embed по страницам: (name, value)"""
+    return [
+        [(f"{item.name} (ID: {item.id})", f"Цена: {format_currency(item.price)}\nВес: {item.weight}т")
+         for item in items[start:start + items_per_page]]
+        for start in range(0, len(items), items_per_page)
+    ] or [[]]
+
+
+class SpecCatalog:
+    """Готовый каталог одной специализации"""
+
+    def __init__(self, spec: Specialization, items: List[CatalogItem], items_per_page: int):
+        self.spec = spec
+        self.items = items
+        self.items_per_page = items_per_page
+        self.by_id: Dict[int, CatalogItem] = {item.id: item for item in items}
+        self.rations_price = int(RATIONS_BASE_PRICE * spec.discount)
+        self.methane_price = int(METHANE_BASE_PRICE * spec.methane_discount)
+        self.resources_field = _resources_field(self.rations_price, self.methane_price)
+        self.pages = _paginate(items, items_per_page)
+
+    def item(self, item_id: int) -> Optional[CatalogItem]:
+        return self.by_id.get(item_id)
+
+    def quote(self, item_id: int, count: int) -> Optional[CatalogItem]:
+        return self.by_id.get(item_id)
+
+    def resource_price(self, resource: str, count: int) -> int:
+        return self.rations_price if resource == "rations" else self.methane_price
+
+    @property
+    def total_pages(self) -> int:
+        return len(self.pages)
+
+
+class MarketCatalog:
+    """Каталог специализации с рыночными множителями одной локации (utils.pricing.MarketIndex)"""
+
+    def __init__(self, base: SpecCatalog, market, shop: "ShopCatalog"):
+        self.base = base
+        self.spec = base.spec
+        self.market = market
+        self._shop = shop
+        self.rations_price = int(base.rations_price * market.factor("rations"))
+        self.methane_price = int(base.methane_price * market.factor("methane"))
+        self.resources_field = _resources_field(self.rations_price, self.methane_price)
+
+    def item(self, item_id: int) -> Optional[CatalogItem]:
+        item = self.base.by_id.get(item_id)
+        factor = self.market.factor(item_id)
+        if item is None or factor == 1.0:
+            return item
+        return item._replace(price=int(item.price * factor))
+
+    def quote(self, item_id: int, count: int) -> Optional[CatalogItem]:
+        """Товар с ценой за штуку по среднему множителю покупки count штук"""
+        item = self.base.by_id.get(item_id)
+        if item is None:
+            return None
+        return item._replace(price=int(item.price * self.market.quote(item_id, count)))
+
+    def resource_price(self, resource: str, count: int) -> int:
+        """Цена за единицу ресурса при покупке count единиц"""
+        base = self.base.rations_price if resource == "rations" else self.base.methane_price
+        return int(base * self.market.quote(resource, count))
+
+    @property
+    def pages(self) -> List[List[Tuple[str, str]]]:
+        # Страницы кэшируются до следующей сделки в локации или пересборки каталога
+        key = (self.market.guild_id, self.market.location_id, self.spec.id)
+        version = (self._shop.version, self.market.version)
+        cached = self._shop._market_pages.get(key)
+        if cached is None or cached[0] != version:
+            pages = _paginate([self.item(item.id) for item in self.base.items], self.base.items_per_page)
+            cached = self._shop._market_pages[key] = (version, pages)
+        return cached[1]
+
+    @property
+    def total_pages(self) -> int:
+        return self.base.total_pages
+
+
+class ShopCatalog:
+    """Каталоги всех специализаций; пересобираются целиком при изменении модулей или цен"""
+
+    def __init__(self, items_per_page: int = SHOP_ITEMS_PER_PAGE):
+        self.items_per_page = items_per_page
+        self.version = 0
+        self._catalogs: Dict[int, SpecCatalog] = {}
+        # Все модули по базовой цене: продажа и оснащение в любой локации
+        self.modules: Dict[int, CatalogItem] = {}
+        self._market_pages: Dict[Tuple[int, int, int], Tuple[Tuple[int, int], list]] = {}
+        self.names = NameIndex(())
+        self.stat_index = ModuleStatIndex(())
+
+    @property
+    def ready(self) -> bool:
+        return bool(self._catalogs)
+
+    def rebuild(self, modules: Iterable[dict], prices: Optional[Dict[int, int]] = None) -> None:
+        """modules - строки таблицы modules; prices - переопределение базовых цен по id модуля"""
+        base = {}
+        for m in sorted(modules, key=lambda m: m['id']):
+            stats = m['stats']
+            if isinstance(stats, str):
+                stats = json.loads(stats or '{}')
+            price = prices.get(m['id'], m['price']) if prices else m['price']
+            base[m['id']] = CatalogItem(m['id'], m['name'], m['type'], m['weight'], price, price, stats)
+
+        catalogs = {}
+        for spec in SPECIALIZATIONS:
+            allowed = {t.value for t in spec.module_types}
+            items = [item._replace(price=int(item.base_price * spec.discount))
+                     for item in base.values() if item.type in allowed]
+            catalogs[spec.id] = SpecCatalog(spec, items, self.items_per_page)
+        self.modules = base
+        self.names = NameIndex((item.id, item.name) for item in base.values())
+        self.stat_index = ModuleStatIndex(base.values())
+        self._catalogs = catalogs
+        self._market_pages.clear()
+        self.version += 1
+
+    def resolve(self, query: str) -> Optional[int]:
+        """id модуля по числу или названию; None если не найден или название неоднозначно"""
+        if query.isdigit():
+            module_id = int(query)
+            return module_id if module_id in self.modules else None
+        return self.names.resolve(query)
+
+    def candidates(self, query: str, limit: int = 5) -> List[CatalogItem]:
+        return [self.modules[module_id] for module_id in self.names.search(query, limit)]
+
+    def for_spec(self, location_spec: str) -> SpecCatalog:
+        return self._catalogs[LOCATIONS.spec_id(location_spec)]
+
+    def for_market(self, location_spec: str, market=None):
+        """Каталог специализации с множителями рынка локации; без рынка - базовый"""
+        base = self.for_spec(location_spec)
+        if market is None:
+            return base
+        return MarketCatalog(base, market, self)
+
+
+CATALOG = ShopCatalog()
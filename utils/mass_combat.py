@@ -0,0 +1,176 @@
+from typing import Dict, List, Tuple
+
+from models.schemas import Ship, ShipStatus
+from utils.combat_engine import BattleState, CombatSide, hp_status
+from utils.constants import MIN_HIT_CHANCE
+from utils.interception import MissileSalvo
+from utils.game_mechanics import (
+    CombatProfile, allocate, binomial, get_combat_profile, loadout_fingerprint, range_index
+)
+
+# Полоса повреждений на входе в бой: корабли разных полос не смешиваются в одном стеке
+DAMAGE_BANDS = {
+    ShipStatus.OPERATIONAL: 0,
+    ShipStatus.LIGHT_DAMAGE: 1,
+    ShipStatus.MODERATE_DAMAGE: 2,
+    ShipStatus.HEAVY_DAMAGE: 3,
+}
+
+class ShipStack:
+    """Группа одинаковых кораблей: класс, оснастка и полоса повреждений совпадают"""
+
+    def __init__(self, ships: List[Ship], profile: CombatProfile):
+        self.ship_ids = [s.id for s in ships]
+        self.fleet_id = ships[0].fleet_id
+        self.ship_class = ships[0].ship_class
+        self.project = ships[0].project
+        self.profile = profile
+        self.alive = len(ships)
+        self.decoys = profile.decoys * len(ships)
+        # Урон, полученный "ведущим" кораблём стека, ещё не уничтоженным
+        self.lead_damage = 0.0
+
+    @property
+    def size(self) -> int:
+        return len(self.ship_ids)
+
+    def take_damage(self, damage: float) -> int:
+        """Распределяет урон по стеку: добивает корабли целиком, остаток - на ведущего. Возвращает потери."""
+        if self.alive <= 0 or damage <= 0:
+            return 0
+        hp = self.profile.hp
+        if hp <= 0:
+            losses = self.alive
+        else:
+            total = self.lead_damage + damage
+            losses = min(self.alive, int(total // hp))
+            self.lead_damage = total - losses * hp if losses < self.alive else 0.0
+        self.alive -= losses
+        # Ловушки погибших кораблей пропадают вместе с ними
+        self.decoys = min(self.decoys, self.alive * self.profile.decoys)
+        return losses
+
+
+class MassSide:
+    """Сторона массового боя: стеки вместо отдельных кораблей"""
+
+    def __init__(self, ships: List[Ship]):
+        groups: Dict[Tuple[int, str, int], List[Ship]] = {}
+        for ship in ships:
+            # Стеки не смешивают флоты, чтобы статистику можно было разнести по владельцам
+            key = (ship.fleet_id, loadout_fingerprint(ship), DAMAGE_BANDS.get(ship.status, 0))
+            groups.setdefault(key, []).append(ship)
+        self.stacks = [ShipStack(group, get_combat_profile(group[0])) for group in groups.values()]
+        self.fleet_damage: Dict[int, int] = {}
+        self.fleet_kills: Dict[int, int] = {}
+
+    @property
+    def alive_count(self) -> int:
+        return sum(s.alive for s in self.stacks)
+
+    def alive_stacks(self) -> List[ShipStack]:
+        return [s for s in self.stacks if s.alive > 0]
+
+    credit = CombatSide.credit
+
+    def status_lines(self) -> List[str]:
+        return [f"{s.project} ({s.ship_class}): {s.alive}/{s.size}" for s in self.stacks]
+
+
+class MassBattleState(BattleState):
+    """
+    Массовый бой: огонь рассчитывается между стеками, а не между кораблями.
+    Стоимость хода растёт с числом различных типов кораблей, а не с числом кораблей.
+    """
+
+    mode = "mass"
+
+    def __init__(self, attacker_fleets, defender_fleets, attacker_ships, defender_ships, distance, seed=None):
+        super().__init__(attacker_fleets, defender_fleets, [], [], distance, seed)
+        self.attackers = MassSide(attacker_ships)
+        self.defenders = MassSide(defender_ships)
+        self.a_ships_map = {s.id: s for s in attacker_ships}
+        self.d_ships_map = {s.id: s for s in defender_ships}
+
+    def _side_volley(self, shooters: MassSide, targets: MassSide, round_log):
+        damage = 0
+        kills = 0
+        target_stacks = targets.alive_stacks()
+        if not target_stacks:
+            return damage, kills
+
+        # Огонь распределяется по стекам пропорционально числу живых кораблей, как при случайном выборе цели
+        total_targets = sum(t.alive for t in target_stacks)
+        shares = [t.alive / total_targets for t in target_stacks]
+        km = range_index(self.distance)
+        incoming = [0.0] * len(target_stacks)
+        # Вклад каждого флота в урон по каждому стеку - для статистики
+        contributions: List[Dict[int, float]] = [{} for _ in target_stacks]
+        shooter_stacks = shooters.alive_stacks()
+        salvo = MissileSalvo(self.rng)
+        for s, stack in enumerate(shooter_stacks):
+            for weapon in stack.profile.weapons:
+                allocation = allocate(stack.alive * weapon.shots, shares, self.rng)
+                missile = weapon.ammo_type == "missile"
+                for j, target in enumerate(target_stacks):
+                    hit_chance = max(MIN_HIT_CHANCE, weapon.ranges[km] - target.profile.evasion)
+                    hits = binomial(allocation[j], hit_chance, self.rng)
+                    if not hits:
+                        continue
+                    if missile:
+                        salvo.add(s, j, weapon, hits)
+                        continue
+                    incoming[j] += hits * weapon.damage
+                    contributions[j][stack.fleet_id] = contributions[j].get(stack.fleet_id, 0) + hits * weapon.damage
+
+        if salvo:
+            # Перехват по стекам: ПРО всех живых кораблей стека, общий запас ловушек
+            decoys = [t.decoys for t in target_stacks]
+            salvo.intercept(
+                [t.alive * t.profile.pd_intercepts for t in target_stacks],
+                [t.profile.pd_accuracy for t in target_stacks],
+                decoys
+            )
+            for target, left in zip(target_stacks, decoys):
+                target.decoys = left
+            for s, j, _, _, dealt in salvo.impacts():
+                fleet_id = shooter_stacks[s].fleet_id
+                incoming[j] += dealt
+                contributions[j][fleet_id] = contributions[j].get(fleet_id, 0) + dealt
+
+        for target, dmg, contrib in zip(target_stacks, incoming, contributions):
+            if not dmg:
+                continue
+            alive_before = target.alive
+            # Засчитывается только снятая прочность стека, без перебития
+            dealt = dmg
+            if target.profile.hp > 0:
+                dealt = min(dmg, alive_before * target.profile.hp - target.lead_damage)
+            losses = target.take_damage(dmg)
+            damage += dealt
+            kills += losses
+            # Потери стека и урон делятся между флотами пропорционально нанесённому урону
+            fleet_ids = list(contrib)
+            fleet_kills = allocate(losses, [contrib[f] / dmg for f in fleet_ids], self.rng)
+            for fleet_id, fleet_loss in zip(fleet_ids, fleet_kills):
+                shooters.credit(fleet_id, int(contrib[fleet_id] * dealt / dmg), fleet_loss)
+            # Погибают первые живые корабли стека
+            self.destroyed.extend(target.ship_ids[target.size - alive_before:target.size - alive_before + losses])
+            if round_log is not None and losses:
+                round_log.append(f"💀 {target.project}: потеряно {losses} из {alive_before}")
+        return int(damage), kills
+
+    def final_statuses(self):
+        statuses = []
+        for side in (self.attackers, self.defenders):
+            for stack in side.stacks:
+                dead = stack.size - stack.alive
+                for i, ship_id in enumerate(stack.ship_ids):
+                    if i < dead:
+                        status = ShipStatus.DESTROYED
+                    elif i == dead and stack.lead_damage > 0:
+                        status = hp_status(stack.profile.hp - stack.lead_damage, stack.profile.hp)
+                    else:
+                        status = ShipStatus.OPERATIONAL
+                    statuses.append((ship_id, status))
+        return statuses
@@ -0,0 +1,199 @@
+"""
+Колоночный индекс характеристик модулей и язык запросов !найти.
+
+Каталог хранится столбцами (array) по строкам-модулям. Для каждого столбца заранее
+отсортирован порядок строк и построены битовые маски префиксов этого порядка
+(через каждые MASK_BLOCK строк). Условие `столбец < x` - бинарный поиск и маска
+префикса, поэтому фильтр стоит O(log n) плюс побитовые операции над целыми, а
+сочетание условий - побитовое И масок.
+
+Запрос: `оружие урон>500 вес<300 сорт:-залп лимит:10`
+  - тип модуля (оружие, двигатель, броня, ...), несколько типов объединяются через ИЛИ;
+  - условия `столбец оп число`, оп: > >= < <= = !=;
+  - `сорт:столбец` (по возрастанию) или `сорт:-столбец` (по убыванию);
+  - `лимит:N`.
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from models.schemas import ModuleType
+
+MASK_BLOCK = 64
+DEFAULT_QUERY_LIMIT = 10
+MAX_QUERY_LIMIT = 25
+
+
+def _ratio(a: float, b: float) -> float:
+    return a / b if b else 0.0
+
+
+# Столбец -> функция (вес, цена, характеристики) -> значение
+COLUMNS: Dict[str, Callable[[int, int, dict], float]] = {
+    "вес": lambda weight, price, stats: weight,
+    "цена": lambda weight, price, stats: price,
+    "урон": lambda weight, price, stats: stats.get("damage", 0),
+    "точность": lambda weight, price, stats: stats.get("accuracy", 0),
+    "выстрелы": lambda weight, price, stats: stats.get("shots", 0),
+    "тяга": lambda weight, price, stats: stats.get("thrust", 0),
+    "прочность": lambda weight, price, stats: stats.get("hp_bonus", 0),
+    "залп": lambda weight, price, stats: stats.get("damage", 0) * stats.get("shots", 0),
+    "тяга_на_тонну": lambda weight, price, stats: _ratio(stats.get("thrust", 0), weight),
+    "залп_на_тонну": lambda weight, price, stats: _ratio(stats.get("damage", 0) * stats.get("shots", 0), weight),
+}
+COLUMN_ALIASES = {
+    "weight": "вес", "price": "цена", "damage": "урон", "accuracy": "точность", "shots": "выстрелы",
+    "thrust": "тяга", "hp": "прочность", "volley": "залп", "twr": "тяга_на_тонну", "dpt": "залп_на_тонну",
+}
+TYPE_ALIASES = {
+    "оружие": ModuleType.WEAPON, "weapon": ModuleType.WEAPON,
+    "двигатель": ModuleType.ENGINE, "двигатели": ModuleType.ENGINE, "engine": ModuleType.ENGINE,
+    "броня": ModuleType.ARMOR, "armor": ModuleType.ARMOR,
+    "корпус": ModuleType.HULL, "hull": ModuleType.HULL,
+    "боеукладка": ModuleType.AMMO, "ammo": ModuleType.AMMO,
+    "бак": ModuleType.FUEL_TANK, "баки": ModuleType.FUEL_TANK, "топливный_бак": ModuleType.FUEL_TANK,
+    "fuel": ModuleType.FUEL_TANK,
+    "прочее": ModuleType.OTHER, "other": ModuleType.OTHER,
+}
+
+_CONDITION = re.compile(r"^([a-zа-яё_]+)(>=|<=|!=|>|<|=)(-?\d+(?:[.,]\d+)?)$")
+
+
+def format_stat(value: float) -> str:
+    return str(int(value)) if value == int(value) else f"{value:.2f}"
+
+
+def column_name(name: str) -> str:
+    name = name.lower().replace("ё", "е")
+    name = COLUMN_ALIASES.get(name, name)
+    if name not in COLUMNS:
+        raise ValueError(f"Неизвестная характеристика '{name}'. Доступны: {', '.join(COLUMNS)}")
+    return name
+
+
+class Query(NamedTuple):
+    types: Tuple[str, ...]                          # Значения ModuleType
+    conditions: Tuple[Tuple[str, str, float], ...]  # (столбец, оп, значение)
+    sort: Optional[str] = None
+    descending: bool = False
+    limit: int = DEFAULT_QUERY_LIMIT
+
+    @property
+    def columns(self) -> List[str]:
+        """Столбцы, упомянутые в запросе (для вывода)"""
+        names = [column for column, _, _ in self.conditions]
+        if self.sort:
+            names.append(self.sort)
+        return list(dict.fromkeys(names))
+
+
+def parse_query(tokens: Iterable[str]) -> Query:
+    """Разбор токенов запроса; ValueError с понятным сообщением при ошибке"""
+    types, conditions = [], []
+    sort, descending, limit = None, False, DEFAULT_QUERY_LIMIT
+    for token in tokens:
+        token = token.lower().replace("ё", "е")
+        if token in ("и", "and"):
+            continue
+        key, sep, value = token.partition(":")
+        if sep and key in ("сорт", "sort"):
+            descending = value.startswith("-")
+            sort = column_name(value.lstrip("+-"))
+        elif sep and key in ("лимит", "limit"):
+            if not value.isdigit() or int(value) <= 0:
+                raise ValueError("Лимит должен быть положительным числом.")
+            limit = min(int(value), MAX_QUERY_LIMIT)
+        elif token in TYPE_ALIASES:
+            types.append(TYPE_ALIASES[token].value)
+        else:
+            match = _CONDITION.match(token)
+            if not match:
+                raise ValueError(f"Не понимаю '{token}'. Пример: `оружие урон>500 вес<300 сорт:-залп`")
+            column, op, number = match.groups()
+            conditions.append((column_name(column), op, float(number.replace(",", "."))))
+    return Query(tuple(dict.fromkeys(types)), tuple(conditions), sort, descending, limit)
+
+
+class _Column:
+    """Значения столбца, порядок строк по значению и маски префиксов этого порядка"""
+
+    def __init__(self, values: array):
+        self.values = values
+        self.order = array('l', sorted(range(len(values)), key=values.__getitem__))
+        self.sorted_values = array('d', (values[row] for row in self.order))
+        self._blocks = [0]
+        mask = 0
+        for k, row in enumerate(self.order, 1):
+            mask |= 1 << row
+            if k % MASK_BLOCK == 0:
+                self._blocks.append(mask)
+
+    def first(self, k: int) -> int:
+        """Маска первых k строк в порядке возрастания значения"""
+        block = k // MASK_BLOCK
+        mask = self._blocks[block]
+        for row in self.order[block * MASK_BLOCK:k]:
+            mask |= 1 << row
+        return mask
+
+    def mask(self, op: str, value: float, everything: int) -> int:
+        lo = bisect_left(self.sorted_values, value)
+        hi = bisect_right(self.sorted_values, value)
+        if op == "<":
+            return self.first(lo)
+        if op == "<=":
+            return self.first(hi)
+        if op == ">":
+            return everything ^ self.first(hi)
+        if op == ">=":
+            return everything ^ self.first(lo)
+        equal = self.first(hi) ^ self.first(lo)
+        return equal if op == "=" else everything ^ equal
+
+
+class ModuleStatIndex:
+    """Колоночный индекс каталога модулей"""
+
+    def __init__(self, items: Iterable):
+        """items - CatalogItem (id, name, type, weight, base_price, stats)"""
+        items = list(items)
+        self.ids = array('l', (item.id for item in items))
+        self.columns: Dict[str, _Column] = {
+            name: _Column(array('d', (get(item.weight, item.base_price, item.stats) for item in items)))
+            for name, get in COLUMNS.items()
+        }
+        self.everything = (1 << len(items)) - 1
+        self._types: Dict[str, int] = {}
+        for row, item in enumerate(items):
+            self._types[item.type] = self._types.get(item.type, 0) | (1 << row)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def value(self, row: int, column: str) -> float:
+        return self.columns[column].values[row]
+
+    def query(self, query: Query) -> List[int]:
+        """Номера строк, прошедших фильтр, в порядке сортировки (не больше query.limit)"""
+        mask = self.everything
+        if query.types:
+            type_mask = 0
+            for module_type in query.types:
+                type_mask |= self._types.get(module_type, 0)
+            mask &= type_mask
+        for column, op, value in query.conditions:
+            mask &= self.columns[column].mask(op, value, self.everything)
+            if not mask:
+                return []
+
+        order = self.columns[query.sort].order if query.sort else range(len(self.ids))
+        if query.sort and query.descending:
+            order = reversed(order)
+        rows = []
+        for row in order:
+            if mask >> row & 1:
+                rows.append(row)
+                if len(rows) == query.limit:
+                    break
+        return rows
@@ -0,0 +1,149 @@
+"""
+Поиск модулей по названию.
+
+Названия нормализуются (регистр, ё -> е, кавычки и дефисы -> пробелы) и бьются на
+токены. Поиск идёт по ступеням: точное совпадение -> каждый токен запроса является
+префиксом какого-либо токена названия (префиксное дерево) -> нечёткое совпадение
+по триграммам отдельных токенов. Индекс строится один раз при пересборке каталога.
+Нечёткие совпадения по умолчанию только подсказываются: команды, которые тратят
+золото или двигают склад, не должны угадывать модуль.
+"""
+import re
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_NON_WORD = re.compile(r"[^0-9a-zа-я]+")
+
+FUZZY_MIN_SCORE = 0.3        # Минимальное сходство триграмм для кандидата
+FUZZY_RESOLVE_SCORE = 0.4    # Сходство, с которым лучший кандидат принимается без уточнения
+FUZZY_RESOLVE_MARGIN = 0.1   # Отрыв лучшего нечёткого кандидата от второго
+
+
+def normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", text.casefold().replace("ё", "е")).strip()
+
+
+def trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.ids: Set[int] = set()
+
+
+class NameIndex:
+    """Индекс названий: точный, префиксный по токенам и триграммный"""
+
+    def __init__(self, items: Iterable[Tuple[int, str]]):
+        self.names: Dict[int, str] = {}
+        self._exact: Dict[str, int] = {}
+        self._tokens: Dict[int, Tuple[str, ...]] = {}
+        self._root = _TrieNode()
+        # Триграммы токенов: gram -> {(id, номер токена)}
+        self._grams: Dict[str, Set[Tuple[int, int]]] = {}
+        self._gram_counts: Dict[Tuple[int, int], int] = {}
+        for item_id, name in items:
+            norm = normalize(name)
+            self.names[item_id] = name
+            self._exact.setdefault(norm, item_id)
+            tokens = tuple(norm.split())
+            self._tokens[item_id] = tokens
+            for token in tokens:
+                node = self._root
+                for char in token:
+                    node = node.children.setdefault(char, _TrieNode())
+                    node.ids.add(item_id)
+            for position, token in enumerate(tokens):
+                grams = trigrams(token)
+                self._gram_counts[item_id, position] = len(grams)
+                for gram in grams:
+                    self._grams.setdefault(gram, set()).add((item_id, position))
+
+    def _prefixed(self, token: str) -> Set[int]:
+        node = self._root
+        for char in token:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.ids
+
+    def _fuzzy(self, tokens: List[str]) -> List[Tuple[float, int]]:
+        """Сходство - среднее по токенам запроса лучшего коэффициента Жаккара с токеном названия"""
+        totals: Dict[int, float] = {}
+        for token in tokens:
+            grams = trigrams(token)
+            common: Dict[Tuple[int, int], int] = {}
+            for gram in grams:
+                for key in self._grams.get(gram, ()):
+                    common[key] = common.get(key, 0) + 1
+            best: Dict[int, float] = {}
+            for key, shared in common.items():
+                score = shared / (len(grams) + self._gram_counts[key] - shared)
+                if score > best.get(key[0], 0.0):
+                    best[key[0]] = score
+            for item_id, score in best.items():
+                totals[item_id] = totals.get(item_id, 0.0) + score
+        scored = []
+        for item_id, total in totals.items():
+            score = total / len(tokens)
+            if score >= FUZZY_MIN_SCORE:
+                scored.append((score, item_id))
+        scored.sort(key=lambda pair: (-pair[0], pair[1]))
+        return scored
+
+    def search(self, query: str, limit: int = 5) -> List[int]:
+        """Кандидаты по убыванию соответствия"""
+        return [item_id for _, item_id in self._ranked(query)[:limit]]
+
+    def _ranked(self, query: str) -> List[Tuple[float, int]]:
+        norm = normalize(query)
+        if not norm:
+            return []
+        exact = self._exact.get(norm)
+        if exact is not None:
+            return [(2.0, exact)]
+        tokens = norm.split()
+        matched = None
+        for token in tokens:
+            ids = self._prefixed(token)
+            matched = set(ids) if matched is None else matched & ids
+            if not matched:
+                break
+        if matched:
+            # Больше токенов совпало целиком и короче название - выше
+            def score(item_id):
+                own = self._tokens[item_id]
+                whole = sum(1 for token in tokens if token in own)
+                return 1.0 + whole / len(tokens) - len(own) / 100
+            return sorted(((score(i), i) for i in matched), key=lambda pair: (-pair[0], pair[1]))
+        return self._fuzzy(tokens)
+
+    def resolve(self, query: str, fuzzy: bool = False) -> Optional[int]:
+        """
+        Однозначный id по названию или None (не найдено или неоднозначно).
+        Принимается точное совпадение или единственное префиксное; если префиксных
+        несколько - единственное, где все слова запроса совпали целиком. Нечёткие
+        совпадения принимаются только с fuzzy=True (для встроенных данных), иначе
+        они остаются подсказками search.
+        """
+        ranked = self._ranked(query)
+        if not ranked:
+            return None
+        best_score, best = ranked[0]
+        if best_score >= 2.0 or (best_score >= 1.0 and len(ranked) == 1):
+            return best
+        if best_score >= 1.0:
+            tokens = normalize(query).split()
+            complete = [item_id for _, item_id in ranked
+                        if all(token in self._tokens[item_id] for token in tokens)]
+            return complete[0] if len(complete) == 1 else None
+        # Нечёткое совпадение принимается только с уверенным отрывом
+        if not fuzzy or best_score < FUZZY_RESOLVE_SCORE:
+            return None
+        if len(ranked) > 1 and best_score - ranked[1][0] < FUZZY_RESOLVE_MARGIN:
+            return None
+        return best
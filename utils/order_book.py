@@ -0,0 +1,154 @@
+"""
+Биржа игроков: лимитные заявки на модули с приоритетом цена-время.
+
+Для каждого модуля сервера ведётся стакан из двух куч: покупки (максимальная цена
+сверху) и продажи (минимальная цена сверху), при равной цене раньше исполняется
+более старая заявка (меньший id). Отменённые и исполненные заявки удаляются из
+куч лениво - при выходе на вершину. Сведение заявки идёт только в памяти;
+итог (сделки) записывается в БД одной транзакцией, а при её отказе стакан
+откатывается через revert. Заявка, которая исполнилась бы о встречную заявку
+того же флота, отклоняется целиком.
+"""
+import heapq
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+SIDE_BUY = "buy"
+SIDE_SELL = "sell"
+
+
+class Order:
+    """Лимитная заявка; remaining уменьшается по мере исполнения"""
+
+    __slots__ = ("id", "guild_id", "fleet_id", "module_id", "side", "price", "quantity", "remaining")
+
+    def __init__(self, id: int, guild_id: int, fleet_id: int, module_id: int, side: str,
+                 price: int, quantity: int, remaining: Optional[int] = None):
+        self.id = id
+        self.guild_id = guild_id
+        self.fleet_id = fleet_id
+        self.module_id = module_id
+        self.side = side
+        self.price = price
+        self.quantity = quantity
+        self.remaining = quantity if remaining is None else remaining
+
+    @property
+    def active(self) -> bool:
+        return self.remaining > 0
+
+
+class Fill(NamedTuple):
+    maker: Order          # Заявка из стакана
+    quantity: int
+    price: int            # Цена сделки - цена заявки из стакана
+
+
+class OrderBook:
+    """Стакан одного модуля"""
+
+    def __init__(self):
+        self._bids: List[Tuple[int, int, Order]] = []   # (-цена, id, заявка)
+        self._asks: List[Tuple[int, int, Order]] = []   # (цена, id, заявка)
+
+    def add(self, order: Order) -> None:
+        if order.side == SIDE_BUY:
+            heapq.heappush(self._bids, (-order.price, order.id, order))
+        else:
+            heapq.heappush(self._asks, (order.price, order.id, order))
+
+    def _top(self, heap) -> Optional[Order]:
+        while heap and not heap[0][2].active:
+            heapq.heappop(heap)
+        return heap[0][2] if heap else None
+
+    def best_bid(self) -> Optional[Order]:
+        return self._top(self._bids)
+
+    def best_ask(self) -> Optional[Order]:
+        return self._top(self._asks)
+
+    def match(self, order: Order) -> Optional[List[Fill]]:
+        """
+        Сводит входящую заявку со встречными; уменьшает remaining у всех участников.
+        None (стакан не изменён), если заявка дошла бы до встречной заявки своего же флота.
+        """
+        fills = []
+        if order.side == SIDE_BUY:
+            heap, crosses = self._asks, lambda maker: maker.price <= order.price
+        else:
+            heap, crosses = self._bids, lambda maker: maker.price >= order.price
+        while order.remaining:
+            maker = self._top(heap)
+            if maker is None or not crosses(maker):
+                break
+            if maker.fleet_id == order.fleet_id:
+                self.revert(order, fills)
+                return None
+            quantity = min(order.remaining, maker.remaining)
+            maker.remaining -= quantity
+            order.remaining -= quantity
+            fills.append(Fill(maker, quantity, maker.price))
+            if not maker.active:
+                heapq.heappop(heap)
+        return fills
+
+    def revert(self, order: Order, fills: List[Fill]) -> None:
+        """Откат match, если сделки не удалось записать"""
+        for fill in fills:
+            popped = not fill.maker.active
+            fill.maker.remaining += fill.quantity
+            if popped:
+                self.add(fill.maker)
+            order.remaining += fill.quantity
+
+    def depth(self, side: str, levels: int) -> List[Tuple[int, int]]:
+        """Лучшие ценовые уровни стороны: [(цена, суммарное количество)]"""
+        heap = self._bids if side == SIDE_BUY else self._asks
+        totals: Dict[int, int] = {}
+        for _, _, order in heap:
+            if order.active:
+                totals[order.price] = totals.get(order.price, 0) + order.remaining
+        prices = sorted(totals, reverse=side == SIDE_BUY)[:levels]
+        return [(price, totals[price]) for price in prices]
+
+
+class Exchange:
+    """Стаканы всех модулей всех серверов и индекс заявок по id"""
+
+    def __init__(self):
+        self._books: Dict[Tuple[int, int], OrderBook] = {}
+        self.orders: Dict[int, Order] = {}
+
+    def book(self, guild_id: int, module_id: int) -> OrderBook:
+        key = (guild_id, module_id)
+        book = self._books.get(key)
+        if book is None:
+            book = self._books[key] = OrderBook()
+        return book
+
+    def add(self, order: Order) -> None:
+        self.orders[order.id] = order
+        self.book(order.guild_id, order.module_id).add(order)
+
+    def remove(self, order_id: int) -> Optional[Order]:
+        """Снять заявку (ленивое удаление из кучи)"""
+        order = self.orders.pop(order_id, None)
+        if order is not None:
+            order.remaining = 0
+        return order
+
+    def forget_filled(self, fills: Iterable[Fill]) -> None:
+        for fill in fills:
+            if not fill.maker.active:
+                self.orders.pop(fill.maker.id, None)
+
+    def fleet_orders(self, fleet_id: int) -> List[Order]:
+        return sorted((o for o in self.orders.values() if o.fleet_id == fleet_id), key=lambda o: o.id)
+
+    def load(self, rows: Iterable[dict]) -> None:
+        """Восстановление стаканов из строк market_orders"""
+        self._books.clear()
+        self.orders.clear()
+        for row in rows:
+            self.add(Order(row['id'], row['guild_id'], row['fleet_id'], row['module_id'], row['side'],
+                           row['price'], row['quantity'], row['remaining']))
@@ -0,0 +1,179 @@
+"""
+Рыночное ценообразование по локациям.
+
+Для каждой локации сервера хранятся индексы спроса (куплено у рынка) и предложения
+(продано рынку) по каждому товару. Сделка меняет индексы и множитель цены только
+своего товара, ход затухает все индексы сервера. Множители читаются из памяти за O(1);
+изменённые индексы помечаются и пакетно сбрасываются в таблицу market_prices.
+
+Сделка оценивается по среднему множителю на всём своём объёме (от индекса до сделки
+до индекса после неё), поэтому одна крупная покупка стоит столько же, сколько
+та же партия, купленная по одной штуке.
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple, Union
+
+from utils.constants import (
+    PRICE_ELASTICITY, PRICE_DEPTH_MODULE, PRICE_DEPTH_RESOURCE,
+    PRICE_FACTOR_MIN, PRICE_FACTOR_MAX, PRICE_DECAY
+)
+from utils.locations import LOCATIONS
+
+# Товар: id модуля или ресурс ('rations' / 'methane')
+ItemKey = Union[int, str]
+
+# Индексы ниже порога после затухания удаляются
+PRICE_INDEX_EPSILON = 0.01
+
+
+def item_to_text(item: ItemKey) -> str:
+    return str(item)
+
+
+def item_from_text(text: str) -> ItemKey:
+    return int(text) if text.isdigit() else text
+
+
+def _clamp(factor: float) -> float:
+    return min(PRICE_FACTOR_MAX, max(PRICE_FACTOR_MIN, factor))
+
+
+def average_factor(start: float, end: float) -> float:
+    """Среднее значение множителя при изменении давления от start до end (с учётом пределов)"""
+    if start == end:
+        return _clamp(1.0 + PRICE_ELASTICITY * start)
+    lo, hi = min(start, end), max(start, end)
+    # Давление, на котором множитель упирается в пределы
+    floor = (PRICE_FACTOR_MIN - 1.0) / PRICE_ELASTICITY
+    ceiling = (PRICE_FACTOR_MAX - 1.0) / PRICE_ELASTICITY
+    area = PRICE_FACTOR_MIN * max(0.0, min(hi, floor) - lo) + PRICE_FACTOR_MAX * max(0.0, hi - max(lo, ceiling))
+    a, b = max(lo, floor), min(hi, ceiling)
+    if b > a:
+        area += (b - a) * (1.0 + PRICE_ELASTICITY * (a + b) / 2)
+    return area / (hi - lo)
+
+
+class MarketIndex:
+    """Спрос, предложение и множители цен одной локации"""
+
+    __slots__ = ("guild_id", "location_id", "demand", "stock", "factors", "version")
+
+    def __init__(self, guild_id: int, location_id: int):
+        self.guild_id = guild_id
+        self.location_id = location_id
+        self.demand: Dict[ItemKey, float] = {}
+        self.stock: Dict[ItemKey, float] = {}
+        self.factors: Dict[ItemKey, float] = {}
+        self.version = 0
+
+    def factor(self, item: ItemKey) -> float:
+        return self.factors.get(item, 1.0)
+
+    def _pressure(self, item: ItemKey) -> Tuple[float, int]:
+        depth = PRICE_DEPTH_RESOURCE if isinstance(item, str) else PRICE_DEPTH_MODULE
+        return (self.demand.get(item, 0.0) - self.stock.get(item, 0.0)) / depth, depth
+
+    def quote(self, item: ItemKey, count: int) -> float:
+        """Средний множитель сделки на count единиц (count > 0 - покупка, < 0 - продажа)"""
+        pressure, depth = self._pressure(item)
+        return average_factor(pressure, pressure + count / depth)
+
+    def _reprice(self, item: ItemKey) -> None:
+        pressure, _ = self._pressure(item)
+        factor = _clamp(1.0 + PRICE_ELASTICITY * pressure)
+        if factor == 1.0:
+            self.factors.pop(item, None)
+        else:
+            self.factors[item] = factor
+
+
+class PricingEngine:
+    """Таблица рыночных индексов всех локаций в памяти"""
+
+    def __init__(self):
+        self._markets: Dict[Tuple[int, int], MarketIndex] = {}
+        self._dirty: Set[Tuple[int, int, ItemKey]] = set()
+
+    def market(self, guild_id: int, location: str) -> MarketIndex:
+        key = (guild_id, LOCATIONS.location_id(location))
+        market = self._markets.get(key)
+        if market is None:
+            market = self._markets[key] = MarketIndex(*key)
+        return market
+
+    def factor(self, guild_id: int, location: str, item: ItemKey) -> float:
+        market = self._markets.get((guild_id, LOCATIONS.location_id(location)))
+        return market.factor(item) if market else 1.0
+
+    def quote(self, guild_id: int, location: str, item: ItemKey, count: int) -> float:
+        """Средний множитель сделки на count единиц (см. MarketIndex.quote)"""
+        return self.market(guild_id, location).quote(item, count)
+
+    def record_trade(self, guild_id: int, location: str, item: ItemKey, count: int) -> None:
+        """count > 0 - покупка у рынка (растёт спрос), count < 0 - продажа рынку (растёт предложение)"""
+        if not count:
+            return
+        market = self.market(guild_id, location)
+        index = market.demand if count > 0 else market.stock
+        index[item] = index.get(item, 0.0) + abs(count)
+        market._reprice(item)
+        market.version += 1
+        self._dirty.add((guild_id, market.location_id, item))
+
+    def decay(self, guild_id: int, rate: float = PRICE_DECAY) -> None:
+        """Затухание индексов всех локаций сервера (раз в ход)"""
+        for (market_guild, location_id), market in self._markets.items():
+            if market_guild != guild_id:
+                continue
+            items = set(market.demand) | set(market.stock)
+            for index in (market.demand, market.stock):
+                for item in list(index):
+                    value = index[item] * rate
+                    if value < PRICE_INDEX_EPSILON:
+                        del index[item]
+                    else:
+                        index[item] = value
+            for item in items:
+                market._reprice(item)
+                self._dirty.add((guild_id, location_id, item))
+            if items:
+                market.version += 1
+
+    def load(self, rows: Iterable[dict]) -> None:
+        """Восстановление из строк market_prices"""
+        self._markets.clear()
+        self._dirty.clear()
+        for row in rows:
+            market = self.market(row['guild_id'], row['location'])
+            item = item_from_text(row['item'])
+            if row['demand']:
+                market.demand[item] = row['demand']
+            if row['stock']:
+                market.stock[item] = row['stock']
+            market._reprice(item)
+
+    def take_dirty(self) -> Optional[Tuple[List[tuple], List[tuple]]]:
+        """
+        Изменения с прошлого сброса: (upserts, deletes) для Database.save_market_prices.
+        None если сбрасывать нечего.
+        """
+        if not self._dirty:
+            return None
+        upserts, deletes = [], []
+        for guild_id, location_id, item in self._dirty:
+            market = self._markets[(guild_id, location_id)]
+            row = (guild_id, LOCATIONS.location_name(location_id), item_to_text(item))
+            demand = market.demand.get(item, 0.0)
+            stock = market.stock.get(item, 0.0)
+            if demand or stock:
+                upserts.append((*row, demand, stock))
+            else:
+                deletes.append(row)
+        self._dirty.clear()
+        return upserts, deletes
+
+    def restore_dirty(self, batch: Tuple[List[tuple], List[tuple]]) -> None:
+        """Вернуть несохранённый пакет в очередь (ошибка записи)"""
+        upserts, deletes = batch
+        for row in (*upserts, *deletes):
+            guild_id, location, item = row[:3]
+            self._dirty.add((guild_id, LOCATIONS.location_id(location), item_from_text(item)))
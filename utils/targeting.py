@@ -0,0 +1,183 @@
+"""
+Доктрины целеуказания.
+
+Селектор цели строится над стороной-мишенью (CombatSide) и держит живые корабли
+в индексированной куче: выбор цели - O(1), обновление после попадания и удаление
+погибшего - O(log n).
+"""
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
+
+DOCTRINE_RANDOM = "random"
+DOCTRINE_FOCUS = "focus"
+DOCTRINE_THREAT = "threat"
+DOCTRINE_LOWEST_HP = "lowest_hp"
+DOCTRINE_ANTI_MISSILE = "anti_missile"
+
+# Русское название -> доктрина
+DOCTRINE_ALIASES = {
+    "случайно": DOCTRINE_RANDOM,
+    "фокус": DOCTRINE_FOCUS,
+    "угроза": DOCTRINE_THREAT,
+    "добивание": DOCTRINE_LOWEST_HP,
+    "про": DOCTRINE_ANTI_MISSILE,
+}
+DOCTRINE_NAMES = {
+    DOCTRINE_RANDOM: "🎲 Случайные цели",
+    DOCTRINE_FOCUS: "🎯 Фокус огня",
+    DOCTRINE_THREAT: "⚠️ Самые опасные",
+    DOCTRINE_LOWEST_HP: "🩸 Добивание",
+    DOCTRINE_ANTI_MISSILE: "🚀 Ракетоносцы и ПРО",
+}
+
+
+def parse_doctrine(name: Optional[str]) -> Optional[str]:
+    """Доктрина по русскому или внутреннему названию, None если не найдена"""
+    if not name:
+        return None
+    name = name.lower()
+    if name in DOCTRINE_NAMES:
+        return name
+    return DOCTRINE_ALIASES.get(name)
+
+
+class IndexedHeap:
+    """
+    Min-куча индексов кораблей с обратным индексом позиций.
+    Ключ вычисляется функцией key(i) и пересчитывается при update(i).
+    """
+
+    def __init__(self, size: int, items, key: Callable[[int], Tuple]):
+        self.key = key
+        self._pos = array('l', [-1]) * size
+        self._heap: List[int] = []
+        self._keys: List[Tuple] = []
+        for i in items:
+            self._pos[i] = len(self._heap)
+            self._heap.append(i)
+            self._keys.append(key(i))
+        for p in reversed(range(len(self._heap) // 2)):
+            self._sift_down(p)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def __contains__(self, i: int) -> bool:
+        return self._pos[i] >= 0
+
+    def top(self) -> int:
+        return self._heap[0]
+
+    def update(self, i: int) -> None:
+        p = self._pos[i]
+        if p < 0:
+            return
+        self._keys[p] = self.key(i)
+        self._sift_up(p)
+        self._sift_down(self._pos[i])
+
+    def remove(self, i: int) -> None:
+        p = self._pos[i]
+        if p < 0:
+            return
+        self._pos[i] = -1
+        last = self._heap.pop()
+        last_key = self._keys.pop()
+        if p == len(self._heap):
+            return
+        self._heap[p] = last
+        self._keys[p] = last_key
+        self._pos[last] = p
+        self._sift_up(p)
+        self._sift_down(self._pos[last])
+
+    def _swap(self, a: int, b: int) -> None:
+        heap, keys = self._heap, self._keys
+        heap[a], heap[b] = heap[b], heap[a]
+        keys[a], keys[b] = keys[b], keys[a]
+        self._pos[heap[a]] = a
+        self._pos[heap[b]] = b
+
+    def _sift_up(self, p: int) -> None:
+        keys = self._keys
+        while p > 0:
+            parent = (p - 1) >> 1
+            if keys[p] >= keys[parent]:
+                break
+            self._swap(p, parent)
+            p = parent
+
+    def _sift_down(self, p: int) -> None:
+        keys = self._keys
+        n = len(keys)
+        while True:
+            child = 2 * p + 1
+            if child >= n:
+                break
+            if child + 1 < n and keys[child + 1] < keys[child]:
+                child += 1
+            if keys[p] <= keys[child]:
+                break
+            self._swap(p, child)
+            p = child
+
+
+def _doctrine_key(side, doctrine: str) -> Callable[[int], Tuple]:
+    hp, threat = side.hp, side.threat
+    if doctrine == DOCTRINE_LOWEST_HP:
+        return lambda i: (hp[i],)
+    if doctrine == DOCTRINE_THREAT:
+        return lambda i: (-threat[i], hp[i])
+    if doctrine == DOCTRINE_FOCUS:
+        # Угроза на единицу прочности: подбитая цель только растёт в приоритете,
+        # поэтому вся сторона бьёт одну цель до её уничтожения
+        return lambda i: (-threat[i] / max(hp[i], 1.0), hp[i])
+    if doctrine == DOCTRINE_ANTI_MISSILE:
+        missile, defence = side.missile_threat, side.defence
+        return lambda i: (-missile[i], -defence[i], -threat[i], hp[i])
+    raise ValueError(f"Unknown doctrine: {doctrine}")
+
+
+class TargetSelector:
+    """Выбор цели по доктрине на стороне-мишени"""
+
+    def __init__(self, side, doctrine: str = DOCTRINE_RANDOM):
+        self.side = side
+        self.doctrine = doctrine
+        self.heap = None
+        if doctrine != DOCTRINE_RANDOM:
+            self.heap = IndexedHeap(len(side), side.alive_indices(), _doctrine_key(side, doctrine))
+
+    def pick(self, rng=None) -> int:
+        if self.heap is None:
+            return self.side.random_alive(rng)
+        return self.heap.top()
+
+    def on_damage(self, i: int) -> None:
+        if self.heap is not None:
+            self.heap.update(i)
+
+    def on_kill(self, i: int) -> None:
+        if self.heap is not None:
+            self.heap.remove(i)
+
+
+class TargetingIndex:
+    """Селекторы по доктринам для одной стороны; строятся лениво при первом запросе"""
+
+    def __init__(self, side):
+        self.side = side
+        self._selectors: Dict[str, TargetSelector] = {}
+
+    def selector(self, doctrine: str) -> TargetSelector:
+        selector = self._selectors.get(doctrine)
+        if selector is None:
+            selector = self._selectors[doctrine] = TargetSelector(self.side, doctrine)
+        return selector
+
+    def on_damage(self, i: int, killed: bool) -> None:
+        for selector in self._selectors.values():
+            if killed:
+                selector.on_kill(i)
+            else:
+                selector.on_damage(i)
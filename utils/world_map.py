@@ -0,0 +1,120 @@
+"""
+Карта мира сервера: локации и маршруты между ними.
+
+Граф неориентированный, рёбра - расстояния в км. При построении карты кратчайшие
+пути между всеми парами локаций считаются заранее (Дейкстра из каждой вершины),
+поэтому запрос маршрута - восстановление пути по таблице предшественников.
+Карта пересобирается только при её изменении. Стартовая локация флотилий (home)
+присутствует на карте всегда, даже если администратор её не добавлял.
+"""
+import heapq
+from array import array
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+UNREACHABLE = float("inf")
+
+
+def location_key(name: str) -> str:
+    return " ".join(name.casefold().replace("ё", "е").split())
+
+
+class MapLocation(NamedTuple):
+    index: int
+    name: str
+    spec: str
+
+
+class Leg(NamedTuple):
+    start: str
+    end: str
+    distance: int
+
+
+class Route(NamedTuple):
+    legs: List[Leg]
+    distance: int
+
+    @property
+    def stops(self) -> List[str]:
+        return [self.legs[0].start] + [leg.end for leg in self.legs] if self.legs else []
+
+    def methane(self, methane_per_100km: int) -> int:
+        return methane_to_fly(methane_per_100km, self.distance)
+
+
+def methane_to_fly(methane_per_100km: int, distance: int) -> int:
+    """Расход метана на перелёт, с округлением вверх"""
+    return -(-methane_per_100km * distance // 100)
+
+
+class WorldMap:
+    """Граф локаций с предрасчитанными кратчайшими путями между всеми парами"""
+
+    def __init__(self, locations: Iterable[dict], routes: Iterable[dict], home: Optional[Tuple[str, str]] = None):
+        """home - (название, специализация) стартовой локации"""
+        self.locations: List[MapLocation] = []
+        self._by_key: Dict[str, MapLocation] = {}
+        for row in locations:
+            location = MapLocation(len(self.locations), row['name'], row['spec'])
+            self.locations.append(location)
+            self._by_key[row['key']] = location
+        if home is not None and location_key(home[0]) not in self._by_key:
+            location = MapLocation(len(self.locations), *home)
+            self.locations.append(location)
+            self._by_key[location_key(home[0])] = location
+
+        n = len(self.locations)
+        self.edges: List[Dict[int, int]] = [{} for _ in range(n)]
+        for row in routes:
+            a = self._by_key.get(row['a_key'])
+            b = self._by_key.get(row['b_key'])
+            if a is None or b is None:
+                continue
+            self.edges[a.index][b.index] = row['distance']
+            self.edges[b.index][a.index] = row['distance']
+
+        # dist[s][t] и prev[s][t] - предшественник t на кратчайшем пути из s
+        self._dist: List[array] = []
+        self._prev: List[array] = []
+        for source in range(n):
+            dist, prev = self._dijkstra(source)
+            self._dist.append(dist)
+            self._prev.append(prev)
+
+    def _dijkstra(self, source: int):
+        n = len(self.locations)
+        dist = array('d', [UNREACHABLE]) * n
+        prev = array('l', [-1]) * n
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, w in self.edges[u].items():
+                nd = d + w
+                if nd < dist[v]:
+                    dist[v] = nd
+                    prev[v] = u
+                    heapq.heappush(heap, (nd, v))
+        return dist, prev
+
+    def __len__(self) -> int:
+        return len(self.locations)
+
+    def location(self, name: str) -> Optional[MapLocation]:
+        return self._by_key.get(location_key(name))
+
+    def route(self, start: str, end: str) -> Optional[Route]:
+        """Кратчайший маршрут по названиям; None если локации нет на карте или она недостижима"""
+        a, b = self.location(start), self.location(end)
+        if a is None or b is None or self._dist[a.index][b.index] == UNREACHABLE:
+            return None
+        prev = self._prev[a.index]
+        path = [b.index]
+        while path[-1] != a.index:
+            path.append(prev[path[-1]])
+        path.reverse()
+        legs = [Leg(self.locations[u].name, self.locations[v].name, self.edges[u][v])
+                for u, v in zip(path, path[1:])]
+        return Route(legs, int(self._dist[a.index][b.index]))